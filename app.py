@@ -1,17 +1,24 @@
 import logging
-from flask import Flask
+import threading
+
+import click
+from flask import Flask, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from logging.handlers import RotatingFileHandler
 from flask_cors import CORS
 from sqlalchemy import text
 
 from db.db import load_config
+from db.engine import InstrumentedQueuePool, RoutingSession, pool_metrics
 
 
 def create_app(env):
     app = Flask(__name__)
     config = load_config(env)
     app.config.update(config)
+    # 连接池统计取连接的等待时间,见 GET /db/pool_metrics
+    for engine_options in [app.config['SQLALCHEMY_ENGINE_OPTIONS'], *app.config['SQLALCHEMY_BINDS'].values()]:
+        engine_options.setdefault('poolclass', InstrumentedQueuePool)
 
     if not app.debug and not app.testing:
         handler = RotatingFileHandler(app.config['LOGGING_FILE'], maxBytes=10000, backupCount=1)
@@ -24,25 +31,99 @@ def create_app(env):
 
 env = 'development'
 app = create_app(env)
-db = SQLAlchemy(app)
+# GET 请求的只读查询在配置了只读副本时路由到副本
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 
 # 注册蓝图
 from controllers.user_controller import auth_bp
 from controllers.picture_controller import picture_bp
 from controllers.record_controller import records_bp
 from controllers.favorite_controller import favorite_bp
+from controllers.job_controller import jobs_bp
 
 app.register_blueprint(auth_bp)
 app.register_blueprint(picture_bp)
 app.register_blueprint(records_bp)
 app.register_blueprint(favorite_bp)
+app.register_blueprint(jobs_bp)
 
 # 允许跨域请求
 CORS(app)
 
-# 创建所有数据库表（在应用程序上下文中）
-with app.app_context():
-    db.create_all()
+def create_tables():
+    """
+    创建数据库表,导入本模块的每个进程 (包括命令行命令) 都会执行
+    """
+    # 创建所有数据库表（在应用程序上下文中）
+    with app.app_context():
+        db.create_all()
+
+
+# 图库建索引的解码进程以 spawn 方式启动,python app.py 运行时这些子进程会以 __mp_main__ 的名字重新导入本模块,
+# 它们只负责解码图片,不能建表
+if __name__ != '__mp_main__':
+    create_tables()
+
+
+_background_services_lock = threading.Lock()
+_background_services_started = False
+
+
+@app.before_request
+def start_background_services():
+    """
+    收到第一个请求时预加载模型,并启动后台任务 worker 和搜索历史写入线程
+
+    只有实际处理请求的进程才会启动这些线程,flask run --reload 的监视进程、flask reindex 等命令行命令不会
+    """
+    global _background_services_started
+    if _background_services_started:
+        return
+    with _background_services_lock:
+        if _background_services_started:
+            return
+        _background_services_started = True
+
+        # 在后台线程中预加载模型和鱼类向量,尽量不让首个图片搜索请求承担初始化开销
+        if app.config['MODEL_WARMUP']:
+            threading.Thread(target=warmup, name='model-warmup', daemon=True).start()
+
+        # 启动后台任务 worker,审核通过后的建索引等工作在这里执行
+        if app.config['JOB_WORKERS'] > 0:
+            import service.job_handlers  # noqa: F401  注册任务处理函数
+            from service.job_queue import JobQueue
+            JobQueue.get_instance().start(
+                app,
+                workers=app.config['JOB_WORKERS'],
+                poll_interval=app.config['JOB_POLL_INTERVAL'],
+                lease_seconds=app.config['JOB_LEASE_SECONDS'],
+                retry_backoff=app.config['JOB_RETRY_BACKOFF'],
+                max_attempts=app.config['JOB_MAX_ATTEMPTS'],
+            )
+
+        # 启动搜索历史的异步批量写入线程,搜索请求不再同步写库
+        if app.config['SEARCH_HISTORY_ASYNC']:
+            from service.search_history import SearchHistoryWriter
+            SearchHistoryWriter.get_instance().start(
+                app,
+                buffer_size=app.config['SEARCH_HISTORY_BUFFER_SIZE'],
+                batch_size=app.config['SEARCH_HISTORY_BATCH_SIZE'],
+                flush_interval=app.config['SEARCH_HISTORY_FLUSH_INTERVAL'],
+                full_policy=app.config['SEARCH_HISTORY_FULL_POLICY'],
+                block_timeout=app.config['SEARCH_HISTORY_BLOCK_TIMEOUT'],
+            )
+
+
+def warmup():
+    with app.app_context():
+        from service.fish_service import FishService
+        FishService.get_instance().warmup()
+
+
+# 统计每个请求的 SQL 语句数和数据库耗时
+if app.config['SQL_PROFILER']:
+    from utils.sql_profiler import install_sql_profiler
+    install_sql_profiler(app)
 
 
 @app.route('/')
@@ -53,5 +134,93 @@ def test_db_connection():
     except Exception as e:
         return f'Database connection failed: {str(e)}'
 
+
+@app.route('/db/pool_metrics')
+def db_pool_metrics():
+    """
+    主库和只读副本连接池的使用情况:池大小、已借出和空闲的连接数、溢出连接数、取连接的次数、超时次数和等待时间
+    """
+    return jsonify({'message': 'Pool metrics', 'success': True, 'pools': pool_metrics(db.engines)}), 200
+
+@app.cli.command('reindex')
+@click.option('--full', is_flag=True, help='重新计算所有 Fish 的向量,而不仅是缺失或过期的')
+def reindex_command(full):
+    """
+    在 Web 进程之外为整个 Fish 表重建图片向量存储
+    """
+    from service.fish_service import FishService
+
+    def progress(done, failed, total):
+        click.echo(f'\rEmbedded {done}/{total}, failed {failed}', nl=False)
+
+    total, failures = FishService.reindex(full=full, progress=progress)
+    click.echo()
+    for fish_id, image_url, error in failures:
+        click.echo(f'Failed to embed fish {fish_id} ({image_url}): {error}', err=True)
+    click.echo(f'Reindexed {total - len(failures)} of {total} fish')
+
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """
+    创建新表,为已存在的表补建模型中新增的列和索引,并从 Fish.tags 回填 fish_tag 关联
+    """
+    from db.migrations import ensure_columns, ensure_indexes, remove_duplicate_favorites
+    from service.tag_search import backfill_fish_tags
+
+    db.create_all()
+    for name in ensure_columns(db):
+        click.echo(f'Added column {name}')
+    click.echo(f'Removed {remove_duplicate_favorites(db)} duplicate favorites')
+    created = ensure_indexes(db)
+    for name in created:
+        click.echo(f'Created index {name}')
+    click.echo(f'Created {len(created)} indexes')
+    click.echo(f'Backfilled tags of {backfill_fish_tags()} fish')
+
+
+@app.cli.command('rebuild-search-stats')
+def rebuild_search_stats_command():
+    """
+    从 search_history 重新累加热门搜索的按天聚合表,首次部署聚合表后执行一次
+    """
+    from service.search_history import rebuild_search_stats
+
+    total = rebuild_search_stats()
+    db.session.commit()
+    click.echo(f'Aggregated {total} searches')
+
+
+@app.cli.command('check-backend')
+@click.argument('backend')
+@click.option('--top-k', default=5, show_default=True, help='比较的 top-k 数量')
+def check_backend_command(backend, top_k):
+    """
+    在 dataset/ 和 uploads/ 的样本图片上比较推理后端与 eager 模式的向量和 top-k 结果
+    """
+    from service.fish_service import FishService
+
+    report, skipped = FishService.check_backend(backend, top_k=top_k)
+    for path, error in skipped:
+        click.echo(f'Skipped {path}: {error}', err=True)
+    for key, value in report.items():
+        click.echo(f'{key}: {value:.6f}')
+
+
+@app.cli.command('benchmark-preprocessing')
+@click.argument('paths', nargs=-1)
+@click.option('--repeat', default=10, show_default=True, help='每张图片重复的次数')
+def benchmark_preprocessing_command(paths, repeat):
+    """
+    对比原始流水线和快速预处理的耗时,默认使用 dataset/ 和 uploads/ 中的样本图片
+    """
+    from service.fish_service import FishService
+    from service.preprocessing import benchmark
+
+    paths = list(paths) or FishService.sample_image_paths(app.config.get('MODEL_SAMPLE_DIRS', ['dataset', 'uploads']))
+    for key, value in benchmark(paths, repeat=repeat).items():
+        click.echo(f'{key}: {value:.3f}')
+
+
 if __name__ == '__main__':
     app.run()
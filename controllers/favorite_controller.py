@@ -1,8 +1,10 @@
 from datetime import datetime, timezone
 
 from flask import Blueprint, request, jsonify
+from sqlalchemy.exc import IntegrityError
 from model import Favorite, Fish, User, FishType
 from app import db
+from utils.sql_profiler import sql_budget
 
 favorite_bp = Blueprint('favorite', __name__, url_prefix='/favorites')
 
@@ -10,6 +12,7 @@ favorite_bp = Blueprint('favorite', __name__, url_prefix='/favorites')
 
 
 @favorite_bp.route('/', methods=['GET'])
+@sql_budget(1)
 def get_user_favorites():
     """
     获取指定用户的收藏夹列表。
@@ -68,6 +71,7 @@ def get_user_favorites():
 
 
 @favorite_bp.route('/', methods=['POST'])
+@sql_budget(1)
 def add_to_favorites():
     """
     将指定的鱼类添加到用户的收藏夹。
@@ -88,27 +92,34 @@ def add_to_favorites():
         user_id = data.get('user_id')
         fish_id = data.get('fish_id')
 
-        # 检查是否已经收藏过该鱼类
-        existing_favorite = Favorite.query.filter_by(user_id=user_id, fish_id=fish_id).first()
-        if existing_favorite:
+        # 直接插入,由 (user_id, fish_id) 唯一索引判断是否已经收藏过,不再先查询一次
+        new_favorite = Favorite(user_id=user_id, fish_id=fish_id,
+                                created_at=datetime.now(timezone.utc))
+        db.session.add(new_favorite)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            # 外键不存在同样是 IntegrityError,只有确实已经收藏过时才返回 423
+            if Favorite.query.filter_by(user_id=user_id, fish_id=fish_id).first() is None:
+                raise
             return jsonify({
                 'message': 'Fish already in favorites',
                 'success': False
             }), 423
 
-        # 创建新的收藏夹项目
-        new_favorite = Favorite(user_id=user_id, fish_id=fish_id,
-                                created_at=datetime.now(timezone.utc))
-        db.session.add(new_favorite)
+        # 在提交之前序列化,避免提交后对象过期、读取属性时再查询一次
+        favorite_info = new_favorite.to_dict()
         db.session.commit()
 
         return jsonify({
             'message': 'Fish added to favorites',
             'success': True,
-            'favorite_info': new_favorite.to_dict()
+            'favorite_info': favorite_info
         }), 200
 
     except Exception as e:
+        db.session.rollback()
         return jsonify({
             'message': f'Error: {e}',
             'success': False
@@ -116,6 +127,7 @@ def add_to_favorites():
 
 
 @favorite_bp.route('/favorite', methods=['DELETE'])
+@sql_budget(1)
 def remove_from_favorites():
     """
     从用户的收藏夹中删除指定的项目。
@@ -134,18 +146,15 @@ def remove_from_favorites():
         favorite_id = request.args.get('favorite_id')
         # favorite_id = data.get('favorite_id')
 
-        # 查找要删除的收藏夹项目
-        favorite = Favorite.query.filter_by(id=favorite_id).first()
-        if not favorite:
+        # 直接删除收藏夹项目,按影响的行数判断是否存在
+        deleted = Favorite.query.filter_by(id=favorite_id).delete(synchronize_session=False)
+        db.session.commit()
+        if not deleted:
             return jsonify({
                 'message': 'Favorite not found',
                 'success': False
             }), 404
 
-        # 删除收藏夹项目
-        db.session.delete(favorite)
-        db.session.commit()
-
         return jsonify({
             'message': 'Favorite removed successfully',
             'success': True
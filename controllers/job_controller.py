@@ -0,0 +1,83 @@
+from flask import Blueprint, jsonify, request, session
+from sqlalchemy import func
+
+from app import db
+from db.engine import use_primary
+from model import Job
+from service.job_queue import JobQueue
+
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/jobs')
+
+
+@jobs_bp.before_request
+def require_admin():
+    # 任务状态只对管理员开放 (role: 0 普通用户, 1 管理员)
+    if session.get('role') != 1:
+        return jsonify({'message': 'Admin only', 'success': False}), 403
+
+
+@jobs_bp.route('/', methods=['GET'])
+@use_primary
+def get_jobs():
+    """
+    按状态和类型查询后台任务,按创建时间倒序排列
+
+    参数:
+    status (str): 任务状态 (pending / running / succeeded / dead),可选
+    kind (str): 任务类型,可选
+    limit (int): 返回数量,默认 50
+
+    返回:
+    JSON 格式的响应,包含以下字段:
+    - message (str): 状态消息
+    - success (bool): 是否成功
+    - jobs (list): 任务列表
+    - counts (dict): 各状态的任务数量
+    """
+    try:
+        query = Job.query
+        if request.args.get('status'):
+            query = query.filter(Job.status == request.args['status'])
+        if request.args.get('kind'):
+            query = query.filter(Job.kind == request.args['kind'])
+        limit = min(request.args.get('limit', 50, type=int), 500)
+        jobs = query.order_by(Job.id.desc()).limit(limit).all()
+
+        counts = dict(db.session.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
+
+        return jsonify({'message': 'Jobs found', 'success': True, 'jobs': [job.to_dict() for job in jobs],
+                        'counts': counts}), 200
+    except Exception as e:
+        return jsonify({'message': str(e), 'success': False}), 500
+
+
+@jobs_bp.route('/<int:job_id>', methods=['GET'])
+@use_primary
+def get_job(job_id):
+    """
+    查询单个后台任务的状态、执行次数和最近一次错误
+    """
+    job = db.session.get(Job, job_id)
+    if not job:
+        return jsonify({'message': 'Job not found', 'success': False}), 404
+    return jsonify({'message': 'Job found', 'success': True, 'job': job.to_dict()}), 200
+
+
+@jobs_bp.route('/<int:job_id>/retry', methods=['POST'])
+def retry_job(job_id):
+    """
+    将进入死信状态的任务重新排队
+    """
+    try:
+        job = db.session.get(Job, job_id)
+        if not job:
+            return jsonify({'message': 'Job not found', 'success': False}), 404
+        if job.status != Job.DEAD:
+            return jsonify({'message': f'Job is {job.status}, only dead jobs can be retried', 'success': False}), 400
+
+        JobQueue.get_instance().retry(job)
+        db.session.commit()
+        return jsonify({'message': 'Job requeued', 'success': True, 'job': job.to_dict()}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': str(e), 'success': False}), 500
@@ -5,20 +5,27 @@ import numpy as np
 
 import sqlalchemy
 from flask import Blueprint, request, jsonify, current_app, session
-from sqlalchemy import func
-from sqlalchemy.sql.operators import or_
 from werkzeug.utils import secure_filename
-from model import Record, FishType, Fish, SearchHistory
+from model import Record, FishType, Fish
 from model import User
 from app import db
 from service.fish_service import FishService
+from service import tag_search
+from service.name_index import FishTypeNameIndex
+from service.response_cache import FISH, FISH_TYPES, ResponseCache
+from service.job_queue import JobQueue
+from service.search_history import SearchHistoryWriter
 from utils.OSSClient import OSSClient
+from utils.pagination import row_to_dict
+from utils.sql_profiler import sql_budget
+from utils.streaming import render_rows, stream_rows
 
 picture_bp = Blueprint('picture', __name__, url_prefix='/pictures')
 
 
 # 需要数据为：user_id image（文件） fish_name_latin tags
 @picture_bp.route('/upload', methods=['POST'])
+@sql_budget(4)  # 确认用户存在、插入记录、(异步上传时) 插入上传任务,名称索引过期重建时多一次
 def upload_picture():
     # 获取 OSS 客户端实例
     oss_client = OSSClient.get_instance()
@@ -34,8 +41,8 @@ def upload_picture():
     if not user_id:
         return jsonify({'message': 'User not logged in', 'success': False}), 401
 
-    user = User.query.get(user_id)
-    if not user:
+    # 只确认用户存在,不读取整行
+    if db.session.query(User.id).filter_by(id=user_id).first() is None:
         return jsonify({'message': 'User not found', 'success': False}), 404
 
     file = request.files.get('image')
@@ -46,32 +53,37 @@ def upload_picture():
     if not fish_name_latin:
         return jsonify({'message': 'Fish Latin name is required', 'success': False}), 400
 
-    # 先根据 name_cn 进行模糊查找
-    fish_type = FishType.query.filter(or_(
-        func.lower(FishType.name_cn).contains(func.lower(fish_name_latin)),
-        func.lower(FishType.name_latin).contains(func.lower(fish_name_latin))
-    )).first()
+    # 在进程内的名称索引中查找中文名、拉丁名或拼音包含该名称的 FishType,不查询数据库
+    fish_type_id = FishTypeNameIndex.get_instance().resolve(fish_name_latin)
 
     # 如果没有找到,返回错误信息
-    if not fish_type:
+    if fish_type_id is None:
         return jsonify({'message': 'Fish type not found', 'success': False}), 404
 
     tags = data_json.get('tags')
 
     # 获取图片
     filename = secure_filename(file.filename)
+    async_upload = current_app.config.get('UPLOAD_ASYNC', False)
 
-    # 上传文件到 OSS
+    # 上传文件到 OSS: 从请求的文件流中逐块读取,大文件分片并行上传,不把整个文件读入内存
+    local_path = None
     try:
-        image_url = oss_client.upload_file(filename, file.read())
+        if async_upload:
+            # 先暂存到本地,立即返回 uploading 状态的记录,由后台任务断点续传到 OSS
+            local_path = _stage_upload(file, filename)
+            image_url = oss_client.get_image_url(filename)
+        else:
+            image_url = oss_client.upload_stream(filename, file.stream, _stream_size(file.stream))
     except Exception as e:
         return jsonify({'message': str(e), 'success': False}), 500
 
     # 创建新的 Record 记录
     new_record = Record(
-        user_id=user.id,
+        user_id=user_id,
         image_url=image_url,
-        fish_type_id=fish_type.id,
+        upload_status=Record.UPLOADING if async_upload else Record.UPLOADED,
+        fish_type_id=fish_type_id,
         tags=tags,
         created_at=datetime.now(UTC),
         feedback=None,
@@ -80,12 +92,51 @@ def upload_picture():
 
     try:
         db.session.add(new_record)
+        db.session.flush()
+        job_id = None
+        if async_upload:
+            # 上传任务与记录在同一个事务中提交
+            job = JobQueue.get_instance().enqueue('upload_picture', {
+                'record_id': new_record.id, 'file_path': filename, 'local_path': local_path})
+            db.session.flush()
+            job_id = job.id
+        # 在提交之前序列化,避免提交后对象过期、读取属性时再查询一次
+        record_info = new_record.to_dict()
         db.session.commit()
     except sqlalchemy.exc.SQLAlchemyError as e:
         db.session.rollback()
+        if local_path:
+            os.remove(local_path)
         return jsonify({'message': 'Error saving record to database', 'success': False}), 500
 
-    return jsonify({'message': 'Picture uploaded successfully', 'record': new_record.to_dict(), 'success': True}), 200
+    if async_upload:
+        return jsonify({'message': 'Picture upload accepted', 'record': record_info, 'job_id': job_id,
+                        'success': True}), 202
+    return jsonify({'message': 'Picture uploaded successfully', 'record': record_info, 'success': True}), 200
+
+
+def _stream_size(stream):
+    """
+    上传文件的大小 (字节),文件流不支持 seek 时返回 None
+    """
+    try:
+        position = stream.tell()
+        size = stream.seek(0, os.SEEK_END) - position
+        stream.seek(position)
+        return size
+    except (AttributeError, OSError):
+        return None
+
+
+def _stage_upload(file, filename):
+    """
+    把上传的文件逐块复制到暂存目录,返回暂存文件的绝对路径
+    """
+    staging_dir = current_app.config.get('UPLOAD_STAGING_DIR', 'uploads/staging')
+    os.makedirs(staging_dir, exist_ok=True)
+    local_path = os.path.abspath(os.path.join(staging_dir, f'{os.urandom(8).hex()}_{filename}'))
+    file.save(local_path)
+    return local_path
 
 
 @picture_bp.route('/fish_type', methods=['GET'])
@@ -96,19 +147,53 @@ def get_fishtypes():
     JSON 格式的响应,包含以下字段:
     - message (str): 状态消息
     - success (bool): 是否成功
-    - fish_types (list): FishType 对象列表
+    - fish_types (list): FishType 对象列表,请求参数 format=ndjson 时每行一条记录
+    响应带有 ETag,请求的 If-None-Match 与之相同时返回 304
     """
     try:
-        # 查询所有的 FishType 记录
-        fish_types = FishType.query.all()
+        # FishType 表很少变化,响应由缓存返回,add_fish_type / edit_fishtype 之后失效;
+        # 缓存的响应体一次性生成,不启用缓存时才以流的形式返回
+        cache = ResponseCache.get_instance()
+        if cache.enabled:
+            return cache.serve((FISH_TYPES,), lambda: _list_fishtypes(stream=False))
+        return _list_fishtypes(stream=True)
+
+    except Exception as e:
+        return jsonify({'message': f'Error: {e}', 'success': False, 'fish_types': []}), 500
 
-        # 将 FishType 对象转换为 JSON 格式
-        data = [fish_type.to_dict() for fish_type in fish_types]
 
-        return jsonify({'message': 'FishType list retrieved successfully', 'success': True, 'fish_types': data}), 200
+def _list_fishtypes(stream):
+    # 查询所有的 FishType 记录,流式返回时从服务端游标逐批读取
+    columns = FishType.__table__.columns
+    fish_types = db.session.query(*columns).order_by(FishType.id)
+    fields = [column.key for column in columns]
+
+    render = stream_rows if stream else render_rows
+    return render(fish_types, lambda row: row_to_dict(row, fields), 'fish_types',
+                  'FishType list retrieved successfully')
+
+
+@picture_bp.route('/fish_type/autocomplete', methods=['GET'])
+def autocomplete_fishtypes():
+    """
+    输入 FishType 名称时的自动补全,只查询进程内的名称索引
 
+    参数:
+    q (str): 中文名、拉丁名或拼音的前缀 (也接受子串和少量错别字)
+    limit (int): 返回数量,默认 10,最大 50
+
+    JSON 格式的响应,包含以下字段:
+    - message (str): 状态消息
+    - success (bool): 是否成功
+    - suggestions (list): FishType 的 id、name_cn、name_latin,以及 matched (命中的名称)、match (exact / prefix / substring / fuzzy)
+    """
+    query = request.args.get('q', '')
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    try:
+        suggestions = FishTypeNameIndex.get_instance().search(query, limit=limit)
+        return jsonify({'message': 'Suggestions retrieved', 'success': True, 'suggestions': suggestions}), 200
     except Exception as e:
-        return jsonify({'message': f'Error: {e}', 'success': False, 'fish_types': []}), 500
+        return jsonify({'message': f'Error: {e}', 'success': False, 'suggestions': []}), 500
 
 
 @picture_bp.route('/add_fish_type', methods=['POST'])
@@ -136,6 +221,8 @@ def upload_new_fishtype():
         )
         db.session.add(new_fish_type)
         db.session.commit()
+        FishTypeNameIndex.get_instance().rebuild()
+        ResponseCache.get_instance().invalidate(FISH_TYPES)
 
         return jsonify({'message': 'New fish type uploaded successfully', 'success': True,
                         'fish_type': new_fish_type.to_dict()}), 201
@@ -165,6 +252,8 @@ def edit_fishtype():
         fish_type.description = description
 
         db.session.commit()
+        FishTypeNameIndex.get_instance().rebuild()
+        ResponseCache.get_instance().invalidate(FISH_TYPES)
 
         return jsonify(
             {'message': 'Fish type updated successfully', 'success': True, 'fish_type': fish_type.to_dict()}), 200
@@ -176,15 +265,16 @@ def edit_fishtype():
 @picture_bp.route('/name_search', methods=['GET'])
 def get_fish_by_fish_type_name():
     """
-    根据 FishType 的 name_cn 或 name_latin 精确匹配对应的 Fish 列表
+    根据 FishType 的 name_cn、name_latin 或拼音查找对应的 Fish 列表,依次尝试精确、前缀、子串匹配,都没有时容忍少量错别字
 
     参数:
-    name (str): FishType 的中文名或拉丁名
+    name (str): FishType 的中文名、拉丁名或拼音
 
     JSON 格式的响应,包含以下字段:
     - message (str): 状态消息
     - success (bool): 是否成功
     - fish_list (list): 匹配的 Fish 对象列表
+    响应带有 ETag,请求的 If-None-Match 与之相同时返回 304
     """
     # 从路径参数中获取 name
     name = request.args.get('name')
@@ -195,96 +285,108 @@ def get_fish_by_fish_type_name():
         return jsonify({'message': 'no name', 'success': False}), 401
 
     try:
-        with db.session.begin():
-            # 先根据 name_cn 进行模糊查找
-            fish_type = FishType.query.filter(func.lower(FishType.name_cn).contains(func.lower(name))).first()
+        # 相同的 name 和 count 直接由响应缓存返回,Fish 或 FishType 有变化后失效
+        response = ResponseCache.get_instance().serve(
+            (FISH_TYPES, FISH), lambda: _find_fish_by_fish_type_name(name, count),
+            params={'name': name, 'count': count})
 
-            # 如果没有找到,则根据 name_latin 进行模糊查找
-            if not fish_type:
-                fish_type = FishType.query.filter(func.lower(FishType.name_latin).contains(func.lower(name))).first()
+        if response.status_code in (200, 304):
+            # 记录搜索历史,缓存命中时同样记录
+            SearchHistoryWriter.get_instance().record(user_id, 1, name)  # 0: image, 1: name, 2: tags
+            db.session.commit()
+        return response
 
-            # 如果 FishType 不存在,返回一个包含错误信息的 JSON 响应
-            if not fish_type:
-                return jsonify(
-                    {'message': f'No FishType found for name: {name}', 'success': False, 'fish_list': []}), 404
+    except Exception as e:
+        # 处理异常情况
+        db.session.rollback()
+        return jsonify({'message': f'Error: {e}', 'success': False, 'fish_list': []}), 500
 
-            # 根据 fish_type_id 查找关联的 Fish 列表
-            fish_list = Fish.query.filter_by(fish_type_id=fish_type.id).limit(count).all()
 
-            # 将 Fish 对象转换为 JSON 格式,并添加 FishType 的名称信息
-            data = []
-            for fish in fish_list:
-                fish_dict = fish.to_dict()
-                fish_dict['name_cn'] = fish_type.name_cn
-                fish_dict['name_latin'] = fish_type.name_latin
-                data.append(fish_dict)
+def _find_fish_by_fish_type_name(name, count):
+    with db.session.begin():
+        # 在进程内的名称索引中查找 FishType,不再对 fish_type 表做两次 LIKE 全表扫描
+        matches = FishTypeNameIndex.get_instance().search(name, limit=1)
 
-            # 记录搜索历史
-            search_history = SearchHistory(
-                user_id=user_id,  # 当前用户 ID
-                search_method=1,  # 0: image, 1: name, 2: tags
-                search_content=name
-            )
-            db.session.add(search_history)
+        # 如果 FishType 不存在,返回一个包含错误信息的 JSON 响应
+        if not matches:
+            return jsonify(
+                {'message': f'No FishType found for name: {name}', 'success': False, 'fish_list': []}), 404
+        fish_type = matches[0]
 
-        return jsonify({'message': 'Fish list found', 'success': True, 'fish_list': data}), 200
+        # 根据 fish_type_id 查找关联的 Fish 列表
+        fish_list = Fish.query.filter_by(fish_type_id=fish_type['id']).limit(count).all()
 
-    except Exception as e:
-        # 处理异常情况
-        db.session.rollback()
-        return jsonify({'message': f'Error: {e}', 'success': False, 'fish_list': []}), 500
+        # 将 Fish 对象转换为 JSON 格式,并添加 FishType 的名称信息
+        data = []
+        for fish in fish_list:
+            fish_dict = fish.to_dict()
+            fish_dict['name_cn'] = fish_type['name_cn']
+            fish_dict['name_latin'] = fish_type['name_latin']
+            data.append(fish_dict)
+
+    return jsonify({'message': 'Fish list found', 'success': True, 'fish_list': data}), 200
 
 
 @picture_bp.route('/keyword_search', methods=['GET'])
 def get_fish_by_keyword():
     """
-    根据关键词搜索 Fish 列表
+    根据标签搜索 Fish 列表,结果按命中的标签数量倒序排列
 
     参数:
-    keyword (str): 搜索关键词
+    keyword (str): 搜索关键词,多个标签用逗号分隔
+    match (str): exact 精确匹配标签,prefix 匹配以关键词开头的标签,默认 prefix
+    operator (str): or 命中任一标签即返回,and 要求命中全部标签,默认 or
+    count (int): 返回数量
 
     返回:
     JSON 格式的响应,包含以下字段:
     - message (str): 状态消息
     - success (bool): 是否成功
-    - fish_list (list): 匹配的 Fish 对象列表
+    - fish_list (list): 匹配的 Fish 对象列表,matched 为命中的标签数量
     """
 
     # 从路径参数中获取 name
     keyword = request.args.get('keyword')
-    count = request.args.get('count')
+    count = request.args.get('count', type=int)
     user_id = request.args.get('user_id')
-    if not keyword:
+    match = request.args.get('match', tag_search.MATCH_PREFIX)
+    operator = request.args.get('operator', tag_search.OPERATOR_OR).lower()
+    terms = tag_search.parse_tags(keyword)
+    if not terms:
         return jsonify({'message': 'no keyword', 'success': False}), 401
+    if match not in tag_search.MATCH_MODES or operator not in tag_search.OPERATORS:
+        return jsonify({'message': f'Invalid match or operator: {match}, {operator}', 'success': False,
+                        'fish_list': []}), 400
 
     try:
         with db.session.begin():
-            # 根据关键词搜索 Fish 列表,并联查 FishType 表获取中文名和拉丁名
-            fish_list = db.session.query(
+            # 在 tag / fish_tag 索引上找出命中的 Fish 及命中数量,再按 id 取出 Fish 并联查 FishType 表获取中文名和拉丁名
+            ranked = tag_search.search_fish_ids(terms, match=match, operator=operator, limit=count)
+            rows = db.session.query(
                 Fish,
                 FishType.name_cn,
                 FishType.name_latin
             ).join(
                 FishType, Fish.fish_type_id == FishType.id
             ).filter(
-                func.lower(Fish.tags).contains(func.lower(keyword))
-            ).limit(count).all()
+                Fish.id.in_([fish_id for fish_id, _ in ranked])
+            ).all() if ranked else []
+            fish_by_id = {fish.id: (fish, name_cn, name_latin) for fish, name_cn, name_latin in rows}
 
-            # 将查询结果转换为 JSON 格式
+            # 将查询结果转换为 JSON 格式,保持排序
             data = []
-            for fish, name_cn, name_latin in fish_list:
+            for fish_id, matched in ranked:
+                if fish_id not in fish_by_id:
+                    continue
+                fish, name_cn, name_latin = fish_by_id[fish_id]
                 fish_dict = fish.to_dict()
                 fish_dict['name_cn'] = name_cn
                 fish_dict['name_latin'] = name_latin
+                fish_dict['matched'] = matched
                 data.append(fish_dict)
 
             # 记录搜索历史
-            search_history = SearchHistory(
-                user_id=user_id,  # 当前用户 ID
-                search_method=2,  # 0: image, 1: name, 2: tags
-                search_content=keyword
-            )
-            db.session.add(search_history)
+            SearchHistoryWriter.get_instance().record(user_id, 2, keyword)  # 0: image, 1: name, 2: tags
 
         return jsonify({'message': 'Fish list found', 'success': True, 'fish_list': data}), 200
 
@@ -307,26 +409,17 @@ def get_fish_by_picture():
     if not file:
         return jsonify({'message': 'No image file uploaded', 'success': False}), 400
 
-    # 获取图片
-    filename = secure_filename(file.filename)
-    file.save(os.path.join('uploads', filename))
-    image_path = os.path.join('uploads', filename)
-
     # 获取 fish_service 的单例实例
     fish_service = FishService.get_instance()
 
-    input_vector = fish_service.extract_image_features(image_path)
+    # 直接从上传的文件流中解码图片,不再保存到 uploads/ 目录
+    input_vector = fish_service.extract_image_features(file.stream)
 
-    # 计算top-k相似度
+    # 计算top-k相似度,结果已按相似度从高到低排列
     top_k_fish = fish_service.find_top_k_similar_fish(input_vector, top_k=count)
 
     # 记录搜索历史
-    search_history = SearchHistory(
-        user_id=user_id,  # 当前用户 ID
-        search_method=0,  # 0: image, 1: name, 2: tags
-        search_content="图片搜索"
-    )
-    db.session.add(search_history)
+    SearchHistoryWriter.get_instance().record(user_id, 0, "图片搜索")  # 0: image, 1: name, 2: tags
     db.session.commit()
 
     fish_res = {
@@ -370,11 +463,39 @@ def get_fish_by_picture():
         }
         fish_res_list.append(fish_res)
 
-    fish_res_list.reverse()
-
     # 获取返回值
     return jsonify({
         'message': 'Top K similar fish found',
         'success': True,
         'fish_list': fish_res_list
     })
+
+
+@picture_bp.route('/inference_metrics', methods=['GET'])
+def get_inference_metrics():
+    """
+    获取图片搜索微批量推理调度器的运行指标
+
+    JSON 格式的响应,包含以下字段:
+    - message (str): 状态消息
+    - success (bool): 是否成功
+    - metrics (dict): 队列深度、批次数、平均批大小和批大小分布,未开启微批量推理时为空
+    """
+    scheduler = FishService.get_instance().inference_scheduler
+    metrics = scheduler.metrics() if scheduler is not None else {}
+    return jsonify({'message': 'Inference metrics retrieved', 'success': True, 'metrics': metrics}), 200
+
+
+@picture_bp.route('/cache_metrics', methods=['GET'])
+def get_cache_metrics():
+    """
+    获取图片搜索查询向量缓存、top-k 结果缓存和只读接口响应缓存的命中统计
+
+    JSON 格式的响应,包含以下字段:
+    - message (str): 状态消息
+    - success (bool): 是否成功
+    - metrics (dict): embedding / result / response 三个缓存的命中数、未命中数、命中率、条目数和占用字节数,未启用的缓存为空
+    """
+    metrics = FishService.get_instance().cache_metrics()
+    metrics['response'] = ResponseCache.get_instance().stats()
+    return jsonify({'message': 'Cache metrics retrieved', 'success': True, 'metrics': metrics}), 200
@@ -5,51 +5,90 @@ from sqlalchemy.exc import SQLAlchemyError
 
 from app import db
 from model import Record, Fish, SearchHistory
+from service.job_queue import JobQueue
+from service.response_cache import FISH, ResponseCache
+from service.search_history import SearchHistoryWriter, top_queries
+from service.tag_search import set_fish_tags
+from utils.pagination import PaginationError, keyset_page, keyset_query, parse_datetime, parse_fields, parse_limit, \
+    row_to_dict
+from utils.sql_profiler import sql_budget
+from utils.streaming import stream_rows, wants_stream
 from datetime import datetime, timezone
 
 records_bp = Blueprint('records', __name__, url_prefix='/record')
 
 
+# 可以通过 fields 参数投影的字段,与 Record.to_dict 一致
+RECORD_FIELDS = ('id', 'user_id', 'image_url', 'upload_status', 'fish_type_id', 'tags', 'is_approved', 'reviewed_by',
+                 'reviewed_at', 'feedback', 'created_at')
+
+
+def list_records(status=None):
+    """
+    按 (created_at, id) 倒序键集分页查询 Record,只从数据库中读取请求的字段
+
+    请求参数:
+    limit (int): 每页数量,默认 50,最大 500
+    cursor (str): 上一页返回的 next_cursor
+    fields (str): 逗号分隔的字段列表,默认全部字段
+    status (str): pending / approved / rejected,可选
+    created_from / created_to (str): ISO 8601 格式的创建时间范围,可选
+    stream (bool) / format=ndjson: 不分页,从游标位置开始以流的形式返回全部结果
+
+    参数:
+    status (str): 固定的状态过滤条件,为空时使用请求中的 status 参数
+    """
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        fields = parse_fields(request.args.get('fields'), RECORD_FIELDS)
+        status = status or request.args.get('status')
+        created_from = parse_datetime(request.args.get('created_from'), 'created_from')
+        created_to = parse_datetime(request.args.get('created_to'), 'created_to')
+
+        # 分页游标需要 created_at 和 id,即使没有请求这两个字段也要查询
+        columns = [getattr(Record, field) for field in dict.fromkeys([*fields, 'created_at', 'id'])]
+        query = db.session.query(*columns)
+
+        if status == 'pending':
+            query = query.filter(Record.reviewed_at.is_(None))
+        elif status in ('approved', 'rejected'):
+            query = query.filter(Record.is_approved.is_(status == 'approved'), Record.reviewed_at.isnot(None))
+        elif status:
+            raise PaginationError(f'Invalid status: {status}')
+        if created_from:
+            query = query.filter(Record.created_at >= created_from)
+        if created_to:
+            query = query.filter(Record.created_at < created_to)
+
+        if wants_stream():
+            # 导出全部记录时逐批读取、逐块写出,内存占用不随记录数增长;只有显式指定 limit 时才限制行数
+            query = keyset_query(query, Record.created_at, Record.id, request.args.get('cursor'))
+            if request.args.get('limit'):
+                query = query.limit(limit)
+            return stream_rows(query, lambda row: row_to_dict(row, fields), 'records', 'Records found')
+
+        rows, next_cursor = keyset_page(query, Record.created_at, Record.id, limit, request.args.get('cursor'))
+
+        return jsonify({'message': 'Records found', 'success': True,
+                        'records': [row_to_dict(row, fields) for row in rows], 'next_cursor': next_cursor}), 200
+    except PaginationError as e:
+        return jsonify({'message': str(e), 'success': False}), 400
+    except Exception as e:
+        return jsonify({'message': str(e), 'success': False}), 500
+
+
 # 获取所有记录
 @records_bp.route('/records', methods=['GET'])
 def get_all_records():
-    try:
-        # 获取所有 Record 记录,并按照创建时间倒序排列
-        records = Record.query.order_by(Record.created_at.desc()).all()
-
-        # 将 Record 对象转换为 JSON 格式
-        data = []
-        for record in records:
-            record_dict = record.to_dict()
-            # 手动处理 datetime 对象
-            # record_dict['created_at'] = record_dict['created_at'].isoformat()
-            # record_dict['reviewed_at'] = record_dict['reviewed_at'].isoformat()
-            data.append(record_dict)
-
-        return jsonify({'message': 'Records found', 'success': True, 'records': data}), 200
-    except Exception as e:
-        return jsonify({'error': str(e), 'success': False}), 500
+    # 按创建时间倒序分页返回,参数见 list_records
+    return list_records()
 
 
 # 获取所有待审核的记录
 @records_bp.route('/records/pending', methods=['GET'])
 def get_pending_records():
-    try:
-        # 获取所有 is_approved 字段为 False 的 Record 记录,并按照创建时间倒序排列
-        pending_records = Record.query.filter_by(reviewed_at=None).order_by(Record.created_at.desc()).all()
-
-        # 将 Record 对象转换为 JSON 格式
-        data = []
-        for record in pending_records:
-            record_dict = record.to_dict()
-            # 手动处理 datetime 对象
-            # record_dict['created_at'] = record_dict['created_at'].isoformat()
-            # record_dict['reviewed_at'] = record_dict['reviewed_at'].isoformat()
-            data.append(record_dict)
-
-        return jsonify({'message': 'Records found', 'success': True, 'records': data}), 200
-    except Exception as e:
-        return jsonify({'message': str(e), 'success': False}), 500
+    # 获取所有尚未审核 (reviewed_at 为空) 的 Record 记录,按创建时间倒序分页返回
+    return list_records(status='pending')
 
 
 @contextmanager
@@ -78,6 +117,10 @@ def approve_record():
         if not record:
             return jsonify({'message': 'Record not found', 'success': False}), 404
 
+        # 异步上传的图片还没有写入 OSS,此时无法计算向量
+        if record.upload_status != Record.UPLOADED:
+            return jsonify({'message': 'Image upload not finished', 'success': False}), 409
+
         # 更新 Record 记录的 is_approved 字段为 True,并更新 feedback、approved_at 和 reviewed_by 字段
         record.is_approved = True
         record.feedback = feedback
@@ -93,9 +136,16 @@ def approve_record():
             created_at=record.created_at
         )
         db.session.add(fish)
+        db.session.flush()
+        set_fish_tags([(fish.id, fish.tags)])
+
+        # 计算向量、写入图库索引放到后台任务中执行,与 Fish 在同一个事务中提交,审核请求立即返回
+        job = JobQueue.get_instance().enqueue('index_fish', {'fish_id': fish.id, 'image_url': fish.image_url})
         db.session.commit()
+        ResponseCache.get_instance().invalidate(FISH)
 
-        return jsonify({'message': 'Approve record success', 'success': True, 'record': record.to_dict()}), 200
+        return jsonify({'message': 'Approve record success', 'success': True, 'record': record.to_dict(),
+                        'job_id': job.id}), 200
 
     except Exception as e:
         db.session.rollback()
@@ -135,6 +185,7 @@ def reject_record():
 
 # 获取用户自己提出的所有请求
 @records_bp.route('/records/user', methods=['POST'])
+@sql_budget(1)
 def get_user_records():
     try:
         data = request.get_json()
@@ -142,17 +193,16 @@ def get_user_records():
         # 获取前端传来的 user_id 数据
         user_id = data.get('id')
 
-        # 根据 user_id 查找该用户提出的所有 Record 记录
-        records = Record.query.filter_by(user_id=user_id).all()
-
-        # 构建要返回的 JSON 数据
-        data = []
-        for record in records:
-            record_dict = record.to_dict()
-            # 手动处理 datetime 对象
-            # record_dict['created_at'] = record_dict['created_at'].isoformat()
-            # record_dict['reviewed_at'] = record_dict['reviewed_at'].isoformat()
-            data.append(record_dict)
+        # 根据 user_id 查找该用户提出的所有 Record 记录,使用 (user_id, created_at) 索引,按提交时间倒序
+        # 只读取列而不构造 ORM 对象,一次查询后直接转换为字典
+        columns = [getattr(Record, field) for field in RECORD_FIELDS]
+        records = (
+            db.session.query(*columns)
+            .filter(Record.user_id == user_id)
+            .order_by(Record.created_at.desc(), Record.id.desc())
+            .all()
+        )
+        data = [row_to_dict(record, RECORD_FIELDS) for record in records]
 
         return jsonify({'message': 'Records found', 'success': True, 'records': data}), 200
     except Exception as e:
@@ -162,35 +212,96 @@ def get_user_records():
 @records_bp.route('/search_history', methods=['GET'])
 def get_user_search_history():
     """
-    获取指定用户的搜索历史记录。
+    获取指定用户的搜索历史记录,按 (search_at, id) 倒序键集分页,使用 (user_id, search_at, id) 复合索引
 
     参数:
     user_id (int): 用户 ID
+    limit (int): 每页数量,默认 50,最大 500
+    cursor (str): 上一页返回的 next_cursor
+    search_method (int): 0: image, 1: name, 2: tags,可选
+    stream (bool): 为 true 时不分页,以流的形式返回从 cursor 开始的全部记录;请求参数 format=ndjson 时每行一条记录
 
     返回:
     JSON 格式的响应,包含以下字段:
     - message (str): 状态消息
     - success (bool): 是否成功
     - search_history (list): 用户搜索历史记录列表
+    - next_cursor (str): 下一页的游标,没有更多数据时为 null
     """
+    user_id = request.args.get('user_id', type=int)
+    if user_id is None:
+        return jsonify({'message': 'user_id is required', 'success': False}), 400
+
     try:
+        columns = SearchHistory.__table__.columns
+        fields = [column.key for column in columns]
+        query = db.session.query(*columns).filter(SearchHistory.user_id == user_id)
+        search_method = request.args.get('search_method', type=int)
+        if search_method is not None:
+            query = query.filter(SearchHistory.search_method == search_method)
+        cursor = request.args.get('cursor')
+
+        if wants_stream():
+            query = keyset_query(query, SearchHistory.search_at, SearchHistory.id, cursor)
+            if request.args.get('limit'):
+                query = query.limit(parse_limit(request.args.get('limit')))
+            return stream_rows(query, lambda row: row_to_dict(row, fields), 'search_history',
+                               'Search history retrieved')
+
+        rows, next_cursor = keyset_page(query, SearchHistory.search_at, SearchHistory.id,
+                                        parse_limit(request.args.get('limit')), cursor)
+        return jsonify({'message': 'Search history retrieved', 'success': True,
+                        'search_history': [row_to_dict(row, fields) for row in rows],
+                        'next_cursor': next_cursor}), 200
+
+    except PaginationError as e:
+        return jsonify({'message': str(e), 'success': False}), 400
+    except Exception as e:
+        return jsonify({
+            'message': f'Error: {e}',
+            'success': False
+        }), 500
 
-        # 获取用户的搜索历史记录
-        search_history = SearchHistory.query.order_by(SearchHistory.search_at.desc()).all()
 
-        # 构建响应数据
-        history_data = []
-        for record in search_history:
-            history_data.append(record.to_dict())
+@records_bp.route('/search_history/top', methods=['GET'])
+def get_top_searches():
+    """
+    最近一段时间内搜索次数最多的查询,读取增量维护的按天聚合表,不扫描搜索历史
 
-        return jsonify({
-            'message': 'Search history retrieved',
-            'success': True,
-            'search_history': history_data
-        }), 200
+    参数:
+    user_id (int): 用户 ID,为空时统计所有用户
+    days (int): 时间窗口的天数 (包含今天),默认 7,最大 366
+    limit (int): 返回数量,默认 10,最大 100
+    search_method (int): 0: image, 1: name, 2: tags,可选
+
+    返回:
+    JSON 格式的响应,包含以下字段:
+    - message (str): 状态消息
+    - success (bool): 是否成功
+    - top_searches (list): 按搜索次数倒序排列的 search_method、search_content、count 和 last_search_at
+    """
+    days = request.args.get('days', 7, type=int)
+    limit = request.args.get('limit', 10, type=int)
+    if not 0 < days <= 366 or limit <= 0:
+        return jsonify({'message': 'Invalid days or limit', 'success': False}), 400
 
+    try:
+        top_searches = top_queries(user_id=request.args.get('user_id', type=int), days=days, limit=min(limit, 100),
+                                   search_method=request.args.get('search_method', type=int))
+        return jsonify({'message': 'Top searches retrieved', 'success': True, 'top_searches': top_searches}), 200
     except Exception as e:
-        return jsonify({
-            'message': f'Error: {e}',
-            'success': False
-        }), 500
\ No newline at end of file
+        return jsonify({'message': f'Error: {e}', 'success': False}), 500
+
+
+@records_bp.route('/search_history/metrics', methods=['GET'])
+def get_search_history_metrics():
+    """
+    获取搜索历史异步写入器的运行指标
+
+    JSON 格式的响应,包含以下字段:
+    - message (str): 状态消息
+    - success (bool): 是否成功
+    - metrics (dict): 队列深度、已接收 / 丢弃 / 写入 / 写入失败的记录数和批次数
+    """
+    metrics = SearchHistoryWriter.get_instance().metrics()
+    return jsonify({'message': 'Search history metrics retrieved', 'success': True, 'metrics': metrics}), 200
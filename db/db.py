@@ -6,16 +6,100 @@ def load_config(env):
         config = json.load(config_file)
 
     db_config = config['database']['mysql']
+    oss_config = config['oss']
+    pool_config = config['database'].get('pool', {})
+
+    model_config = config.get('model', {})
+    indexing_config = config.get('indexing', {})
+    search_config = config.get('search', {})
+    jobs_config = config.get('jobs', {})
+    search_history_config = config.get('search_history', {})
+    response_cache_config = config.get('response_cache', {})
+    sql_profiler_config = config.get('sql_profiler', {})
 
     print(db_config['user'][env])
 
+    def database_uri(host):
+        return f"mysql+pymysql://{db_config['user'][env]}:{db_config['password'][env]}@{host}/{db_config['database'][env]}"
+
+    # 每个线程同时最多占用一个连接: 请求处理线程、后台任务 worker 和搜索历史写入线程
+    pool_size = pool_config.get('size') or \
+        pool_config.get('request_threads', 8) + jobs_config.get('workers', 2) + 1
+    engine_options = {
+        'pool_size': pool_size,
+        'max_overflow': pool_config.get('max_overflow', 10),
+        'pool_timeout': pool_config.get('timeout', 10),
+        'pool_recycle': pool_config.get('recycle', 1800),
+        'pool_pre_ping': pool_config.get('pre_ping', True),
+    }
+    if pool_config.get('isolation_level'):
+        engine_options['isolation_level'] = pool_config['isolation_level']
+
+    replica_host = db_config.get('replica_host', {}).get(env)
+
     return {
         'SECRET_KEY': config['app']['secret_key'],
-        'SQLALCHEMY_DATABASE_URI': f"mysql+pymysql://{db_config['user'][env]}:{db_config['password'][env]}@{db_config['host'][env]}/{db_config['database'][env]}",
+        'SQLALCHEMY_DATABASE_URI': database_uri(db_config['host'][env]),
+        'SQLALCHEMY_ENGINE_OPTIONS': engine_options,
+        # Flask-SQLAlchemy 不会把 SQLALCHEMY_ENGINE_OPTIONS 应用到其他 bind,只读副本使用相同的连接池配置
+        'SQLALCHEMY_BINDS': {'replica': dict(engine_options, url=database_uri(replica_host))} if replica_host else {},
         'ACCESS_KEY_ID': config['oss']['access_key_id'],
         'ACCESS_KEY_SECRET': config['oss']['access_key_secret'],
         'ENDPOINT': config['oss']['endpoint'],
         'BUCKET_NAME': config['oss']['bucket_name'],
+        'OSS_MULTIPART_THRESHOLD_MB': oss_config.get('multipart_threshold_mb', 8),
+        'OSS_PART_SIZE_MB': oss_config.get('part_size_mb', 2),
+        'OSS_UPLOAD_THREADS': oss_config.get('upload_threads', 4),
+        'UPLOAD_ASYNC': oss_config.get('async_upload', False),
+        'UPLOAD_STAGING_DIR': oss_config.get('staging_dir', 'uploads/staging'),
         'LOGGING_LEVEL': config['logging']['level'],
-        'LOGGING_FILE': config['logging']['file']
+        'LOGGING_FILE': config['logging']['file'],
+        'MODEL_CHECKPOINT_PATH': model_config.get('checkpoint_path'),
+        'MODEL_WARMUP': model_config.get('warmup', False),
+        'MODEL_VERSION': model_config.get('version'),
+        'MODEL_BACKEND': model_config.get('backend', 'eager'),
+        'MODEL_FEATURES': model_config.get('features', 'logits'),
+        'MODEL_CHANNELS_LAST': model_config.get('channels_last', False),
+        'MODEL_NUM_THREADS': model_config.get('num_threads'),
+        'MODEL_SAMPLE_DIRS': model_config.get('sample_dirs', ['dataset', 'uploads']),
+        'INFERENCE_BATCHING': model_config.get('batching', True),
+        'INFERENCE_MAX_BATCH_SIZE': model_config.get('max_batch_size', 16),
+        'INFERENCE_MAX_WAIT_MS': model_config.get('max_wait_ms', 5),
+        'EMBEDDING_STORE_DIR': model_config.get('embedding_store_dir', 'embeddings'),
+        'EMBEDDING_CACHE_MB': model_config.get('embedding_cache_mb', 64),
+        'EMBEDDING_CACHE_TTL': model_config.get('embedding_cache_ttl', 3600),
+        'INDEXING_DOWNLOAD_WORKERS': indexing_config.get('download_workers', 8),
+        'INDEXING_DECODE_WORKERS': indexing_config.get('decode_workers'),
+        'INDEXING_BATCH_SIZE': indexing_config.get('batch_size', 32),
+        'INDEXING_QUEUE_SIZE': indexing_config.get('queue_size', 64),
+        'SEARCH_INDEX': search_config.get('index', 'exact'),
+        'IVF_N_LISTS': search_config.get('ivf_n_lists'),
+        'IVF_N_PROBE': search_config.get('ivf_n_probe', 8),
+        'EMBEDDING_STORAGE': search_config.get('storage', 'float32'),
+        'PQ_SUBVECTORS': search_config.get('pq_subvectors', 64),
+        'SEARCH_RERANK': search_config.get('rerank', 0),
+        'SEARCH_SHARED': search_config.get('shared', False),
+        'SEARCH_FEATURE_L2': search_config.get('feature_l2', False),
+        'SEARCH_PCA_DIM': search_config.get('pca_dim'),
+        'RESULT_CACHE_MB': search_config.get('result_cache_mb', 16),
+        'RESULT_CACHE_TTL': search_config.get('result_cache_ttl', 300),
+        'NAME_INDEX_PINYIN': search_config.get('name_pinyin', True),
+        'NAME_INDEX_REFRESH_INTERVAL': search_config.get('name_index_refresh_interval', 300),
+        'JOB_WORKERS': jobs_config.get('workers', 2),
+        'JOB_POLL_INTERVAL': jobs_config.get('poll_interval', 1.0),
+        'JOB_LEASE_SECONDS': jobs_config.get('lease_seconds', 600),
+        'JOB_RETRY_BACKOFF': jobs_config.get('retry_backoff', 10),
+        'JOB_MAX_ATTEMPTS': jobs_config.get('max_attempts', 5),
+        'SEARCH_HISTORY_ASYNC': search_history_config.get('async', True),
+        'SEARCH_HISTORY_BUFFER_SIZE': search_history_config.get('buffer_size', 10000),
+        'SEARCH_HISTORY_BATCH_SIZE': search_history_config.get('batch_size', 500),
+        'SEARCH_HISTORY_FLUSH_INTERVAL': search_history_config.get('flush_interval', 1.0),
+        'SEARCH_HISTORY_FULL_POLICY': search_history_config.get('full_policy', 'drop'),
+        'SEARCH_HISTORY_BLOCK_TIMEOUT': search_history_config.get('block_timeout', 0.05),
+        'RESPONSE_CACHE_BACKEND': response_cache_config.get('backend', 'memory'),
+        'RESPONSE_CACHE_MB': response_cache_config.get('max_mb', 16),
+        'RESPONSE_CACHE_TTL': response_cache_config.get('ttl', 300),
+        'RESPONSE_CACHE_REDIS_URL': response_cache_config.get('redis_url'),
+        'SQL_PROFILER': sql_profiler_config.get('enabled', True),
+        'SQL_PROFILER_STRICT': sql_profiler_config.get('strict', False)
     }
@@ -0,0 +1,130 @@
+import threading
+import time
+from functools import wraps
+from typing import Callable, Dict, Optional
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+# 只读副本在 SQLALCHEMY_BINDS 中的名称
+REPLICA_BIND = 'replica'
+# 路由到只读副本的请求方法
+READ_METHODS = ('GET', 'HEAD')
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    记录取连接等待时间和超时次数的 QueuePool
+
+    连接池耗尽时请求线程会在 _do_get 中等待最多 pool_timeout 秒,
+    这里统计的等待时间能直接反映连接池是否小于实际并发。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self._local = threading.local()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        # QueuePool._do_get 会递归调用自身,只在最外层计时
+        if getattr(self._local, 'timing', False):
+            return super()._do_get()
+        self._local.timing = True
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            self._local.timing = False
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.timeouts += timed_out
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def metrics(self) -> dict:
+        with self._stats_lock:
+            checkouts = self.checkouts
+            return {
+                'pool_size': self.size(),
+                'checked_out': self.checkedout(),
+                'checked_in': self.checkedin(),
+                # 超出 pool_size 额外创建的连接数,为负数时表示池中还有尚未创建的连接
+                'overflow': self.overflow(),
+                'max_overflow': self._max_overflow,
+                'checkouts': checkouts,
+                'timeouts': self.timeouts,
+                'wait_ms_avg': self.wait_seconds_total * 1000 / checkouts if checkouts else 0.0,
+                'wait_ms_max': self.wait_seconds_max * 1000,
+            }
+
+
+class RoutingSession(Session):
+    """
+    把 GET / HEAD 请求中的只读查询路由到只读副本的 Session
+
+    配置了 SQLALCHEMY_BINDS['replica'] 时生效。以下情况仍然使用主库:
+    - 不在请求上下文中 (后台任务、搜索历史写入线程、命令行)
+    - 非 GET / HEAD 请求,或视图函数用 use_primary 声明需要读到刚写入的数据
+    - flush 以及 INSERT / UPDATE / DELETE / SELECT ... FOR UPDATE 语句
+    同一个事务中对主库和副本各使用一个连接。
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._use_replica(clause):
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _use_replica(self, clause) -> bool:
+        if self._flushing or not has_request_context() or request.method not in READ_METHODS:
+            return False
+        if g.get('use_primary', False):
+            return False
+        if clause is not None and (getattr(clause, 'is_dml', False)
+                                   or getattr(clause, '_for_update_arg', None) is not None):
+            return False
+        return True
+
+
+def use_primary(view: Callable) -> Callable:
+    """
+    声明 GET 接口从主库读取,用于需要立即读到刚写入数据 (不能容忍副本复制延迟) 的接口
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.use_primary = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def pool_metrics(engines: Dict[Optional[str], object]) -> Dict[str, dict]:
+    """
+    每个数据库连接池的使用情况
+
+    参数:
+    engines (dict): bind 名称到 Engine 的映射,即 db.engines
+
+    返回:
+    Dict[str, dict]: bind 名称 (主库为 primary) 到连接池指标的映射
+    """
+    metrics = {}
+    for key, engine in engines.items():
+        pool = engine.pool
+        name = key or 'primary'
+        if isinstance(pool, InstrumentedQueuePool):
+            metrics[name] = pool.metrics()
+        else:
+            metrics[name] = {'status': pool.status()}
+    return metrics
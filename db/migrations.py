@@ -0,0 +1,81 @@
+from typing import List
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+
+def ensure_columns(db: SQLAlchemy) -> List[str]:
+    """
+    为已存在的表补建模型中新增的列 (例如 Record.upload_status)
+
+    新增的列都带有 server_default 或允许为空,ALTER TABLE 时已有的行直接取默认值。
+
+    参数:
+    db (SQLAlchemy): 数据库实例
+
+    返回:
+    List[str]: 本次新建的列,形如 表名.列名
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                definition = CreateColumn(column).compile(dialect=db.engine.dialect)
+                with db.engine.begin() as connection:
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {definition}'))
+                created.append(f'{table.name}.{column.name}')
+    return created
+
+
+def ensure_indexes(db: SQLAlchemy) -> List[str]:
+    """
+    为已存在的表补建模型中新增的索引
+
+    db.create_all() 只会创建不存在的表,已有表上新声明的索引 (例如 Record 的复合索引) 需要单独创建。
+    大表上建索引可能耗时较长,因此不在启动时执行,而是通过 flask upgrade-db 命令手动执行。
+
+    参数:
+    db (SQLAlchemy): 数据库实例
+
+    返回:
+    List[str]: 本次新建的索引名
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=db.engine)
+                created.append(index.name)
+    return created
+
+
+def remove_duplicate_favorites(db: SQLAlchemy) -> int:
+    """
+    删除重复的收藏 (同一用户多次收藏同一条 Fish),只保留最早的一条,之后才能创建 (user_id, fish_id) 唯一索引
+
+    参数:
+    db (SQLAlchemy): 数据库实例
+
+    返回:
+    int: 删除的行数
+    """
+    if 'favorite' not in inspect(db.engine).get_table_names():
+        return 0
+    # MySQL 不允许在 DELETE 的子查询中直接引用被删除的表,多包一层派生表
+    result = db.session.execute(text(
+        'DELETE FROM favorite WHERE id NOT IN '
+        '(SELECT id FROM (SELECT MIN(id) AS id FROM favorite GROUP BY user_id, fish_id) AS keep)'
+    ))
+    db.session.commit()
+    return result.rowcount
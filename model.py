@@ -1,5 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 import datetime
+import json
 
 from app import db
 
@@ -11,7 +12,7 @@ class User(db.Model):
     password = db.Column(db.String(80), nullable=False) # Bcrypt 算法,它会产生一个 60 个字符长的字符串
     email = db.Column(db.String(80), unique=True, nullable=False)
     role = db.Column(db.Integer, nullable=False)  # 0: normal user, 1: admin
-    created_at = db.Column(db.DateTime, default=datetime.datetime.now(datetime.UTC))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.datetime.now(datetime.UTC))
 
     def to_dict(self):
         return {
@@ -24,6 +25,19 @@ class User(db.Model):
 
 class Record(db.Model):
     __tablename__ = 'record'
+    __table_args__ = (
+        # 键集分页按 (created_at, id) 倒序,待审核记录按 reviewed_at IS NULL 过滤,已审核记录按 is_approved 过滤
+        db.Index('ix_record_created_at_id', 'created_at', 'id'),
+        db.Index('ix_record_reviewed_at_created_at_id', 'reviewed_at', 'created_at', 'id'),
+        db.Index('ix_record_is_approved_created_at_id', 'is_approved', 'created_at', 'id'),
+        # 用户查看自己提交的记录
+        db.Index('ix_record_user_id_created_at', 'user_id', 'created_at'),
+    )
+
+    # 图片上传状态: 异步上传时先创建 uploading 状态的记录,上传到 OSS 后改为 uploaded
+    UPLOADING = 'uploading'
+    UPLOADED = 'uploaded'
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     image_url = db.Column(db.String(2083), nullable=False)
@@ -33,13 +47,15 @@ class Record(db.Model):
     reviewed_by = db.Column(db.Integer, db.ForeignKey('user.id'))
     reviewed_at = db.Column(db.DateTime)
     feedback = db.Column(db.String(255), nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.datetime.now(datetime.UTC))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.datetime.now(datetime.UTC))
+    upload_status = db.Column(db.String(16), nullable=False, default=UPLOADED, server_default=UPLOADED)
 
     def to_dict(self):
         return {
             'id': self.id,
             'user_id': self.user_id,
             'image_url': self.image_url,
+            'upload_status': self.upload_status,
             'fish_type_id': self.fish_type_id,
             'tags': self.tags,
             'is_approved': self.is_approved,
@@ -71,7 +87,7 @@ class Fish(db.Model):
     image_url = db.Column(db.String(2083), nullable=False)
     tags = db.Column(db.String(256))
     uploaded_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.datetime.now(datetime.UTC))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.datetime.now(datetime.UTC))
 
     def to_dict(self):
         return {
@@ -82,12 +98,45 @@ class Fish(db.Model):
             'uploaded_by': self.uploaded_by,
             'created_at': self.created_at.isoformat()
         }
+
+
+class Tag(db.Model):
+    """
+    规范化后的标签,Fish.tags 中逗号分割的每个标签对应一行
+    """
+    __tablename__ = 'tag'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), unique=True, nullable=False)  # 去掉首尾空白并转为小写,唯一索引同时用于前缀查询
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name
+        }
+
+
+class FishTag(db.Model):
+    """
+    Fish 与 Tag 的多对多关联,主键 (fish_id, tag_id) 用于按 Fish 查标签,(tag_id, fish_id) 索引用于按标签查 Fish
+    """
+    __tablename__ = 'fish_tag'
+    __table_args__ = (
+        db.Index('ix_fish_tag_tag_id_fish_id', 'tag_id', 'fish_id'),
+    )
+    fish_id = db.Column(db.Integer, db.ForeignKey('fish.id'), primary_key=True)
+    tag_id = db.Column(db.Integer, db.ForeignKey('tag.id'), primary_key=True)
+
+
 class Favorite(db.Model):
     __tablename__ = 'favorite'
+    __table_args__ = (
+        # 同一用户不能重复收藏同一条 Fish,同时用于按用户查询收藏夹
+        db.Index('uq_favorite_user_id_fish_id', 'user_id', 'fish_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     fish_id = db.Column(db.Integer, db.ForeignKey('fish.id'), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.datetime.now(datetime.UTC))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.datetime.now(datetime.UTC))
 
     def to_dict(self):
         return {
@@ -100,11 +149,16 @@ class Favorite(db.Model):
 
 class SearchHistory(db.Model):
     __tablename__ = 'search_history'
+    __table_args__ = (
+        # 按用户查询搜索历史,并按 (search_at, id) 倒序键集分页
+        db.Index('ix_search_history_user_id_search_at', 'user_id', 'search_at', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     search_method = db.Column(db.Integer, nullable=False)  # 0: image, 1: name, 2: tags
     search_content = db.Column(db.Text, nullable=False)  # URL, name, tags
-    search_at = db.Column(db.DateTime, default=datetime.datetime.now(datetime.UTC))
+    search_at = db.Column(db.DateTime, default=lambda: datetime.datetime.now(datetime.UTC))
 
     def to_dict(self):
         return {
@@ -113,4 +167,80 @@ class SearchHistory(db.Model):
             'search_method': self.search_method,
             'search_content': self.search_content,
             'search_at': self.search_at.isoformat()
-        }
\ No newline at end of file
+        }
+
+
+class SearchQueryStat(db.Model):
+    """
+    搜索历史的按天聚合计数,写入搜索历史时在同一事务中增量更新,查询热门搜索时不扫描 search_history 表
+    """
+    __tablename__ = 'search_query_stat'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'day', 'search_method', 'search_content',
+                            name='uq_search_query_stat_user_id_day_query'),
+    )
+
+    # 所有用户合计的聚合行使用的 user_id
+    ALL_USERS = 0
+    # search_content 只保留前这么多个字符
+    CONTENT_LENGTH = 255
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)  # 用户 ID,ALL_USERS 表示所有用户合计
+    day = db.Column(db.Date, nullable=False)  # search_at 所在的日期 (UTC)
+    search_method = db.Column(db.Integer, nullable=False)  # 0: image, 1: name, 2: tags
+    search_content = db.Column(db.String(CONTENT_LENGTH), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    last_search_at = db.Column(db.DateTime, nullable=False)
+
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'day': self.day.isoformat(),
+            'search_method': self.search_method,
+            'search_content': self.search_content,
+            'count': self.count,
+            'last_search_at': self.last_search_at.isoformat()
+        }
+
+
+class Job(db.Model):
+    __tablename__ = 'job'
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+
+    # 任务状态: 等待执行 / 执行中 / 成功 / 重试次数用尽后进入死信
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    DEAD = 'dead'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64), nullable=False)  # 任务类型,对应 JobQueue 中注册的处理函数
+    payload = db.Column(db.Text, nullable=False)  # JSON 格式的任务参数
+    status = db.Column(db.String(16), nullable=False, default=PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    last_error = db.Column(db.Text)
+    run_at = db.Column(db.DateTime, nullable=False)  # 最早可以执行 (或重试) 的时间
+    locked_by = db.Column(db.String(64))
+    locked_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'payload': json.loads(self.payload),
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'last_error': self.last_error,
+            'run_at': self.run_at.isoformat(),
+            'locked_by': self.locked_by,
+            'locked_at': self.locked_at.isoformat() if self.locked_at else None,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
@@ -0,0 +1,341 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+
+class EmbeddingStore:
+    """
+    持久化在磁盘上的图片向量存储
+
+    每个模型版本单独一个目录,目录中包含:
+    - vectors.f32 (压缩后为 vectors-N.f32): 按行连续存放的 float32 向量,启动时以只读方式 mmap,不会整体读入内存
+    - index.json: 元数据索引,记录格式版本、模型版本、向量维度、当前向量文件名以及 fish id -> (行号, 图片 URL 哈希) 的映射
+
+    写入只会在向量文件末尾追加新行,再原子地替换 index.json。
+    图片 URL 变化或被替换的 Fish 会追加一行新向量,被删除的 Fish 只从索引中移除,旧行不再被引用。
+    不再被引用的行超过一半时 (或调用 compact 时) 把仍被引用的行写入新的向量文件,
+    随 index.json 一起原子切换,之后删除旧文件。
+    其他进程写入后,refresh 发现 index.json 被替换时重新读取;每次读取或写入后 revision 加一。
+
+    索引和向量矩阵作为一个不可变的 (entries, vectors) 元组整体发布,写入时先在局部变量中构建新的字典和 mmap 再替换,
+    读取方不加锁,只取一次快照,不会看到新的行号对应旧的向量文件。
+    """
+
+    FORMAT_VERSION = 1
+    VECTORS_FILE = 'vectors.f32'
+    INDEX_FILE = 'index.json'
+    LOCK_FILE = '.lock'
+    # 计算缺失向量期间持有的锁,与写入锁分开,持有期间仍可以调用 put_many
+    EMBEDDING_LOCK_FILE = '.embedding.lock'
+    # 不再被引用的行数超过仍被引用的行数和这个值时自动压缩
+    COMPACT_MIN_ROWS = 1024
+    # 压缩时每次复制的行数
+    COMPACT_CHUNK_ROWS = 4096
+
+    def __init__(self, root: str, model_version: str):
+        """
+        参数:
+        root (str): 向量存储的根目录
+        model_version (str): 生成向量的模型版本,不同版本的向量存放在不同子目录中
+        """
+        self.model_version = model_version
+        self.path = os.path.join(root, model_version)
+        self._lock = threading.Lock()
+        self.dim = 0
+        self.compactions = 0
+        self.vectors_file = self.VECTORS_FILE
+        # fish id -> {'row', 'url_hash'} 与对应的向量矩阵,发布后不再修改
+        self._snapshot = ({}, np.empty((0, 0), dtype=np.float32))
+        # 本进程看到的存储内容每变化一次加一
+        self.revision = 0
+        # 最近一次读取或写入的 index.json 的 (inode, 修改时间)
+        self._signature = None
+
+        os.makedirs(self.path, exist_ok=True)
+        self.load()
+
+    @staticmethod
+    def url_hash(image_url: str) -> str:
+        return hashlib.sha1(image_url.encode('utf-8')).hexdigest()
+
+    def load(self):
+        """
+        读取 index.json 并以只读方式 mmap 向量文件
+        """
+        try:
+            self._load()
+        except FileNotFoundError:
+            # 读取 index.json 之后,向量文件恰好被其他进程的压缩删除,重新读取一次新的 index.json
+            self._load()
+
+    def refresh(self) -> bool:
+        """
+        index.json 被其他进程替换后重新读取,只需要一次 stat
+
+        返回:
+        bool: 是否重新读取
+        """
+        with self._lock:
+            if self._index_signature() == self._signature:
+                return False
+            self.load()
+            return True
+
+    def url_hashes(self) -> Tuple[int, Dict[int, str]]:
+        """
+        返回 (revision, fish id -> 图片 URL 哈希) 的快照,用于比较内存中的图库与存储的差异
+        """
+        with self._lock:
+            return self.revision, {fish_id: entry['url_hash'] for fish_id, entry in self.entries.items()}
+
+    @property
+    def entries(self) -> Dict[int, dict]:
+        """
+        当前快照中 fish id -> {'row', 'url_hash'} 的映射,只读
+        """
+        return self._snapshot[0]
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """
+        当前快照中的向量矩阵,只读
+        """
+        return self._snapshot[1]
+
+    @property
+    def count(self) -> int:
+        """
+        向量文件中的行数,包括不再被引用的行
+        """
+        return self._snapshot[1].shape[0]
+
+    def _index_signature(self):
+        try:
+            stat = os.stat(os.path.join(self.path, self.INDEX_FILE))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _load(self):
+        index = {}
+        index_path = os.path.join(self.path, self.INDEX_FILE)
+        # 先 stat 再读取,读取期间被替换时下一次 refresh 会再读一次
+        self._signature = self._index_signature()
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as index_file:
+                index = json.load(index_file)
+
+        # 格式或模型版本不匹配时视为空存储,之后的写入会覆盖旧数据
+        if index.get('format_version') != self.FORMAT_VERSION or index.get('model_version') != self.model_version:
+            index = {}
+
+        dim = index.get('dim', 0)
+        vectors_file = index.get('vectors_file', self.VECTORS_FILE)
+        entries = {int(fish_id): entry for fish_id, entry in index.get('entries', {}).items()}
+        # 向量文件缺失时在这里抛出 FileNotFoundError,之前的快照保持不变
+        vectors = self._map(vectors_file, index.get('count', 0), dim)
+        self.dim = dim
+        self.compactions = index.get('compactions', 0)
+        self.vectors_file = vectors_file
+        self._snapshot = (entries, vectors)
+        self.revision += 1
+
+    def _map(self, vectors_file: str, count: int, dim: int) -> np.ndarray:
+        if count == 0:
+            return np.empty((0, dim), dtype=np.float32)
+        return np.memmap(os.path.join(self.path, vectors_file), dtype=np.float32, mode='r', shape=(count, dim))
+
+    @property
+    def dead_rows(self) -> int:
+        """
+        向量文件中不再被引用的行数
+        """
+        entries, vectors = self._snapshot
+        return vectors.shape[0] - len(entries)
+
+    def __contains__(self, fish_id: int) -> bool:
+        return fish_id in self._snapshot[0]
+
+    def is_fresh(self, fish_id: int, image_url: str) -> bool:
+        """
+        判断某条 Fish 的向量是否已存在且与当前图片 URL 对应
+        """
+        entry = self._snapshot[0].get(fish_id)
+        return entry is not None and entry['url_hash'] == self.url_hash(image_url)
+
+    def get_vectors(self, fish_ids: Iterable[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        取出给定 Fish 的向量,不在存储中的 id 会被跳过
+
+        参数:
+        fish_ids (Iterable[int]): Fish id 列表
+
+        返回:
+        Tuple[np.ndarray, np.ndarray]: (实际取到的 Fish id 数组, 对应的向量矩阵)
+        """
+        entries, vectors = self._snapshot
+        found_ids = [fish_id for fish_id in fish_ids if fish_id in entries]
+        rows = np.fromiter((entries[fish_id]['row'] for fish_id in found_ids), dtype=np.int64)
+        return np.asarray(found_ids, dtype=np.int64), np.asarray(vectors[rows], dtype=np.float32)
+
+    def put_many(self, fish_ids: List[int], image_urls: List[str], vectors: np.ndarray):
+        """
+        将新的或已过期的向量追加到存储中
+
+        参数:
+        fish_ids (List[int]): Fish id 列表
+        image_urls (List[str]): 与 fish_ids 对应的图片 URL,用于判断向量是否过期
+        vectors (np.ndarray): 与 fish_ids 对应的向量矩阵,形状为 (N, D)
+        """
+        if len(fish_ids) == 0:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+
+        with self._write_lock():
+            # 其他进程可能已经写入过,先以磁盘上的最新状态为准
+            self.load()
+            if self.dim == 0:
+                self.dim = vectors.shape[1]
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f'Embedding dimension mismatch: expected {self.dim}, got {vectors.shape[1]}')
+
+            start = self.count
+            vectors_path = os.path.join(self.path, self.vectors_file)
+            with open(vectors_path, 'ab') as vectors_file:
+                # 丢弃上次写入中断时可能残留在文件末尾的不完整数据
+                vectors_file.truncate(start * self.dim * 4)
+                vectors_file.write(vectors.tobytes())
+                vectors_file.flush()
+                os.fsync(vectors_file.fileno())
+
+            entries = dict(self.entries)
+            for offset, (fish_id, image_url) in enumerate(zip(fish_ids, image_urls)):
+                entries[int(fish_id)] = {'row': start + offset, 'url_hash': self.url_hash(image_url)}
+            count = start + vectors.shape[0]
+
+            self._write_index(entries, count)
+            self._snapshot = (entries, self._map(self.vectors_file, count, self.dim))
+            self._compact_if_needed()
+
+    def remove_many(self, fish_ids: Iterable[int]):
+        """
+        从索引中删除给定 Fish 的向量,向量文件中对应的行不再被引用
+
+        参数:
+        fish_ids (Iterable[int]): Fish id 列表
+        """
+        fish_ids = [int(fish_id) for fish_id in fish_ids]
+        with self._write_lock():
+            self.load()
+            entries, vectors = self._snapshot
+            if not any(fish_id in entries for fish_id in fish_ids):
+                return
+            removed = set(fish_ids)
+            entries = {fish_id: entry for fish_id, entry in entries.items() if fish_id not in removed}
+            self._write_index(entries, vectors.shape[0])
+            self._snapshot = (entries, vectors)
+            self._compact_if_needed()
+
+    def compact(self) -> int:
+        """
+        把仍被引用的行复制到新的向量文件中并原子切换,回收被替换和被删除的 Fish 占用的空间
+
+        返回:
+        int: 回收的行数
+        """
+        with self._write_lock():
+            self.load()
+            return self._compact()
+
+    def _compact_if_needed(self):
+        if self.dead_rows > max(len(self.entries), self.COMPACT_MIN_ROWS):
+            self._compact()
+
+    def _compact(self) -> int:
+        dead_rows = self.dead_rows
+        if dead_rows == 0:
+            return 0
+
+        # 按原来的行号顺序复制,分块读写,内存占用不随存储大小增长
+        fish_ids = sorted(self.entries, key=lambda fish_id: self.entries[fish_id]['row'])
+        old_file = self.vectors_file
+        new_file = f'vectors-{self.compactions + 1}.f32'
+        with open(os.path.join(self.path, new_file), 'wb') as vectors_file:
+            for start in range(0, len(fish_ids), self.COMPACT_CHUNK_ROWS):
+                rows = [self.entries[fish_id]['row'] for fish_id in fish_ids[start:start + self.COMPACT_CHUNK_ROWS]]
+                vectors_file.write(np.ascontiguousarray(self.vectors[rows], dtype=np.float32).tobytes())
+            vectors_file.flush()
+            os.fsync(vectors_file.fileno())
+
+        # 新的行号只写入新字典,与新文件的 mmap 一起发布,读取方不会用新行号读旧文件
+        entries = {fish_id: {'row': row, 'url_hash': self.entries[fish_id]['url_hash']}
+                   for row, fish_id in enumerate(fish_ids)}
+        self.compactions += 1
+        self.vectors_file = new_file
+        # 切换 index.json 之后新文件才生效;已经 mmap 旧文件的进程在 POSIX 上仍可继续读取
+        self._write_index(entries, len(fish_ids))
+        self._snapshot = (entries, self._map(new_file, len(fish_ids), self.dim))
+        try:
+            os.remove(os.path.join(self.path, old_file))
+        except FileNotFoundError:
+            pass
+        return dead_rows
+
+    def _write_index(self, entries: Dict[int, dict], count: int):
+        index = {
+            'format_version': self.FORMAT_VERSION,
+            'model_version': self.model_version,
+            'dim': self.dim,
+            'count': count,
+            'compactions': self.compactions,
+            'vectors_file': self.vectors_file,
+            'entries': {str(fish_id): entry for fish_id, entry in entries.items()},
+        }
+        index_path = os.path.join(self.path, self.INDEX_FILE)
+        tmp_path = f'{index_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as index_file:
+            json.dump(index, index_file)
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        os.replace(tmp_path, index_path)
+        self._signature = self._index_signature()
+        self.revision += 1
+
+    @contextmanager
+    def embedding_lock(self) -> Iterator[bool]:
+        """
+        多个 worker 同时启动时,只让第一个拿到锁的进程下载图片并计算缺失的向量
+
+        其他进程等待它计算完成,退出时再获得锁,此时应当 refresh 读取写入的向量,而不是重新计算。
+
+        返回:
+        Iterator[bool]: 本进程是否没有等待就拿到了锁,即是否应当由本进程计算向量
+        """
+        with open(os.path.join(self.path, self.EMBEDDING_LOCK_FILE), 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                owner = True
+            except BlockingIOError:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                owner = False
+            try:
+                yield owner
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _write_lock(self):
+        # 线程锁保护同一进程内的并发写入,文件锁保护多个 worker 进程之间的并发写入
+        with self._lock:
+            with open(os.path.join(self.path, self.LOCK_FILE), 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
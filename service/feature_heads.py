@@ -0,0 +1,150 @@
+import os
+
+import numpy as np
+
+from service.similarity_index import SimilarityIndex
+
+
+class FeatureHead:
+    """
+    特征头:把模型输出的向量 (磁盘存储中保存的形式) 变换为图库索引中使用的检索向量
+
+    查询向量和图库向量经过同一个特征头,磁盘存储始终保存模型的原始输出,更换特征头不需要重新计算向量。
+    每种特征头的 name 都不相同,索引文件等派生数据按 name 区分。
+    """
+
+    def __init__(self, normalize: bool = False):
+        """
+        参数:
+        normalize (bool): 变换之前是否先做 L2 归一化
+        """
+        self.normalize = normalize
+
+    @property
+    def name(self) -> str:
+        return 'l2' if self.normalize else 'identity'
+
+    @property
+    def is_fitted(self) -> bool:
+        return True
+
+    @property
+    def fitted_count(self) -> int:
+        """
+        拟合时使用的图库向量数,无参数的特征头为 0
+        """
+        return 0
+
+    def fit(self, vectors: np.ndarray):
+        """
+        在图库向量上拟合特征头的参数,无参数的特征头什么都不做
+        """
+
+    def transform(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        参数:
+        vectors (np.ndarray): 模型输出的向量矩阵,形状为 (N, D)
+
+        返回:
+        np.ndarray: 检索向量矩阵
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return SimilarityIndex.normalize(vectors) if self.normalize else vectors
+
+    def save(self, path: str):
+        pass
+
+    def load(self, path: str):
+        pass
+
+
+class PCAHead(FeatureHead):
+    """
+    (可选 L2 归一化后) 用 PCA 把向量降到 dim 维
+
+    检索向量越短,打分时的矩阵乘法和内存中的图库矩阵都按比例变小。
+    PCA 在图库向量上拟合一次后保存到文件,之后的启动和所有 worker 都复用同一个投影。
+    """
+
+    # 拟合时最多使用的样本数
+    MAX_SAMPLES = 10000
+
+    def __init__(self, dim: int, normalize: bool = True):
+        """
+        参数:
+        dim (int): 降维后的维度
+        normalize (bool): 降维之前是否先做 L2 归一化
+        """
+        super().__init__(normalize=normalize)
+        self.dim = dim
+        self.mean = None
+        self.components = None
+        # 拟合时使用的图库向量数,图库增长到两倍以上时需要重新拟合
+        self._fitted_count = 0
+
+    @property
+    def name(self) -> str:
+        return f'pca{self.dim}' + ('-l2' if self.normalize else '')
+
+    @property
+    def is_fitted(self) -> bool:
+        return self.components is not None
+
+    @property
+    def fitted_count(self) -> int:
+        return self._fitted_count
+
+    def fit(self, vectors: np.ndarray):
+        """
+        在图库向量上拟合 PCA;图库向量数少于 dim 时只能得到不足 dim 个主成分,此时不拟合,保持未拟合状态
+        """
+        vectors = super().transform(vectors)
+        if vectors.shape[0] < self.dim:
+            return
+        fitted_count = vectors.shape[0]
+        if vectors.shape[0] > self.MAX_SAMPLES:
+            vectors = vectors[np.random.default_rng(0).choice(vectors.shape[0], self.MAX_SAMPLES, replace=False)]
+        self.mean = vectors.mean(axis=0)
+        # 右奇异向量即主成分方向
+        _, _, vt = np.linalg.svd(vectors - self.mean, full_matrices=False)
+        self.components = np.ascontiguousarray(vt[:self.dim], dtype=np.float32)
+        self._fitted_count = fitted_count
+
+    def transform(self, vectors: np.ndarray) -> np.ndarray:
+        return (super().transform(np.atleast_2d(vectors)) - self.mean) @ self.components.T
+
+    def save(self, path: str):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as head_file:
+            np.savez(head_file, mean=self.mean, components=self.components, dim=self.dim,
+                     fitted_count=self.fitted_count)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str):
+        """
+        读取保存的投影;主成分数与配置的 dim 不一致 (例如早期在小图库上拟合的投影) 时不使用,保持未拟合状态
+        """
+        with np.load(path) as data:
+            components = data['components']
+            if components.shape[0] != self.dim or ('dim' in data and int(data['dim']) != self.dim):
+                return
+            self.mean = data['mean']
+            self.components = components
+            # 旧的投影文件没有记录拟合规模,记为 0,下次启动时重新拟合
+            self._fitted_count = int(data['fitted_count']) if 'fitted_count' in data else 0
+
+
+def create_feature_head(pca_dim: int = None, normalize: bool = False) -> FeatureHead:
+    """
+    根据配置创建特征头
+
+    参数:
+    pca_dim (int): PCA 降维后的维度,为空时不降维
+    normalize (bool): 是否先做 L2 归一化
+
+    返回:
+    FeatureHead: 特征头
+    """
+    if pca_dim:
+        return PCAHead(pca_dim, normalize=normalize)
+    return FeatureHead(normalize=normalize)
@@ -1,71 +1,562 @@
+import hashlib
 import os
-import tempfile
-from typing import List
+import threading
+from typing import BinaryIO, Callable, List, Optional, Tuple, Union
 
 import torch
-import torchvision.models as models
-import torchvision.transforms as transforms
+from flask import current_app
 from PIL import Image
 
 import requests
-from scipy.spatial.distance import cosine
 import numpy as np
 
 from app import db
 from model import Fish, FishType
+from service.ann_index import IVFIndex
+from service.embedding_store import EmbeddingStore
+from service.feature_heads import create_feature_head
+from service.indexing_pipeline import IndexingPipeline
+from service.inference_backends import parity_report
+from service.inference_scheduler import InferenceScheduler
+from service.model_registry import ModelRegistry
+from service.preprocessing import open_image
+from service.query_cache import LRUCache
+from service.quantization import Float16Index, PQIndex, ProductQuantizer
+from service.shared_gallery import SharedGallery, SharedIndex
+from service.similarity_index import SimilarityIndex
 
 
 class FishService:
     __instance = None
+    __instance_lock = threading.Lock()
+
+    # 结果缓存中每个 (Fish id, 相似度) 元组大致占用的字节数
+    RANKED_ENTRY_BYTES = 128
 
     def __init__(self):
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.fish_vectors = self.load_fish_vectors()
+        self.model_registry = self.create_model_registry(self.device)
+        self.embedding_store = self.create_embedding_store(self.model_registry)
+        self.inference_scheduler = self.create_inference_scheduler(self.model_registry)
+        self.embedding_cache, self.result_cache = self.create_query_caches()
+        self._buffers = threading.local()
+        self.feature_head = create_feature_head(pca_dim=current_app.config.get('SEARCH_PCA_DIM'),
+                                                normalize=current_app.config.get('SEARCH_FEATURE_L2', False))
+        # 内存中的图库对应的 fish id -> 图片 URL 哈希,以及同步到的向量存储 revision
+        self._index_lock = threading.Lock()
+        self._indexed, self._indexed_revision = {}, None
+        # EMBEDDING_STORAGE 为 pq 但启动时图库不足以训练码本,暂用 float32 索引,图库足够大后再转换
+        self._pq_pending = False
+        self.fish_index = self.load_fish_vectors()
+
+    @classmethod
+    def create_model_registry(cls, device: torch.device, backend: str = None) -> ModelRegistry:
+        config = current_app.config
+        model_version = config.get('MODEL_VERSION') or ModelRegistry.DEFAULT_MODEL_VERSION
+        return ModelRegistry(
+            device,
+            checkpoint_path=config.get('MODEL_CHECKPOINT_PATH'),
+            model_version=model_version,
+            backend=backend or config.get('MODEL_BACKEND', 'eager'),
+            channels_last=config.get('MODEL_CHANNELS_LAST', False),
+            num_threads=config.get('MODEL_NUM_THREADS'),
+            # 导出的 ONNX 模型与权重版本绑定,和该版本的向量放在同一目录
+            onnx_path=os.path.join(config.get('EMBEDDING_STORE_DIR', 'embeddings'), model_version, 'model.onnx'),
+            calibration_paths=cls.sample_image_paths(config.get('MODEL_SAMPLE_DIRS', ['dataset', 'uploads'])),
+            features=config.get('MODEL_FEATURES', 'logits'),
+        )
+
+    @staticmethod
+    def create_embedding_store(model_registry: ModelRegistry) -> EmbeddingStore:
+        return EmbeddingStore(current_app.config.get('EMBEDDING_STORE_DIR', 'embeddings'),
+                              model_registry.embedding_version)
+
+    @staticmethod
+    def sample_image_paths(directories: List[str]) -> List[str]:
+        """
+        列出给定目录下的所有文件,用作 int8 校准和推理后端一致性检查的样本图片
+        """
+        return [os.path.join(directory, name) for directory in directories if os.path.isdir(directory)
+                for name in sorted(os.listdir(directory)) if os.path.isfile(os.path.join(directory, name))]
+
+    @staticmethod
+    def create_inference_scheduler(model_registry: ModelRegistry) -> Optional[InferenceScheduler]:
+        config = current_app.config
+        if not config.get('INFERENCE_BATCHING', True):
+            return None
+        return InferenceScheduler(model_registry, max_batch_size=config.get('INFERENCE_MAX_BATCH_SIZE', 16),
+                                  max_wait_ms=config.get('INFERENCE_MAX_WAIT_MS', 5))
+
+    @staticmethod
+    def create_query_caches() -> Tuple[Optional[LRUCache], Optional[LRUCache]]:
+        """
+        创建查询向量缓存和 top-k 结果缓存,内存预算为 0 时对应的缓存不启用
+        """
+        config = current_app.config
+        embedding_bytes = config.get('EMBEDDING_CACHE_MB', 64) * 1024 * 1024
+        result_bytes = config.get('RESULT_CACHE_MB', 16) * 1024 * 1024
+        return (
+            LRUCache(embedding_bytes, config.get('EMBEDDING_CACHE_TTL', 3600)) if embedding_bytes > 0 else None,
+            LRUCache(result_bytes, config.get('RESULT_CACHE_TTL', 300)) if result_bytes > 0 else None,
+        )
 
     @classmethod
     def get_instance(cls):
         if cls.__instance is None:
-            cls.__instance = cls()
+            with cls.__instance_lock:
+                if cls.__instance is None:
+                    cls.__instance = cls()
         return cls.__instance
 
-    def load_fish_vectors(self) -> dict:
+    def warmup(self):
+        """
+        在项目启动时预先加载模型并执行一次前向传播
+        """
+        self.model_registry.warmup()
+
+    def load_fish_vectors(self) -> Union[SimilarityIndex, IVFIndex]:
+        """
+        在项目启动时加载所有 Fish 对象的向量数据,以归一化矩阵的形式存储在内存中
+
+        向量优先从磁盘上的 embedding_store 读取,只有缺失或图片 URL 已变化的 Fish 才会重新下载图片并计算向量;
+        多个 worker 同时启动时只有一个计算,其他 worker 等它完成后重新读取向量存储。
+        磁盘上的向量经过 feature_head 变换 (L2 归一化、PCA 降维) 后再放入索引。
+        配置 SEARCH_INDEX 为 'ivf' 时返回近似最近邻索引,否则返回精确检索索引
+        """
+        fish_list = db.session.query(Fish.id, Fish.image_url).all()
+
+        stale = [(fish.id, fish.image_url) for fish in fish_list
+                 if not self.embedding_store.is_fresh(fish.id, fish.image_url)]
+        if stale:
+            with self.embedding_store.embedding_lock() as owner:
+                # 等待锁期间其他 worker 可能已经计算过
+                self.embedding_store.refresh()
+                missing = [(fish_id, image_url) for fish_id, image_url in stale
+                           if not self.embedding_store.is_fresh(fish_id, image_url)]
+                if owner and missing:
+                    failures = self.embed_fish(missing, self.model_registry, self.embedding_store)
+                    for fish_id, image_url, error in failures:
+                        current_app.logger.error(f'Failed to embed fish {fish_id} ({image_url}): {error}')
+                elif missing:
+                    # 另一个 worker 刚刚计算过,仍然缺失的是它计算失败的,不再重复下载
+                    current_app.logger.warning(f'{len(missing)} fish have no embedding after another worker '
+                                               f'indexed the gallery; run flask reindex to retry them')
+
+        self._indexed_revision, self._indexed = self.embedding_store.url_hashes()
+        fish_ids, vectors = self.embedding_store.get_vectors([fish.id for fish in fish_list])
+        vectors = self.fit_feature_head(vectors)
+        if current_app.config.get('SEARCH_INDEX', 'exact') == 'ivf':
+            return self.load_ivf_index(fish_ids, vectors, refreshed_ids=[fish_id for fish_id, _ in stale])
+        return self.load_exact_index(fish_ids, vectors, refreshed_ids=[fish_id for fish_id, _ in stale])
+
+    def fit_feature_head(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        加载或在图库向量上拟合 feature_head,返回变换后的图库向量
+
+        拟合结果保存在向量存储目录中,所有 worker 和之后的启动都复用同一个投影;
+        图库向量数少于 PCA 维度无法拟合时,本次启动退回为不降维的特征头,也不保存投影,等图库足够大后的启动再拟合。
+        保存的投影与配置的维度不一致,或与 IVF 和 PQ 一样图库规模超过拟合时的两倍时重新拟合;
+        由投影派生的文件按拟合规模放在不同子目录中 (见 artifact_path),重新拟合后会重新构建
+
+        参数:
+        vectors (np.ndarray): 磁盘存储中的图库向量
+
+        返回:
+        np.ndarray: 变换后的图库向量
+        """
+        if not self.feature_head.is_fitted:
+            head_path = self.artifact_path('head.npz')
+            if os.path.exists(head_path):
+                self.feature_head.load(head_path)
+            if self.feature_head.is_fitted and vectors.shape[0] > 2 * self.feature_head.fitted_count:
+                current_app.logger.info(f'Refitting feature head {self.feature_head.name}: fitted on '
+                                        f'{self.feature_head.fitted_count} vectors, gallery now has {vectors.shape[0]}')
+                self.feature_head = create_feature_head(pca_dim=self.feature_head.dim,
+                                                        normalize=self.feature_head.normalize)
+            if not self.feature_head.is_fitted:
+                self.feature_head.fit(vectors)
+                if self.feature_head.is_fitted:
+                    self.feature_head.save(head_path)
+        if not self.feature_head.is_fitted:
+            current_app.logger.warning(f'Feature head {self.feature_head.name} could not be fitted on a gallery of '
+                                       f'{vectors.shape[0]} vectors, falling back to unreduced features')
+            self.feature_head = create_feature_head(normalize=self.feature_head.normalize)
+        return self.feature_head.transform(vectors)
+
+    def artifact_path(self, name: str) -> str:
+        """
+        由图库向量派生的文件 (IVF 索引、PQ 码本、共享快照等) 的路径,不同特征头的派生文件放在不同子目录中
+
+        需要拟合的特征头 (PCA) 的派生文件再按拟合规模分目录,重新拟合后的索引从头构建,
+        仍在使用旧投影的 worker 也不会读到按新投影写入的文件
+        """
+        if self.feature_head.name == 'identity':
+            return os.path.join(self.embedding_store.path, name)
+        directory = os.path.join(self.embedding_store.path, self.feature_head.name)
+        if name != 'head.npz' and self.feature_head.fitted_count:
+            directory = os.path.join(directory, f'fit-{self.feature_head.fitted_count}')
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, name)
+
+    def gallery_vectors(self, fish_ids: List[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        从磁盘存储取出给定 Fish 的向量并经过 feature_head 变换,供压缩索引精确重排使用
+        """
+        found_ids, vectors = self.embedding_store.get_vectors(fish_ids)
+        return found_ids, self.feature_head.transform(vectors)
+
+    def load_exact_index(self, fish_ids: np.ndarray, vectors: np.ndarray,
+                         refreshed_ids: List[int]) -> SimilarityIndex:
+        """
+        按 EMBEDDING_STORAGE 配置构建精确检索索引:float32 原样存储,float16 半精度存储,pq 乘积量化存储
+
+        压缩存储时可以配置 SEARCH_RERANK,从 mmap 的磁盘存储中取出候选的原始向量重新精确打分。
+        配置 SEARCH_SHARED 时,float32 矩阵发布到所有 worker 共享的 mmap 快照中,而不是每个进程各保存一份
+
+        参数:
+        fish_ids (np.ndarray): 当前图库的 Fish id 数组
+        vectors (np.ndarray): 与 fish_ids 对应的 (经过 feature_head 变换的) 向量矩阵
+        refreshed_ids (List[int]): 本次启动时重新计算过向量的 Fish id
+
+        返回:
+        SimilarityIndex: 精确检索索引
+        """
+        config = current_app.config
+
+        if config.get('SEARCH_SHARED', False):
+            gallery = SharedGallery(self.artifact_path('shared'))
+            # 快照已与当前图库一致时直接 attach,只有第一个发现不一致 (包括向量维度不同) 的 worker 需要重新发布
+            _, shared_ids, shared_matrix = gallery.attach()
+            if refreshed_ids or set(shared_ids.tolist()) != set(fish_ids.tolist()) or \
+                    (len(shared_ids) > 0 and shared_matrix.shape[1] != vectors.shape[1]):
+                gallery.publish(fish_ids, SimilarityIndex.normalize(vectors))
+            return SharedIndex(gallery)
+        storage = config.get('EMBEDDING_STORAGE', 'float32')
+        rerank = config.get('SEARCH_RERANK', 0)
+
+        if storage == 'float16':
+            index = Float16Index(rerank=rerank, vector_source=self.gallery_vectors)
+            index.add(fish_ids, vectors)
+            return index
+
+        if storage == 'pq':
+            index = self.load_pq_index(fish_ids, vectors)
+            if index is not None:
+                return index
+            self._pq_pending = True
+            current_app.logger.warning(f'Gallery of {len(fish_ids)} vectors is too small to train a PQ codebook, '
+                                       f'using float32 storage until it grows')
+
+        return SimilarityIndex(fish_ids, SimilarityIndex.normalize(vectors))
+
+    def load_pq_index(self, fish_ids: np.ndarray, vectors: np.ndarray) -> Optional[PQIndex]:
+        """
+        加载保存的 PQ 码本 (或在当前图库上训练一个新的) 并编码图库向量
+
+        码本训练代价较高,训练一次后保存在向量存储目录中,所有 worker 和之后的启动都直接复用;
+        与 IVF 一样,图库规模超过训练时的两倍或维度变化时重新训练
+
+        参数:
+        fish_ids (np.ndarray): 当前图库的 Fish id 数组
+        vectors (np.ndarray): 与 fish_ids 对应的 (经过 feature_head 变换的) 向量矩阵
+
+        返回:
+        Optional[PQIndex]: PQ 索引;没有可用的码本且图库不足 min_train_size 条无法训练时返回 None
+        """
+        config = current_app.config
+        n_subvectors = config.get('PQ_SUBVECTORS', 64)
+        codebook_path = self.artifact_path(f'pq-{n_subvectors}.npz')
+        quantizer = ProductQuantizer.load(codebook_path) if os.path.exists(codebook_path) else None
+        if quantizer is not None and (len(fish_ids) > 2 * quantizer.trained_count or
+                                      quantizer.dim != vectors.shape[1]):
+            current_app.logger.info(f'Retraining PQ codebook: trained on {quantizer.trained_count} vectors, '
+                                    f'gallery now has {len(fish_ids)}')
+            quantizer = None
+        if quantizer is None and len(fish_ids) < ProductQuantizer(n_subvectors=n_subvectors).min_train_size:
+            return None
+        index = PQIndex.build(fish_ids, vectors, n_subvectors=n_subvectors, quantizer=quantizer,
+                              rerank=config.get('SEARCH_RERANK', 0), vector_source=self.gallery_vectors)
+        if quantizer is None:
+            index.quantizer.save(codebook_path)
+        return index
+
+    def _build_pending_pq_index(self):
+        # 调用方需持有 _index_lock;启动时图库太小而暂用 float32 的索引,在图库足够训练码本后换成 PQ 索引
+        if not self._pq_pending:
+            return
+        ids, matrix = self.fish_index.ids, self.fish_index.matrix
+        index = self.load_pq_index(ids, matrix)
+        if index is not None:
+            current_app.logger.info(f'Gallery reached {len(ids)} vectors, switched to PQ storage')
+            self.fish_index, self._pq_pending = index, False
+            # 新索引的 generation 从头计数,可能与旧索引缓存的结果重复
+            if self.result_cache is not None:
+                self.result_cache.clear()
+
+    def load_ivf_index(self, fish_ids: np.ndarray, vectors: np.ndarray, refreshed_ids: List[int]) -> IVFIndex:
+        """
+        加载持久化的 IVF 索引并与当前图库同步;索引不存在或图库规模已超过训练时的两倍时重新训练
+
+        参数:
+        fish_ids (np.ndarray): 当前图库的 Fish id 数组
+        vectors (np.ndarray): 与 fish_ids 对应的 (经过 feature_head 变换的) 向量矩阵
+        refreshed_ids (List[int]): 本次启动时重新计算过向量的 Fish id
+
+        返回:
+        IVFIndex: 与当前图库一致的 IVF 索引
+        """
+        config = current_app.config
+        index_path = self.artifact_path('ivf.npz')
+
+        index = IVFIndex.load(index_path) if os.path.exists(index_path) else None
+        if index is not None:
+            # 删除已不存在的 Fish,补充新增或向量已更新的 Fish,新向量直接分配到已有的簇
+            current = set(fish_ids.tolist())
+            index.remove([fish_id for fish_id in index.ids.tolist() if fish_id not in current])
+            changed = set(refreshed_ids)
+            missing = np.array([fish_id not in index or fish_id in changed for fish_id in fish_ids.tolist()],
+                               dtype=bool)
+            index.add(fish_ids[missing], vectors[missing])
+
+        if index is None or not index.is_trained or len(index) > 2 * index.trained_count or \
+                (len(index) > 0 and index.dim != vectors.shape[1]):
+            index = IVFIndex.build(fish_ids, vectors, n_lists=config.get('IVF_N_LISTS'))
+        index.n_probe = config.get('IVF_N_PROBE', 8)
+        index.save(index_path)
+
+        # 用图库中的部分向量作为查询,记录当前参数下相对精确检索的召回率
+        if len(index) > 0:
+            sample = vectors[np.random.default_rng(0).choice(len(vectors), min(len(vectors), 100), replace=False)]
+            current_app.logger.info(f'IVF index: {len(index)} vectors, {index.n_lists} lists, '
+                                    f'n_probe={index.n_probe}, recall@5={index.recall(sample, top_k=5):.3f}')
+        return index
+
+    @staticmethod
+    def embed_fish(fish_list: List[Tuple[int, str]], model_registry: ModelRegistry, embedding_store: EmbeddingStore,
+                   progress: Callable[[int, int, int], None] = None) -> List[tuple]:
+        """
+        通过批量并行流水线计算给定 Fish 的向量,每完成一个批量就写入磁盘存储
+
+        参数:
+        fish_list (List[Tuple[int, str]]): (Fish id, 图片 URL) 列表
+        model_registry (ModelRegistry): 模型注册表
+        embedding_store (EmbeddingStore): 向量存储
+        progress (Callable[[int, int, int], None]): 进度回调,参数为 (已完成数, 失败数, 总数)
+
+        返回:
+        List[tuple]: 处理失败的 (Fish id, 图片 URL, 异常) 列表
+        """
+        config = current_app.config
+        pipeline = IndexingPipeline(
+            model_registry,
+            download_workers=config.get('INDEXING_DOWNLOAD_WORKERS', 8),
+            decode_workers=config.get('INDEXING_DECODE_WORKERS'),
+            batch_size=config.get('INDEXING_BATCH_SIZE', 32),
+            queue_size=config.get('INDEXING_QUEUE_SIZE', 64),
+            progress=progress,
+        )
+        for fish_ids, image_urls, vectors in pipeline.run(fish_list):
+            embedding_store.put_many(fish_ids, image_urls, vectors)
+        return pipeline.failures
+
+    @classmethod
+    def reindex(cls, full: bool = False, progress: Callable[[int, int, int], None] = None) -> Tuple[int, List[tuple]]:
+        """
+        为整个 Fish 表重建磁盘上的向量存储,不需要创建 FishService 实例,可以在 Web 进程之外运行
+
+        重新计算的向量追加在向量文件末尾,完成后压缩存储,回收旧向量和已删除 Fish 占用的行
+
+        参数:
+        full (bool): 为 True 时重新计算所有 Fish 的向量,否则只计算缺失或过期的
+        progress (Callable[[int, int, int], None]): 进度回调,参数为 (已完成数, 失败数, 总数)
+
+        返回:
+        Tuple[int, List[tuple]]: (需要计算的 Fish 数量, 处理失败的 (Fish id, 图片 URL, 异常) 列表)
+        """
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        model_registry = cls.create_model_registry(device)
+        embedding_store = cls.create_embedding_store(model_registry)
+
+        fish_list = [(fish.id, fish.image_url) for fish in db.session.query(Fish.id, Fish.image_url).all()
+                     if full or not embedding_store.is_fresh(fish.id, fish.image_url)]
+        failures = cls.embed_fish(fish_list, model_registry, embedding_store, progress=progress)
+        embedding_store.compact()
+        return len(fish_list), failures
+
+    @classmethod
+    def check_backend(cls, backend: str, top_k: int = 5) -> Tuple[dict, List[tuple]]:
+        """
+        在样本图片上比较给定推理后端与 eager 模式的输出向量和 top-k 检索结果
+
+        top-k 结果在磁盘向量存储中 eager 模式生成的图库上比较,存储为空时以样本图片自身作为图库
+
+        参数:
+        backend (str): 待检查的推理后端
+        top_k (int): 比较的 top-k 数量
+
+        返回:
+        Tuple[dict, List[tuple]]: (parity_report 的结果, 无法解码的 (图片路径, 异常) 列表)
+        """
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        reference_registry = cls.create_model_registry(device, backend='eager')
+        candidate_registry = cls.create_model_registry(device, backend=backend)
+
+        images, skipped = [], []
+        for path in cls.sample_image_paths(current_app.config.get('MODEL_SAMPLE_DIRS', ['dataset', 'uploads'])):
+            try:
+                images.append(reference_registry.transform(path))
+            except OSError as e:
+                skipped.append((path, e))
+        if not images:
+            raise ValueError('No decodable sample images found')
+
+        batch = torch.stack(images)
+        reference = reference_registry.forward(batch).cpu().numpy()
+        candidate = candidate_registry.forward(batch).cpu().numpy()
+
+        embedding_store = cls.create_embedding_store(reference_registry)
+        gallery_ids, gallery = embedding_store.get_vectors(list(embedding_store.entries))
+        if gallery_ids.shape[0] == 0:
+            gallery_ids, gallery = np.arange(reference.shape[0], dtype=np.int64), reference
+        return parity_report(reference, candidate, gallery_ids, gallery, top_k=top_k), skipped
+
+    def add_fish(self, fish_id: int, image_url: str):
+        """
+        将一条新的 Fish 加入图库,磁盘上已有且未过期的向量会直接复用
+
+        参数:
+        fish_id (int): Fish id
+        image_url (str): Fish 的图片 URL
+        """
+        if not self.embedding_store.is_fresh(fish_id, image_url):
+            self.replace_fish(fish_id, image_url)
+            return
+
+        fish_ids, vectors = self.gallery_vectors([fish_id])
+        with self._index_lock:
+            self.fish_index.add(fish_ids, vectors)
+            self._mark_indexed(fish_ids)
+            self._build_pending_pq_index()
+
+    def replace_fish(self, fish_id: int, image_url: str):
+        """
+        重新下载图片并计算向量,替换图库和磁盘存储中该 Fish 的向量 (不存在时新增)
+
+        参数:
+        fish_id (int): Fish id
+        image_url (str): Fish 的图片 URL
+        """
+        vector = self.calculate_image_vector(image_url)
+        self.embedding_store.put_many([fish_id], [image_url], vector[np.newaxis, :])
+        with self._index_lock:
+            self.fish_index.add([fish_id], self.feature_head.transform(vector[np.newaxis, :]))
+            self._mark_indexed([fish_id])
+            self._build_pending_pq_index()
+
+    def remove_fish(self, fish_ids: List[int]):
+        """
+        从图库和磁盘存储中删除给定 Fish 的向量
+
+        参数:
+        fish_ids (List[int]): Fish id 列表
         """
-        在项目启动时,下载所有 Fish 对象的图片并计算向量数据,存储在内存中
+        self.embedding_store.remove_many(fish_ids)
+        with self._index_lock:
+            self.fish_index.remove(fish_ids)
+            for fish_id in fish_ids:
+                self._indexed.pop(int(fish_id), None)
+
+    def _mark_indexed(self, fish_ids: List[int]):
+        # 调用方需持有 _index_lock
+        for fish_id in fish_ids:
+            entry = self.embedding_store.entries.get(int(fish_id))
+            if entry is not None:
+                self._indexed[int(fish_id)] = entry['url_hash']
+
+    def sync_index(self):
+        """
+        把其他进程 (例如领取了 index_fish 任务的 worker) 对向量存储的修改同步到本进程的图库
+
+        向量存储未变化时只有一次 stat;变化时与上次同步时的 fish id -> 图片 URL 哈希比较,
+        删除已不在存储中的 Fish,加入新增或向量已更新的 Fish。共享快照模式下各 worker 的修改已经通过快照发布,不需要同步
         """
-        fish_vectors = {}
-        fish_list = Fish.query.all()
-        for fish in fish_list:
-            image_vector = self.calculate_image_vector(fish.image_url)
-            fish_vectors[fish.id] = image_vector
-        return fish_vectors
+        if isinstance(self.fish_index, SharedIndex):
+            return
+        self.embedding_store.refresh()
+        if self.embedding_store.revision == self._indexed_revision:
+            return
+        with self._index_lock:
+            revision, current = self.embedding_store.url_hashes()
+            if revision == self._indexed_revision:
+                return
+            removed = [fish_id for fish_id in self._indexed if fish_id not in current]
+            changed = [fish_id for fish_id, url_hash in current.items() if self._indexed.get(fish_id) != url_hash]
+            if removed:
+                self.fish_index.remove(removed)
+            if changed:
+                self.fish_index.add(*self.gallery_vectors(changed))
+                self._build_pending_pq_index()
+            self._indexed, self._indexed_revision = current, revision
 
     def find_top_k_similar_fish(self, image_vector: np.ndarray, top_k: int = 5) -> List[Fish]:
         """
-        根据给定的图片 URL,查找前 top_k 个最相似的鱼类
+        根据给定的图片向量,查找前 top_k 个最相似的鱼类
 
         参数:
         image_vector (np.ndarray): 待查找的图片向量
         top_k (int): 需要返回的最相似鱼类的数量
 
         返回:
-        List[Fish]: 前 top_k 个最相似的鱼类对象列表
+        List[Fish]: 前 top_k 个最相似的 (Fish, FishType) 列表,按相似度从高到低排列
         """
-        similarities = []
-        for fish_id, fish_vector in self.fish_vectors.items():
-            distance = cosine(image_vector, fish_vector)
-            similarities.append((fish_id, distance))
+        return self.find_top_k_similar_fish_batch(np.atleast_2d(image_vector), top_k=top_k)[0]
 
-        similarities.sort(key=lambda x: x[1])
-        top_k_fish_ids = [x[0] for x in similarities[:top_k]]
+    def find_top_k_similar_fish_batch(self, image_vectors: np.ndarray, top_k: int = 5) -> List[List[Fish]]:
+        """
+        一次性为多个图片向量查找前 top_k 个最相似的鱼类,所有查询共用一次矩阵乘法和一次数据库查询
+
+        参数:
+        image_vectors (np.ndarray): 待查找的图片向量矩阵,形状为 (Q, D)
+        top_k (int): 每个查询需要返回的最相似鱼类的数量
 
-        top_k_fish = (
+        返回:
+        List[List[Fish]]: 每个查询对应一个 (Fish, FishType) 列表,按相似度从高到低排列
+        """
+        self.sync_index()
+        image_vectors = self.feature_head.transform(np.atleast_2d(image_vectors))
+        if self.result_cache is None:
+            return self._load_ranked_fish(self.fish_index.search_batch(image_vectors, top_k))
+
+        # 图库每次变化 generation 都会改变,旧的缓存结果不会再被命中,等待 TTL 或 LRU 淘汰即可
+        generation = self.fish_index.generation
+        keys = [(self.content_hash(vector), top_k, generation) for vector in image_vectors]
+        results = [self.result_cache.get(key) for key in keys]
+
+        misses = [i for i, ranked in enumerate(results) if ranked is None]
+        if misses:
+            for i, ranked in zip(misses, self.fish_index.search_batch(image_vectors[misses], top_k)):
+                results[i] = ranked
+                self.result_cache.put(keys[i], ranked, size=self.RANKED_ENTRY_BYTES * (len(ranked) + 1))
+        return self._load_ranked_fish(results)
+
+    def _load_ranked_fish(self, results: List[List[tuple]]) -> List[List[Fish]]:
+        # 一次查询取回所有命中的 Fish,再按各查询的相似度顺序重新排列
+        fish_ids = {fish_id for ranked in results for fish_id, _ in ranked}
+        if not fish_ids:
+            return [[] for _ in results]
+
+        rows = (
             db.session.query(Fish, FishType)
-            .filter(Fish.id.in_(top_k_fish_ids))
+            .filter(Fish.id.in_(fish_ids))
             .join(FishType, Fish.fish_type_id == FishType.id)
             .all()
         )
+        rows_by_id = {fish.id: (fish, fish_type) for fish, fish_type in rows}
 
-        return top_k_fish
+        return [
+            [rows_by_id[fish_id] for fish_id, _ in ranked if fish_id in rows_by_id]
+            for ranked in results
+        ]
 
     def calculate_image_vector(self, image_url: str) -> np.ndarray:
         """
@@ -77,21 +568,12 @@ class FishService:
         返回:
         np.ndarray: 图片的向量表示
         """
-        # 下载图片
+        # 下载图片,直接在内存中解码,不再写入 uploads/ 目录
         print('Downloading image:', image_url)
-        response = requests.get(image_url)
-        image_path = os.path.join('uploads', os.path.basename(image_url))
-        with open(image_path, 'wb') as f:
-            f.write(response.content)
-
-        # 计算图片向量
-        # 这里需要实现具体的图像特征提取算法,比如使用预训练的深度学习模型
-        image_vector = self.extract_image_features(image_path)
+        response = requests.get(image_url, timeout=30)
+        response.raise_for_status()
 
-        # 删除临时文件
-        os.remove(image_path)
-
-        return image_vector
+        return self.extract_image_features(response.content)
 
     def calculate_image_vector_binary(self, image_binary: bytes) -> np.ndarray:
         """
@@ -103,56 +585,85 @@ class FishService:
         返回:
         np.ndarray: 图片的向量表示
         """
-        # 将二进制数据保存到临时文件
-        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-            tmp_file.write(image_binary)
-            tmp_file.flush()
-            image_path = tmp_file.name
+        return self.extract_image_features(image_binary)
 
-        # 计算图片向量
-        image_vector = self.extract_image_features(image_path)
+    @staticmethod
+    def open_image(image: Union[str, bytes, BinaryIO, Image.Image]) -> Image.Image:
+        """
+        将各种形式的图片输入统一解码为 RGB 格式的 PIL 图像,安装了 pillow-heif 时也支持 HEIC
 
-        # 删除临时文件
-        os.remove(image_path)
+        参数:
+        image (Union[str, bytes, BinaryIO, Image.Image]): 图片路径、二进制数据、文件对象或 PIL 图像
 
-        return image_vector
+        返回:
+        Image.Image: RGB 格式的 PIL 图像
+        """
+        return open_image(image).convert('RGB')
 
-    def extract_image_features(self, image_path: str) -> np.ndarray:
+    @staticmethod
+    def content_hash(data: Union[np.ndarray, torch.Tensor]) -> str:
+        """
+        计算张量或数组内容的摘要,用作查询缓存的键
+        """
+        if isinstance(data, torch.Tensor):
+            data = data.cpu().numpy()
+        return hashlib.blake2b(np.ascontiguousarray(data).tobytes(), digest_size=16).hexdigest()
+
+    def cache_metrics(self) -> dict:
+        """
+        返回查询向量缓存和 top-k 结果缓存的命中统计,未启用的缓存为空
+        """
+        return {
+            'embedding': self.embedding_cache.stats() if self.embedding_cache is not None else {},
+            'result': self.result_cache.stats() if self.result_cache is not None else {},
+        }
+
+    def extract_image_features(self, image: Union[str, bytes, BinaryIO, Image.Image]) -> np.ndarray:
         """
         图像特征向量可以用于计算图像之间的相似度。
         一般来说,使用余弦相似度是一种常见的方法来比较两个向量的相似程度。
         余弦相似度可以反映两个向量之间的夹角大小,值域范围为[-1, 1]。
         当两个向量完全相同时,余弦相似度为1;当两个向量完全正交时,余弦相似度为0;当两个向量完全相反时,余弦相似度为-1
-        """
 
-        # Load the pre-trained model
-        # ResNet-50 是目前最广泛使用的卷积神经网络模型之一,它在各种图像分类任务上表现都非常优秀
-        model = models.resnet50(pretrained=True).to(self.device)
-        # 将模型设置为评估模式,禁用诸如 Dropout 和 BatchNorm 等层的训练行为
-        model.eval()  # Set the model to evaluation mode
-
-        # Define the image transformations
-        transform = transforms.Compose([
-            transforms.Resize(256),
-            transforms.CenterCrop(224), # 从图像中心裁剪出 224x224 大小的区域
-            transforms.ToTensor(), # 将 PIL 图像转换为 PyTorch 张量
-            # 使用 ImageNet 数据集的平均值和标准差对图像进行归一化
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-        ])
+        参数:
+        image (Union[str, bytes, BinaryIO, Image.Image]): 图片路径、二进制数据、文件对象或 PIL 图像
+        """
 
-        # Load the image
-        # 从给定路径加载图像,并确保图像格式为 RGB
-        image = Image.open(image_path).convert('RGB')
-
-        # Apply the transformations
-        # 对图像应用上述定义的转换操作,得到一个 PyTorch 张量
-        # 在第一个维度上添加一个批量维度,因为模型的输入需要是一个批量的图像
-        image_tensor = transform(image).unsqueeze(0).to(self.device)
+        # 解码图像并应用预处理,得到一个 PyTorch 张量
+        # JPEG 按缩小的尺寸解码,预处理流水线由 model_registry 在进程内只构建一次
+        if self.inference_scheduler is not None:
+            # 张量会在调度器队列中等待凑批,不能复用缓冲区
+            image_tensor = self.model_registry.transform(image)
+        else:
+            image_tensor = self.model_registry.transform(image, out=self._input_buffer()[0])
+
+        # 以解码并预处理后的像素内容和模型版本作为缓存键,同一张图片换了文件名或元数据也能命中
+        if self.embedding_cache is not None:
+            cache_key = (self.content_hash(image_tensor), self.model_registry.embedding_version)
+            features_np = self.embedding_cache.get(cache_key)
+            if features_np is None:
+                features_np = self._forward_single(image_tensor)
+                features_np.flags.writeable = False
+                self.embedding_cache.put(cache_key, features_np, size=features_np.nbytes)
+            return features_np
+        return self._forward_single(image_tensor)
+
+    def _input_buffer(self) -> torch.Tensor:
+        # 每个线程一个预先分配的 (1, 3, 224, 224) 输入缓冲区,预处理直接写入,每次请求不再重新分配
+        buffer = getattr(self._buffers, 'input', None)
+        if buffer is None:
+            buffer = self._buffers.input = torch.empty((1, 3, 224, 224), dtype=torch.float32)
+        return buffer
+
+    def _forward_single(self, image_tensor: torch.Tensor) -> np.ndarray:
+        # 开启微批量推理时,与其他并发请求合并为一个批量执行前向传播
+        if self.inference_scheduler is not None:
+            return self.inference_scheduler.infer(image_tensor)
 
         # Forward pass to get the output from the last hidden layer
         # 对转换后的图像tensor进行前向传播,得到模型最后一个隐藏层的输出
-        with torch.no_grad():
-            features = model(image_tensor)
+        # 在第一个维度上添加一个批量维度,因为模型的输入需要是一个批量的图像
+        features = self.model_registry.forward(image_tensor.unsqueeze(0))
 
         # Convert the features to a 1-D NumPy array
         # 去掉批量维度,得到一个 1D 的特征向量
@@ -160,4 +671,3 @@ class FishService:
         features_np = features.squeeze(0).cpu().numpy().flatten()  # Flatten the array
 
         return features_np
-
@@ -0,0 +1,185 @@
+import multiprocessing
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, List, Tuple
+
+import numpy as np
+import requests
+import torch
+
+from service.model_registry import ModelRegistry
+
+# 解码进程内的预处理流水线,每个进程只构建一次
+_process_transform = None
+
+
+def _decode_image(content: bytes) -> np.ndarray:
+    """
+    在解码进程中执行:解码图片、缩放裁剪并归一化,返回形状为 (3, 224, 224) 的 float32 数组
+    """
+    global _process_transform
+    if _process_transform is None:
+        _process_transform = ModelRegistry.build_transform()
+    return _process_transform(content).numpy()
+
+
+class IndexingPipeline:
+    """
+    图库向量的流式批量计算流水线
+
+    三个阶段并行执行:
+    1. 下载: 多个线程并发下载图片,结果放入有界队列,队列满时下载线程阻塞,内存占用有上限
+    2. 解码: 进程池并行解码并缩放图片,绕开 GIL
+    3. 推理: 每凑满 batch_size 张图片执行一次前向传播
+
+    单张图片下载或解码失败时只记录到 failures 中并跳过,不会中断整个流程。
+    """
+
+    def __init__(self, model_registry: ModelRegistry, download_workers: int = 8, decode_workers: int = None,
+                 batch_size: int = 32, queue_size: int = 64, progress: Callable[[int, int, int], None] = None):
+        """
+        参数:
+        model_registry (ModelRegistry): 用于前向传播的模型注册表
+        download_workers (int): 下载线程数
+        decode_workers (int): 解码进程数,为 0 时在当前进程内解码,为空时使用 CPU 核数
+        batch_size (int): 每次前向传播的图片数量
+        queue_size (int): 已下载但尚未解码的图片数量上限
+        progress (Callable[[int, int, int], None]): 进度回调,参数为 (已完成数, 失败数, 总数)
+        """
+        self.model_registry = model_registry
+        self.download_workers = download_workers
+        self.decode_workers = multiprocessing.cpu_count() if decode_workers is None else decode_workers
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.progress = progress
+        self.failures = []
+        self._done = 0
+        self._total = 0
+
+    def run(self, fish_list: List[Tuple[int, str]]) -> Iterator[Tuple[List[int], List[str], np.ndarray]]:
+        """
+        为给定的 Fish 计算向量,每完成一个批量就产出一次结果
+
+        参数:
+        fish_list (List[Tuple[int, str]]): (Fish id, 图片 URL) 列表
+
+        返回:
+        Iterator[Tuple[List[int], List[str], np.ndarray]]: 每个批量的 (Fish id 列表, 图片 URL 列表, 向量矩阵)
+        """
+        self.failures = []
+        self._done = 0
+        self._total = len(fish_list)
+        if not fish_list:
+            return
+
+        downloaded = queue.Queue(maxsize=self.queue_size)
+        stopped = threading.Event()
+        threading.Thread(target=self._download_all, args=(list(fish_list), downloaded, stopped), daemon=True).start()
+
+        try:
+            if self.decode_workers > 0:
+                # 使用 spawn 启动解码进程,避免 fork 已经初始化过 torch 线程池的父进程导致死锁
+                context = multiprocessing.get_context('spawn')
+                with ProcessPoolExecutor(max_workers=self.decode_workers, mp_context=context) as executor:
+                    yield from self._decode_and_embed(downloaded, executor)
+            else:
+                yield from self._decode_and_embed(downloaded, None)
+        finally:
+            # 调用方提前结束迭代时,让仍阻塞在队列上的下载线程退出
+            stopped.set()
+
+    @staticmethod
+    def _put(downloaded: queue.Queue, item, stopped: threading.Event):
+        while not stopped.is_set():
+            try:
+                downloaded.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _download_all(self, fish_list: List[Tuple[int, str]], downloaded: queue.Queue, stopped: threading.Event):
+        pending = iter(fish_list)
+        pending_lock = threading.Lock()
+
+        def worker():
+            # 每个线程复用自己的 Session,保持与 OSS 的长连接
+            session = requests.Session()
+            while True:
+                with pending_lock:
+                    item = next(pending, None)
+                if item is None or stopped.is_set():
+                    break
+                fish_id, image_url = item
+                try:
+                    response = session.get(image_url, timeout=30)
+                    response.raise_for_status()
+                    self._put(downloaded, (fish_id, image_url, response.content, None), stopped)
+                except requests.RequestException as e:
+                    self._put(downloaded, (fish_id, image_url, None, e), stopped)
+
+        workers = [threading.Thread(target=worker, daemon=True) for _ in range(self.download_workers)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        # 哨兵,通知解码阶段所有下载都已结束
+        self._put(downloaded, None, stopped)
+
+    def _decode_and_embed(self, downloaded: queue.Queue, executor: ProcessPoolExecutor):
+        in_flight = deque()
+        batch = []
+        finished = False
+
+        while not finished or in_flight:
+            # 控制同时在解码的图片数量,避免已下载的数据在内存中无限堆积
+            while not finished and len(in_flight) < max(self.decode_workers, 1) * 2:
+                item = downloaded.get()
+                if item is None:
+                    finished = True
+                    break
+                fish_id, image_url, content, error = item
+                if error is not None:
+                    self._fail(fish_id, image_url, error)
+                    continue
+                if executor is None:
+                    in_flight.append((fish_id, image_url, None, content))
+                else:
+                    in_flight.append((fish_id, image_url, executor.submit(_decode_image, content), None))
+
+            if not in_flight:
+                continue
+
+            fish_id, image_url, future, content = in_flight.popleft()
+            try:
+                tensor = future.result() if future is not None else _decode_image(content)
+            except Exception as e:
+                self._fail(fish_id, image_url, e)
+                continue
+
+            batch.append((fish_id, image_url, tensor))
+            if len(batch) >= self.batch_size:
+                yield self._embed(batch)
+                batch = []
+
+        if batch:
+            yield self._embed(batch)
+
+    def _embed(self, batch: List[Tuple[int, str, np.ndarray]]) -> Tuple[List[int], List[str], np.ndarray]:
+        fish_ids = [fish_id for fish_id, _, _ in batch]
+        image_urls = [image_url for _, image_url, _ in batch]
+        images = torch.from_numpy(np.stack([tensor for _, _, tensor in batch]))
+        vectors = self.model_registry.forward(images).cpu().numpy()
+
+        self._done += len(batch)
+        self._report()
+        return fish_ids, image_urls, vectors
+
+    def _fail(self, fish_id: int, image_url: str, error: Exception):
+        self.failures.append((fish_id, image_url, error))
+        self._report()
+
+    def _report(self):
+        if self.progress is not None:
+            self.progress(self._done, len(self.failures), self._total)
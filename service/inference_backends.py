@@ -0,0 +1,156 @@
+import os
+from typing import Callable, Dict, List
+
+import numpy as np
+import torch
+import torchvision.models.quantization as quantized_models
+
+from service.similarity_index import SimilarityIndex
+
+BACKENDS = ('eager', 'torchscript', 'onnx', 'int8_dynamic', 'int8_static')
+
+# 这些后端的输出与 eager 模式在浮点误差范围内一致,可以与 eager 模式生成的图库向量混用
+EXACT_BACKENDS = ('eager', 'torchscript', 'onnx')
+
+
+def configure_threads(num_threads: int = None):
+    """
+    设置当前进程 torch 的计算线程数
+
+    同一台主机上运行多个 worker 时,每个 worker 默认都会使用全部核心,线程数相加远超核心数,
+    互相抢占反而更慢;通常设置为 核心数 / worker 数
+
+    参数:
+    num_threads (int): 线程数,为空时保持 torch 的默认值
+    """
+    if not num_threads:
+        return
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # interop 线程池只能在第一次并行计算之前设置
+        pass
+
+
+def build_backend(name: str, model: torch.nn.Module, device: torch.device, channels_last: bool = False,
+                  onnx_path: str = None, num_threads: int = None,
+                  calibration: List[torch.Tensor] = None) -> Callable[[torch.Tensor], torch.Tensor]:
+    """
+    将 eager 模式的模型编译为指定的推理后端
+
+    参数:
+    name (str): 后端名称,取值见 BACKENDS
+    model (torch.nn.Module): eval 模式下的 float32 模型
+    device (torch.device): 模型所在的设备
+    channels_last (bool): 是否使用 channels-last 内存格式,CPU 上的卷积通常更快
+    onnx_path (str): onnx 后端导出模型的文件路径,文件已存在时直接加载
+    num_threads (int): onnx 后端的计算线程数
+    calibration (List[torch.Tensor]): int8_static 后端用于统计激活值范围的校准图像张量
+
+    返回:
+    Callable[[torch.Tensor], torch.Tensor]: 输入形状为 (N, 3, 224, 224) 的图像张量,返回模型输出
+    """
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown inference backend: {name}, expected one of {", ".join(BACKENDS)}')
+    if name.startswith('int8') and device.type != 'cpu':
+        raise ValueError(f'Inference backend {name} only runs on CPU')
+
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    example = torch.zeros(1, 3, 224, 224, device=device)
+
+    if name == 'onnx':
+        return _build_onnx(model, example, onnx_path, num_threads)
+
+    if name == 'int8_dynamic':
+        # 动态量化只支持全连接层,ResNet-50 中只有最后的 fc 层会被量化,卷积仍然是 float32
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif name == 'int8_static':
+        model = _quantize_static(model, calibration)
+    else:
+        model = model.to(memory_format=memory_format)
+
+    if name == 'torchscript':
+        with torch.no_grad():
+            model = torch.jit.freeze(torch.jit.trace(model, example.to(memory_format=memory_format)))
+
+    def forward(batch: torch.Tensor) -> torch.Tensor:
+        with torch.no_grad():
+            return model(batch.to(device).contiguous(memory_format=memory_format))
+
+    return forward
+
+
+def _build_onnx(model: torch.nn.Module, example: torch.Tensor, onnx_path: str,
+                num_threads: int = None) -> Callable[[torch.Tensor], torch.Tensor]:
+    try:
+        import onnxruntime
+    except ImportError:
+        raise RuntimeError('The onnx inference backend requires onnxruntime: pip install onnxruntime')
+
+    if not os.path.exists(onnx_path):
+        os.makedirs(os.path.dirname(onnx_path) or '.', exist_ok=True)
+        tmp_path = f'{onnx_path}.{os.getpid()}.tmp'
+        torch.onnx.export(model, example, tmp_path, input_names=['images'], output_names=['features'],
+                          dynamic_axes={'images': {0: 'batch'}, 'features': {0: 'batch'}})
+        os.replace(tmp_path, onnx_path)
+
+    options = onnxruntime.SessionOptions()
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+    session = onnxruntime.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+
+    def forward(batch: torch.Tensor) -> torch.Tensor:
+        (features,) = session.run(None, {'images': batch.cpu().numpy()})
+        return torch.from_numpy(features)
+
+    return forward
+
+
+def _quantize_static(model: torch.nn.Module, calibration: List[torch.Tensor]) -> torch.nn.Module:
+    # 静态量化需要在残差相加等位置插入量化节点,使用 torchvision 的可量化 ResNet-50 结构加载同一份权重
+    if not calibration:
+        raise ValueError('Inference backend int8_static requires calibration images')
+    quantizable = quantized_models.resnet50(weights=None, quantize=False)
+    if isinstance(model.fc, torch.nn.Identity):
+        quantizable.fc = torch.nn.Identity()
+    quantizable.load_state_dict(model.state_dict())
+    quantizable.eval()
+    quantizable.fuse_model(is_qat=False)
+    quantizable.qconfig = torch.ao.quantization.get_default_qconfig('fbgemm')
+    torch.ao.quantization.prepare(quantizable, inplace=True)
+    with torch.no_grad():
+        for image_tensor in calibration:
+            quantizable(image_tensor.unsqueeze(0).cpu())
+    return torch.ao.quantization.convert(quantizable, inplace=True)
+
+
+def parity_report(reference: np.ndarray, candidate: np.ndarray, gallery_ids: np.ndarray,
+                  gallery: np.ndarray, top_k: int = 5) -> Dict[str, float]:
+    """
+    比较候选后端与 eager 模式在同一批图片上的输出
+
+    参数:
+    reference (np.ndarray): eager 模式的输出,形状为 (Q, D)
+    candidate (np.ndarray): 候选后端的输出,形状为 (Q, D)
+    gallery_ids (np.ndarray): 用于比较 top-k 结果的图库 Fish id
+    gallery (np.ndarray): 与 gallery_ids 对应的图库向量
+    top_k (int): 比较的 top-k 数量
+
+    返回:
+    Dict[str, float]: 最大绝对误差、最小余弦相似度、top-k 重合率和 top-1 一致率
+    """
+    cosine = np.sum(SimilarityIndex.normalize(reference) * SimilarityIndex.normalize(candidate), axis=1)
+    index = SimilarityIndex(gallery_ids, SimilarityIndex.normalize(gallery))
+    expected = index.search_batch(reference, top_k)
+    actual = index.search_batch(candidate, top_k)
+    overlap = [len({fish_id for fish_id, _ in a} & {fish_id for fish_id, _ in e}) / max(len(e), 1)
+               for a, e in zip(actual, expected)]
+    top1 = [bool(a) and bool(e) and a[0][0] == e[0][0] for a, e in zip(actual, expected)]
+    return {
+        'max_abs_diff': float(np.max(np.abs(reference - candidate))),
+        'min_cosine': float(np.min(cosine)),
+        'top_k_overlap': float(np.mean(overlap)),
+        'top1_agreement': float(np.mean(top1)),
+    }
@@ -0,0 +1,115 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import torch
+
+from service.model_registry import ModelRegistry
+
+
+class InferenceScheduler:
+    """
+    微批量推理调度器
+
+    并发请求各自完成解码和预处理后,把图像张量放入队列并拿到一个 Future。
+    后台线程从队列中取出请求,凑满 max_batch_size 个或等待超过 max_wait_ms 后执行一次前向传播,
+    再把每个请求对应的结果写回各自的 Future。
+    这样并发请求共用一次前向传播,也避免了多个线程同时推理时争抢 torch 的线程池。
+    """
+
+    def __init__(self, model_registry: ModelRegistry, max_batch_size: int = 16, max_wait_ms: float = 5):
+        """
+        参数:
+        model_registry (ModelRegistry): 用于前向传播的模型注册表
+        max_batch_size (int): 每批最多的图像数量
+        max_wait_ms (float): 收到第一张图像后最多等待多少毫秒来凑批
+        """
+        self.model_registry = model_registry
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        # 批量输入缓冲区只在调度线程中使用,每批直接写入而不是重新分配
+        self._batch_buffer = None
+        self._metrics_lock = threading.Lock()
+        self._batches = 0
+        self._images = 0
+        self._batch_sizes = {}
+        self._max_queue_depth = 0
+        self._thread = threading.Thread(target=self._run, name='inference-scheduler', daemon=True)
+        self._thread.start()
+
+    def submit(self, image_tensor: torch.Tensor) -> Future:
+        """
+        提交一张预处理后的图像,返回的 Future 在推理完成后得到一维的 NumPy 特征向量
+
+        参数:
+        image_tensor (torch.Tensor): 形状为 (3, 224, 224) 的图像张量
+
+        返回:
+        Future: 推理结果
+        """
+        future = Future()
+        self._queue.put((image_tensor, future))
+        with self._metrics_lock:
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return future
+
+    def infer(self, image_tensor: torch.Tensor, timeout: float = None) -> np.ndarray:
+        """
+        提交一张图像并等待结果
+        """
+        return self.submit(image_tensor).result(timeout=timeout)
+
+    def metrics(self) -> dict:
+        """
+        返回调度器的运行指标:当前队列深度、历史最大队列深度、批次数、平均批大小和批大小分布
+        """
+        with self._metrics_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_queue_depth,
+                'batches': self._batches,
+                'images': self._images,
+                'average_batch_size': self._images / self._batches if self._batches else 0,
+                'batch_size_histogram': dict(sorted(self._batch_sizes.items())),
+            }
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # 已经在队列中的请求直接取走,队列为空时最多等到 deadline
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _stack(self, tensors: list) -> torch.Tensor:
+        shape = (self.max_batch_size,) + tuple(tensors[0].shape)
+        if self._batch_buffer is None or self._batch_buffer.shape != shape:
+            self._batch_buffer = torch.empty(shape, dtype=tensors[0].dtype)
+        return torch.stack(tensors, out=self._batch_buffer[:len(tensors)])
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            futures = [future for _, future in batch]
+            try:
+                images = self._stack([image_tensor for image_tensor, _ in batch])
+                features = self.model_registry.forward(images).cpu().numpy()
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            for future, vector in zip(futures, features):
+                future.set_result(vector.flatten())
+
+            with self._metrics_lock:
+                self._batches += 1
+                self._images += len(batch)
+                self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
@@ -0,0 +1,42 @@
+import os
+
+from app import db
+from model import Record
+from service.fish_service import FishService
+from service.job_queue import JobQueue
+from utils.OSSClient import OSSClient
+
+job_queue = JobQueue.get_instance()
+
+
+@job_queue.register('index_fish')
+def index_fish(payload: dict):
+    """
+    计算新 Fish 的图片向量并写入磁盘存储和图库索引
+    """
+    FishService.get_instance().add_fish(payload['fish_id'], payload['image_url'])
+
+
+@job_queue.register('upload_picture')
+def upload_picture(payload: dict):
+    """
+    把暂存在本地的图片断点续传到 OSS,完成后将 Record 标记为已上传并删除暂存文件
+
+    上传期间不持有数据库事务;重试时只上传上一次没有完成的分片。
+    """
+    local_path = payload['local_path']
+    if not os.path.exists(local_path):
+        # 上一次执行已经完成上传并删除了暂存文件,只是没来得及记录任务成功
+        status = db.session.query(Record.upload_status).filter(Record.id == payload['record_id']).scalar()
+        if status in (None, Record.UPLOADED):
+            return
+        raise FileNotFoundError(f'Staged upload {local_path} not found on this host')
+
+    OSSClient.get_instance().upload_local_file(payload['file_path'], local_path)
+    (
+        db.session.query(Record)
+        .filter(Record.id == payload['record_id'], Record.upload_status == Record.UPLOADING)
+        .update({'upload_status': Record.UPLOADED}, synchronize_session=False)
+    )
+    db.session.commit()
+    os.remove(local_path)
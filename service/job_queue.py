@@ -0,0 +1,206 @@
+import json
+import os
+import threading
+import traceback
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict
+
+from flask import Flask
+from sqlalchemy import and_, or_
+
+from app import db
+from model import Job
+
+
+class JobQueue:
+    """
+    基于数据库 job 表的后台任务队列
+
+    任务与业务数据在同一个事务中写入 (enqueue 只把任务加入当前会话,由调用方提交),
+    因此审核通过后的 Fish 和对应的建索引任务要么同时存在,要么都不存在。
+
+    每个 Web 进程内有若干个 worker 线程轮询 job 表,用 SELECT ... FOR UPDATE SKIP LOCKED 加条件更新领取任务,
+    多个进程之间不会重复执行同一个任务。
+    - 失败的任务按指数退避重新排队,达到 max_attempts 次后进入死信状态 (dead),等待管理员处理
+    - 领取任务后超过 lease 秒仍未完成的任务 (例如进程被杀掉) 会被其他 worker 重新领取
+    """
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self):
+        self.handlers: Dict[str, Callable[[dict], None]] = {}
+        self.poll_interval = 1.0
+        self.lease = timedelta(seconds=600)
+        self.retry_backoff = 10.0
+        self.max_attempts = 5
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._threads = []
+
+    @classmethod
+    def get_instance(cls) -> 'JobQueue':
+        if cls.__instance is None:
+            with cls.__instance_lock:
+                if cls.__instance is None:
+                    cls.__instance = cls()
+        return cls.__instance
+
+    def register(self, kind: str) -> Callable:
+        """
+        注册任务处理函数的装饰器,处理函数接收 enqueue 时传入的 payload,抛出异常表示本次执行失败
+
+        参数:
+        kind (str): 任务类型
+        """
+        def decorator(handler: Callable[[dict], None]) -> Callable[[dict], None]:
+            self.handlers[kind] = handler
+            return handler
+        return decorator
+
+    def enqueue(self, kind: str, payload: dict, max_attempts: int = None, delay: float = 0) -> Job:
+        """
+        将任务加入当前数据库会话,调用方提交事务后任务才对 worker 可见
+
+        参数:
+        kind (str): 任务类型
+        payload (dict): 可 JSON 序列化的任务参数
+        max_attempts (int): 最多执行次数,为空时使用队列的默认值
+        delay (float): 延迟多少秒后才可以执行
+
+        返回:
+        Job: 新建的任务
+        """
+        now = datetime.now(timezone.utc)
+        job = Job(kind=kind, payload=json.dumps(payload), status=Job.PENDING, attempts=0,
+                  max_attempts=max_attempts or self.max_attempts, run_at=now + timedelta(seconds=delay),
+                  created_at=now)
+        db.session.add(job)
+        self._wakeup.set()
+        return job
+
+    def start(self, app: Flask, workers: int = 2, poll_interval: float = 1.0, lease_seconds: float = 600,
+              retry_backoff: float = 10.0, max_attempts: int = 5):
+        """
+        启动 worker 线程
+
+        参数:
+        app (Flask): Flask 应用,worker 线程在其应用上下文中执行任务
+        workers (int): worker 线程数
+        poll_interval (float): 没有可执行任务时的轮询间隔 (秒)
+        lease_seconds (float): 任务执行超过这么多秒仍未完成时,允许被其他 worker 重新领取
+        retry_backoff (float): 第一次重试前的等待秒数,之后每次翻倍
+        max_attempts (int): 任务默认的最多执行次数
+        """
+        self.poll_interval = poll_interval
+        self.lease = timedelta(seconds=lease_seconds)
+        self.retry_backoff = retry_backoff
+        self.max_attempts = max_attempts
+        for i in range(workers - len(self._threads)):
+            thread = threading.Thread(target=self._run, args=(app,), name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def _run(self, app: Flask):
+        while not self._stopped.is_set():
+            with app.app_context():
+                try:
+                    worked = self.run_once()
+                except Exception as e:
+                    app.logger.error(f'Job worker error: {e}')
+                    worked = False
+                finally:
+                    db.session.remove()
+            if not worked:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def run_once(self) -> bool:
+        """
+        领取并执行一个任务,需要在应用上下文中调用
+
+        返回:
+        bool: 是否领取到了任务
+        """
+        job = self._claim()
+        if job is None:
+            return False
+        if job.status == Job.DEAD:
+            return True
+
+        job_id, kind, payload = job.id, job.kind, json.loads(job.payload)
+        handler = self.handlers.get(kind)
+        try:
+            if handler is None:
+                raise LookupError(f'No handler registered for job kind {kind}')
+            handler(payload)
+        except Exception as e:
+            # 处理函数可能留下未提交或已失败的事务,先回滚再记录结果
+            db.session.rollback()
+            self._fail(db.session.get(Job, job_id), e, retry=handler is not None)
+            return True
+
+        job = db.session.get(Job, job_id)
+        job.status = Job.SUCCEEDED
+        job.finished_at = datetime.now(timezone.utc)
+        job.last_error = None
+        db.session.commit()
+        return True
+
+    def _claim(self) -> Job:
+        now = datetime.now(timezone.utc)
+        job = (
+            Job.query
+            .filter(or_(and_(Job.status == Job.PENDING, Job.run_at <= now),
+                        and_(Job.status == Job.RUNNING, Job.locked_at < now - self.lease)))
+            .order_by(Job.run_at)
+            .with_for_update(skip_locked=True)
+            .first()
+        )
+        if job is None:
+            db.session.rollback()
+            return None
+
+        if job.attempts >= job.max_attempts:
+            # 只有租约过期的任务会走到这里: 最后一次执行时进程退出了
+            values = {'status': Job.DEAD, 'last_error': job.last_error or 'Lease expired', 'finished_at': now}
+        else:
+            values = {'status': Job.RUNNING, 'attempts': job.attempts + 1, 'locked_at': now,
+                      'locked_by': f'{os.getpid()}:{threading.current_thread().name}'}
+        # 以读到的状态和执行次数为条件更新,不支持 SKIP LOCKED 的数据库上两个 worker 同时读到同一个任务时只有一个能领取成功
+        claimed = (
+            Job.query
+            .filter(Job.id == job.id, Job.status == job.status, Job.attempts == job.attempts)
+            .update(values, synchronize_session=False)
+        )
+        db.session.commit()
+        if claimed == 0:
+            return None
+        return db.session.get(Job, job.id, populate_existing=True)
+
+    def _fail(self, job: Job, error: Exception, retry: bool = True):
+        now = datetime.now(timezone.utc)
+        job.last_error = ''.join(traceback.format_exception_only(type(error), error)).strip()
+        job.locked_by = None
+        job.locked_at = None
+        if retry and job.attempts < job.max_attempts:
+            job.status = Job.PENDING
+            job.run_at = now + timedelta(seconds=self.retry_backoff * 2 ** (job.attempts - 1))
+        else:
+            job.status = Job.DEAD
+            job.finished_at = now
+        db.session.commit()
+
+    def retry(self, job: Job):
+        """
+        将死信任务重新排队,执行次数清零,调用方负责提交
+        """
+        job.status = Job.PENDING
+        job.attempts = 0
+        job.run_at = datetime.now(timezone.utc)
+        job.finished_at = None
+        self._wakeup.set()
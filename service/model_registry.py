@@ -0,0 +1,148 @@
+import threading
+from typing import List
+
+import torch
+import torchvision.models as models
+
+from service.inference_backends import EXACT_BACKENDS, build_backend, configure_threads
+from service.preprocessing import ImagePreprocessor
+
+
+class ModelRegistry:
+    """
+    进程内的模型注册表
+
+    网络结构、权重和预处理流水线只在第一次使用时构建一次,之后在所有请求和线程之间共享。
+    模型处于 eval 模式且推理时不会修改任何状态,因此多个线程可以同时调用 forward。
+    forward 使用的推理后端 (eager、TorchScript、ONNX Runtime 或 int8 量化) 见 service/inference_backends.py。
+    """
+
+    DEFAULT_MODEL_VERSION = 'resnet50-imagenet1k-v1'
+    FEATURES = ('logits', 'pooled')
+
+    def __init__(self, device: torch.device, checkpoint_path: str = None, model_version: str = None,
+                 backend: str = 'eager', channels_last: bool = False, num_threads: int = None,
+                 onnx_path: str = None, calibration_paths: List[str] = None, features: str = 'logits'):
+        """
+        参数:
+        device (torch.device): 模型运行的设备
+        checkpoint_path (str): 本地权重文件路径 (state_dict),为空时使用 torchvision 的 ImageNet 预训练权重
+        model_version (str): 模型版本标识,用于区分不同权重生成的向量,更换权重时必须同时修改
+        backend (str): 推理后端,取值见 service.inference_backends.BACKENDS
+        channels_last (bool): 是否使用 channels-last 内存格式
+        num_threads (int): torch / ONNX Runtime 的计算线程数,为空时使用默认值
+        onnx_path (str): onnx 后端导出模型的文件路径
+        calibration_paths (List[str]): int8_static 后端的校准图片路径
+        features (str): 模型输出,'logits' 为 1000 维的 ImageNet 分类输出,'pooled' 为 fc 层之前全局平均池化的 2048 维特征
+        """
+        if features not in self.FEATURES:
+            raise ValueError(f'Unknown features: {features}, expected one of {", ".join(self.FEATURES)}')
+        self.device = device
+        self.checkpoint_path = checkpoint_path
+        self.model_version = model_version or self.DEFAULT_MODEL_VERSION
+        self.backend = backend
+        self.channels_last = channels_last
+        self.num_threads = num_threads
+        self.onnx_path = onnx_path
+        self.calibration_paths = calibration_paths or []
+        self.features = features
+        self._lock = threading.Lock()
+        self._model = None
+        self._transform = None
+        self._forward = None
+
+    @property
+    def embedding_version(self) -> str:
+        """
+        向量的版本标识,记录生成向量的权重、特征层、预处理和推理后端,不同版本的向量不会混用
+
+        int8 量化后端的输出与 float32 模型有明显差异,同样使用单独的版本
+        """
+        version = f'{self.model_version}+{ImagePreprocessor.VERSION}'
+        if self.features != 'logits':
+            version = f'{version}+{self.features}'
+        if self.backend not in EXACT_BACKENDS:
+            version = f'{version}+{self.backend}'
+        return version
+
+    @property
+    def model(self) -> torch.nn.Module:
+        self._ensure_loaded()
+        return self._model
+
+    @property
+    def transform(self) -> ImagePreprocessor:
+        self._ensure_loaded()
+        return self._transform
+
+    def _ensure_loaded(self):
+        # 双重检查锁定: 已加载时不加锁,避免每次请求都争用同一把锁
+        if self._model is not None:
+            return
+        with self._lock:
+            if self._model is not None:
+                return
+            configure_threads(self.num_threads)
+            self._transform = self.build_transform()
+            model = self._build_model()
+            self._forward = build_backend(self.backend, model, self.device, channels_last=self.channels_last,
+                                          onnx_path=self.onnx_path, num_threads=self.num_threads,
+                                          calibration=self._load_calibration())
+            # 最后再发布模型,保证其他线程看到 _model 时 _transform 和 _forward 也已就绪
+            self._model = model
+
+    def _load_calibration(self) -> List[torch.Tensor]:
+        if self.backend != 'int8_static':
+            return []
+        calibration = []
+        for path in self.calibration_paths:
+            try:
+                calibration.append(self._transform(path))
+            except OSError:
+                # 跳过无法解码的图片
+                continue
+        return calibration
+
+    def _build_model(self) -> torch.nn.Module:
+        # ResNet-50 是目前最广泛使用的卷积神经网络模型之一,它在各种图像分类任务上表现都非常优秀
+        if self.checkpoint_path:
+            # 从本地权重文件加载,worker 无需访问网络
+            model = models.resnet50(weights=None)
+            state_dict = torch.load(self.checkpoint_path, map_location='cpu', weights_only=True)
+            model.load_state_dict(state_dict)
+        else:
+            model = models.resnet50(weights=models.ResNet50_Weights.IMAGENET1K_V1)
+
+        if self.features == 'pooled':
+            # 去掉 fc 层,直接输出全局平均池化后的 2048 维特征,同时省去 fc 层的计算
+            model.fc = torch.nn.Identity()
+
+        # 将模型设置为评估模式,禁用诸如 Dropout 和 BatchNorm 等层的训练行为
+        model.eval()
+        return model.to(self.device)
+
+    @staticmethod
+    def build_transform() -> ImagePreprocessor:
+        # 等价于 Resize(256) + CenterCrop(224) + ToTensor + Normalize(ImageNet 均值和标准差),
+        # 但 JPEG 按缩小的尺寸解码,并且只缩放中心裁剪保留的区域,见 service/preprocessing.py
+        return ImagePreprocessor(resize=256, crop=224)
+
+    def warmup(self):
+        """
+        构建模型并执行一次空白输入的前向传播,让首个真实请求不再承担初始化开销
+        """
+        dummy = torch.zeros(1, 3, 224, 224, device=self.device)
+        self.forward(dummy)
+
+    def forward(self, batch: torch.Tensor) -> torch.Tensor:
+        """
+        对一个批量的图像张量执行前向传播
+
+        参数:
+        batch (torch.Tensor): 形状为 (N, 3, 224, 224) 的图像张量
+
+        返回:
+        torch.Tensor: 模型输出,形状为 (N, D)
+        """
+        self._ensure_loaded()
+        return self._forward(batch)
@@ -0,0 +1,266 @@
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from flask import current_app
+
+from app import db
+from model import FishType
+
+try:
+    # 安装 pypinyin 后,中文名额外以全拼 (dahuangyu) 和首字母 (dhy) 作为别名参与查找
+    from pypinyin import Style, lazy_pinyin
+except ImportError:
+    lazy_pinyin = None
+
+# 匹配类型,按优先级排列
+EXACT = 'exact'
+PREFIX = 'prefix'
+SUBSTRING = 'substring'
+FUZZY = 'fuzzy'
+_RANK = {EXACT: 0, PREFIX: 1, SUBSTRING: 2, FUZZY: 3}
+
+# 模糊匹配时,查询中至少有这么大比例的 bigram 出现在候选名中
+MIN_NGRAM_SIMILARITY = 0.3
+
+
+def normalize_name(name: str) -> str:
+    """
+    规范化名称:全角转半角、转小写、去掉空白
+    """
+    return ''.join(unicodedata.normalize('NFKC', name or '').lower().split())
+
+
+def pinyin_aliases(name: str) -> List[str]:
+    """
+    中文名的全拼和首字母,没有安装 pypinyin 或名称中没有汉字时返回空列表
+    """
+    if lazy_pinyin is None or not any('一' <= char <= '鿿' for char in name):
+        return []
+    full = ''.join(lazy_pinyin(name))
+    initials = ''.join(lazy_pinyin(name, style=Style.FIRST_LETTER))
+    return [alias for alias in dict.fromkeys([full, initials]) if alias and alias != name]
+
+
+def edit_distance(a: str, b: str, limit: int, prefix: bool = False) -> int:
+    """
+    Levenshtein 编辑距离,超过 limit 时提前返回 limit + 1
+
+    参数:
+    a (str): 查询
+    b (str): 候选名称
+    limit (int): 关心的最大距离
+    prefix (bool): 为 True 时返回 a 与 b 的任一前缀之间的最小距离,用于输入到一半的自动补全
+    """
+    if prefix:
+        # 与更长的前缀之间的距离一定超过 limit
+        b = b[:len(a) + limit]
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous) if prefix else previous[-1]
+
+
+def _bigrams(key: str, padded: bool = True) -> set:
+    if padded:
+        key = f'^{key}$'
+    return {key[i:i + 2] for i in range(len(key) - 1)}
+
+
+class _Snapshot:
+    """
+    某一时刻 fish_type 表的只读名称索引,重建时整体替换,查询不需要加锁
+    """
+
+    def __init__(self, rows: List[Tuple[int, str, str]], use_pinyin: bool):
+        # 每个 FishType 的展示信息
+        self.fish_types: Dict[int, dict] = {}
+        # 规范化后的名称或别名 -> [(fish_type_id, 原始名称)]
+        self.keys: Dict[str, List[Tuple[int, str]]] = defaultdict(list)
+        for fish_type_id, name_cn, name_latin in rows:
+            self.fish_types[fish_type_id] = {'id': fish_type_id, 'name_cn': name_cn, 'name_latin': name_latin}
+            aliases = [name_cn, name_latin] + (pinyin_aliases(name_cn) if use_pinyin else [])
+            for alias in aliases:
+                key = normalize_name(alias)
+                if key and (fish_type_id, alias) not in self.keys[key]:
+                    self.keys[key].append((fish_type_id, alias))
+
+        # 前缀树: 每个节点是 {字符: 子节点},键结束的节点上 '' 指向该键
+        self.trie: dict = {}
+        # bigram 倒排表: bigram -> 包含它的键
+        self.grams: Dict[str, set] = defaultdict(set)
+        for key in self.keys:
+            node = self.trie
+            for char in key:
+                node = node.setdefault(char, {})
+            node[''] = key
+            for gram in _bigrams(key):
+                self.grams[gram].add(key)
+
+    def prefix_keys(self, prefix: str, limit: int) -> List[str]:
+        """
+        以 prefix 开头的键,按广度优先遍历,较短的键在前
+        """
+        node = self.trie
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+        keys, level = [], [node]
+        while level and len(keys) < limit:
+            next_level = []
+            for current in level:
+                for char, child in current.items():
+                    if char == '':
+                        keys.append(child)
+                    else:
+                        next_level.append(child)
+            level = next_level
+        return keys[:limit]
+
+    def substring_keys(self, query: str) -> List[str]:
+        """
+        包含 query 的键,先用 query 内部的 bigram 在倒排表上求交集得到候选,再逐个确认
+        """
+        grams = _bigrams(query, padded=False)
+        if not grams:
+            candidates = self.keys.keys()
+        else:
+            postings = sorted((self.grams.get(gram, set()) for gram in grams), key=len)
+            candidates = set.intersection(*postings) if postings else set()
+        return sorted((key for key in candidates if query in key), key=lambda key: (len(key), key))
+
+    def fuzzy_keys(self, query: str, max_distance: int) -> List[Tuple[str, int, float]]:
+        """
+        与 query 编辑距离不超过 max_distance 的键,query 可以只对应键的前缀
+
+        先用 bigram 倒排表找出包含 query 中至少 MIN_NGRAM_SIMILARITY 比例 bigram 的候选,只对候选计算编辑距离。
+
+        返回:
+        List[Tuple[str, int, float]]: (键, 编辑距离, bigram 覆盖率),按编辑距离升序、覆盖率降序排列
+        """
+        query_grams = _bigrams(query)
+        shared = defaultdict(int)
+        for gram in query_grams:
+            for key in self.grams.get(gram, ()):
+                shared[key] += 1
+        matches = []
+        for key, count in shared.items():
+            similarity = count / len(query_grams)
+            if similarity < MIN_NGRAM_SIMILARITY:
+                continue
+            distance = edit_distance(query, key, max_distance, prefix=True)
+            if distance <= max_distance:
+                matches.append((key, distance, similarity))
+        return sorted(matches, key=lambda match: (match[1], -match[2], len(match[0]), match[0]))
+
+
+class FishTypeNameIndex:
+    """
+    进程内的 FishType 名称索引,替代 name_cn / name_latin 上的 LIKE '%x%' 全表扫描
+
+    中文名、拉丁名以及 (安装 pypinyin 时) 中文名的全拼和首字母都作为键放入前缀树和 bigram 倒排表:
+    - 精确匹配和前缀匹配走前缀树
+    - 子串匹配用 bigram 倒排表求交集得到候选
+    - 输错字时用 bigram 相似度筛选候选,再按编辑距离排序
+    add_fish_type / edit_fishtype 修改 fish_type 表后立即重建;其他 worker 进程中的索引最多在 refresh_interval 秒后重建。
+    """
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self, use_pinyin: bool = True, refresh_interval: float = 300):
+        """
+        参数:
+        use_pinyin (bool): 是否为中文名生成拼音别名 (需要安装 pypinyin)
+        refresh_interval (float): 索引最多使用多少秒后从数据库重建,0 表示只在本进程修改 fish_type 时重建
+        """
+        self.use_pinyin = use_pinyin
+        self.refresh_interval = refresh_interval
+        self._snapshot: Optional[_Snapshot] = None
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> 'FishTypeNameIndex':
+        if cls.__instance is None:
+            with cls.__instance_lock:
+                if cls.__instance is None:
+                    config = current_app.config
+                    cls.__instance = cls(use_pinyin=config.get('NAME_INDEX_PINYIN', True),
+                                         refresh_interval=config.get('NAME_INDEX_REFRESH_INTERVAL', 300))
+        return cls.__instance
+
+    def rebuild(self):
+        """
+        从 fish_type 表重建索引,需要在应用上下文中调用
+        """
+        rows = db.session.query(FishType.id, FishType.name_cn, FishType.name_latin).all()
+        snapshot = _Snapshot([tuple(row) for row in rows], self.use_pinyin)
+        with self._lock:
+            self._snapshot = snapshot
+            self._built_at = time.monotonic()
+
+    def _current(self) -> _Snapshot:
+        snapshot = self._snapshot
+        expired = self.refresh_interval and time.monotonic() - self._built_at > self.refresh_interval
+        if snapshot is None or expired:
+            self.rebuild()
+            snapshot = self._snapshot
+        return snapshot
+
+    def search(self, query: str, limit: int = 10, fuzzy: bool = True) -> List[dict]:
+        """
+        按名称查找 FishType,结果按 精确 > 前缀 > 子串 > 模糊 排列,同一个 FishType 只出现一次
+
+        参数:
+        query (str): 中文名、拉丁名或拼音的全部或一部分
+        limit (int): 返回数量
+        fuzzy (bool): 前面几种匹配不足 limit 个时,是否补充编辑距离相近的名称
+
+        返回:
+        List[dict]: FishType 的 id、name_cn、name_latin,以及 matched (命中的名称)、match (匹配类型)、distance (编辑距离)
+        """
+        query = normalize_name(query)
+        if not query or limit <= 0:
+            return []
+        snapshot = self._current()
+        results: Dict[int, dict] = {}
+
+        def collect(keys, match, distance=0):
+            for key in keys:
+                for fish_type_id, alias in snapshot.keys[key]:
+                    if fish_type_id not in results and len(results) < limit:
+                        results[fish_type_id] = dict(snapshot.fish_types[fish_type_id], matched=alias, match=match,
+                                                     distance=distance)
+
+        collect([query] if query in snapshot.keys else [], EXACT)
+        collect(snapshot.prefix_keys(query, limit + 1), PREFIX)
+        if len(results) < limit:
+            collect(snapshot.substring_keys(query), SUBSTRING)
+        # 允许的编辑距离: 两个字符以内不做模糊匹配,3-6 个字符 1 处,更长的 2 处
+        max_distance = min(2, (len(query) + 1) // 4)
+        if fuzzy and max_distance and len(results) < limit:
+            for key, distance, _ in snapshot.fuzzy_keys(query, max_distance):
+                collect([key], FUZZY, distance)
+        return sorted(results.values(), key=lambda item: (_RANK[item['match']], item['distance']))
+
+    def resolve(self, name: str, fuzzy: bool = False) -> Optional[int]:
+        """
+        将用户输入的名称解析为一个 FishType 的 id,找不到时返回 None
+
+        参数:
+        name (str): 中文名、拉丁名或拼音的全部或一部分
+        fuzzy (bool): 是否接受编辑距离相近的名称
+        """
+        matches = self.search(name, limit=1, fuzzy=fuzzy)
+        return matches[0]['id'] if matches else None
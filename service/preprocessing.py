@@ -0,0 +1,159 @@
+import io
+import time
+from typing import BinaryIO, Dict, List, Union
+
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+from PIL import Image
+
+try:
+    # HEIC/HEIF 是 iPhone 的默认拍照格式,Pillow 本身不支持,安装 pillow-heif 后自动注册解码器
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+except ImportError:
+    pass
+
+ImageSource = Union[str, bytes, BinaryIO, Image.Image]
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+def open_image(image: ImageSource) -> Image.Image:
+    """
+    打开各种形式的图片输入,此时只读取了文件头,像素数据尚未解码
+
+    参数:
+    image (ImageSource): 图片路径、二进制数据、文件对象或 PIL 图像
+
+    返回:
+    Image.Image: PIL 图像
+    """
+    if isinstance(image, Image.Image):
+        return image
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        # 直接从内存解码,不经过临时文件
+        image = io.BytesIO(image)
+    return Image.open(image)
+
+
+class ImagePreprocessor:
+    """
+    与 Resize(256) + CenterCrop(224) + ToTensor + Normalize 等价的快速预处理
+
+    - JPEG 使用 draft 模式,由解码器直接按 1/2、1/4、1/8 缩小解码,千万像素的手机照片不需要完整解码
+    - 只缩放最终会被中心裁剪保留下来的区域,缩放和裁剪合并为一次 PIL resize
+    - 归一化在 torch 张量上原地完成,可以直接写入调用方预先分配并重复使用的缓冲区
+    """
+
+    # 预处理的版本标识,输出与 torchvision 的 Resize + CenterCrop 有细微差异,计入向量版本 (见 ModelRegistry.embedding_version)
+    VERSION = 'pp2'
+
+    def __init__(self, resize: int = 256, crop: int = 224, mean=IMAGENET_MEAN, std=IMAGENET_STD):
+        """
+        参数:
+        resize (int): 短边缩放到的长度
+        crop (int): 中心裁剪的边长
+        mean (tuple): 各通道的均值
+        std (tuple): 各通道的标准差
+        """
+        self.resize = resize
+        self.crop = crop
+        std = torch.tensor(std, dtype=torch.float32).view(3, 1, 1)
+        # (x / 255 - mean) / std == x * scale - shift
+        self._scale = 1 / (255 * std)
+        self._shift = torch.tensor(mean, dtype=torch.float32).view(3, 1, 1) / std
+
+    def __call__(self, image: ImageSource, out: torch.Tensor = None) -> torch.Tensor:
+        """
+        解码并预处理一张图片
+
+        参数:
+        image (ImageSource): 图片路径、二进制数据、文件对象或 PIL 图像
+        out (torch.Tensor): 形状为 (3, crop, crop) 的 float32 缓冲区,为空时新分配
+
+        返回:
+        torch.Tensor: 归一化后的图像张量,传入 out 时就是 out 本身
+        """
+        image = open_image(image)
+        width, height = image.size
+        if image.format == 'JPEG':
+            # draft 选择不小于请求尺寸的最大缩小比例,缩小后短边仍不小于 resize
+            scale = self.resize / min(width, height)
+            image.draft('RGB', (int(np.ceil(width * scale)), int(np.ceil(height * scale))))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        image = image.resize((self.crop, self.crop), Image.BILINEAR, box=self._crop_box(*image.size),
+                             reducing_gap=3.0)
+
+        tensor = out if out is not None else torch.empty((3, self.crop, self.crop), dtype=torch.float32)
+        tensor.copy_(torch.from_numpy(np.array(image, dtype=np.uint8)).permute(2, 0, 1))
+        return tensor.mul_(self._scale).sub_(self._shift)
+
+    def _crop_box(self, width: int, height: int) -> tuple:
+        # 按 torchvision 的取整方式计算缩放后的尺寸和中心裁剪位置,再换算回原图坐标
+        if width <= height:
+            resized_width, resized_height = self.resize, int(self.resize * height / width)
+        else:
+            resized_width, resized_height = int(self.resize * width / height), self.resize
+        left = int(round((resized_width - self.crop) / 2.0))
+        top = int(round((resized_height - self.crop) / 2.0))
+        scale_x, scale_y = width / resized_width, height / resized_height
+        return (left * scale_x, top * scale_y, (left + self.crop) * scale_x, (top + self.crop) * scale_y)
+
+
+def build_reference_transform() -> transforms.Compose:
+    """
+    原始的 torchvision 预处理流水线,用于对比快速预处理的速度和结果
+    """
+    return transforms.Compose([
+        transforms.Resize(256),
+        transforms.CenterCrop(224),  # 从图像中心裁剪出 224x224 大小的区域
+        transforms.ToTensor(),  # 将 PIL 图像转换为 PyTorch 张量
+        # 使用 ImageNet 数据集的平均值和标准差对图像进行归一化
+        transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD),
+    ])
+
+
+def benchmark(paths: List[str], repeat: int = 10) -> Dict[str, float]:
+    """
+    在给定图片上分别测量原始流水线 (完整解码 + torchvision) 和快速预处理的耗时
+
+    参数:
+    paths (List[str]): 图片路径列表
+    repeat (int): 每张图片重复的次数
+
+    返回:
+    Dict[str, float]: 两种流水线每张图片的平均毫秒数、加速比以及两者输出的最小余弦相似度
+    """
+    contents = []
+    for path in paths:
+        with open(path, 'rb') as image_file:
+            contents.append(image_file.read())
+
+    reference = build_reference_transform()
+    preprocessor = ImagePreprocessor()
+    buffer = torch.empty((3, preprocessor.crop, preprocessor.crop), dtype=torch.float32)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        expected = [reference(open_image(content).convert('RGB')) for content in contents]
+    reference_ms = (time.perf_counter() - start) * 1000 / (repeat * len(contents))
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for content in contents:
+            preprocessor(content, out=buffer)
+    fast_ms = (time.perf_counter() - start) * 1000 / (repeat * len(contents))
+
+    cosine = [float(torch.nn.functional.cosine_similarity(e.flatten(), preprocessor(content).flatten(), dim=0))
+              for e, content in zip(expected, contents)]
+    return {
+        'images': len(contents),
+        'reference_ms': reference_ms,
+        'fast_ms': fast_ms,
+        'speedup': reference_ms / fast_ms,
+        'min_cosine': min(cosine),
+    }
@@ -0,0 +1,216 @@
+import os
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from service.ann_index import cluster_sums
+from service.similarity_index import SimilarityIndex
+
+
+class Float16Index(SimilarityIndex):
+    """
+    以 float16 存储图库向量的精确检索索引,常驻内存减半
+
+    NumPy 的 float16 矩阵乘法没有 BLAS 加速,因此打分时按块临时转换为 float32,额外内存只有一个块的大小。
+    """
+
+    storage_dtype = np.float16
+    CHUNK_ROWS = 4096
+
+    def _scores(self, queries: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+        scores = np.empty((queries.shape[0], matrix.shape[0]), dtype=np.float32)
+        for start in range(0, matrix.shape[0], self.CHUNK_ROWS):
+            chunk = matrix[start:start + self.CHUNK_ROWS].astype(np.float32)
+            scores[:, start:start + chunk.shape[0]] = queries @ chunk.T
+        return scores
+
+
+class ProductQuantizer:
+    """
+    乘积量化器
+
+    把 D 维向量切分为 n_subvectors 个子向量,每个子空间用 k-means 训练 n_centroids 个码字,
+    每个向量最终只需保存 n_subvectors 个 uint8 码字编号。
+    查询时先计算查询子向量与每个码字的内积表,再按编号查表求和 (非对称距离计算, ADC),查询向量本身不做量化。
+    """
+
+    def __init__(self, n_subvectors: int = 64, n_centroids: int = 256, iterations: int = 10, seed: int = 0):
+        """
+        参数:
+        n_subvectors (int): 子向量数量,即每个向量编码后的字节数
+        n_centroids (int): 每个子空间的码字数量,最多 256
+        iterations (int): k-means 迭代次数
+        seed (int): 随机种子
+        """
+        self.n_subvectors = n_subvectors
+        self.n_centroids = min(n_centroids, 256)
+        self.iterations = iterations
+        self.seed = seed
+        self.codebooks = None
+        self.bounds = None
+        # 训练时的图库规模,图库增长到两倍以上时需要重新训练
+        self.trained_count = 0
+
+    @property
+    def is_trained(self) -> bool:
+        return self.codebooks is not None
+
+    @property
+    def dim(self) -> int:
+        return int(self.bounds[-1]) if self.bounds is not None else 0
+
+    @property
+    def min_train_size(self) -> int:
+        """
+        训练新码本至少需要的向量数,少于这个数时每个子空间填不满 n_centroids 个码字
+        """
+        return self.n_centroids
+
+    def train(self, vectors: np.ndarray):
+        """
+        在给定的 (已归一化) 向量上训练每个子空间的码本
+
+        参数:
+        vectors (np.ndarray): 训练向量矩阵,形状为 (N, D)
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape[0] == 0:
+            return
+        rng = np.random.default_rng(self.seed)
+        self.trained_count = vectors.shape[0]
+        n_centroids = max(1, min(self.n_centroids, vectors.shape[0]))
+        # 每个码字最多取 32 个样本训练
+        if vectors.shape[0] > 32 * n_centroids:
+            vectors = vectors[rng.choice(vectors.shape[0], 32 * n_centroids, replace=False)]
+
+        # D 不能被 n_subvectors 整除时,前面的子空间各多分一维
+        split = np.array_split(np.arange(vectors.shape[1]), min(self.n_subvectors, vectors.shape[1]))
+        self.bounds = np.array([part[0] for part in split] + [vectors.shape[1]], dtype=np.int64)
+
+        codebooks = []
+        for start, end in zip(self.bounds[:-1], self.bounds[1:]):
+            sub = vectors[:, start:end]
+            centroids = sub[rng.choice(sub.shape[0], n_centroids, replace=False)].copy()
+            for _ in range(self.iterations):
+                # 欧氏距离 k-means: argmin ||x - c||^2 = argmax (x·c - ||c||^2 / 2)
+                assignment = np.argmax(sub @ centroids.T - 0.5 * np.sum(centroids ** 2, axis=1), axis=1)
+                sums, counts = cluster_sums(sub, assignment, n_centroids)
+                non_empty = counts > 0
+                centroids[non_empty] = sums[non_empty] / counts[non_empty, np.newaxis]
+            codebooks.append(centroids)
+        self.codebooks = codebooks
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        将向量编码为 uint8 码字编号
+
+        参数:
+        vectors (np.ndarray): 向量矩阵,形状为 (N, D)
+
+        返回:
+        np.ndarray: 码字编号矩阵,形状为 (N, n_subvectors)
+        """
+        codes = np.empty((vectors.shape[0], len(self.codebooks)), dtype=np.uint8)
+        for j, (start, end) in enumerate(zip(self.bounds[:-1], self.bounds[1:])):
+            centroids = self.codebooks[j]
+            sub = vectors[:, start:end]
+            codes[:, j] = np.argmax(sub @ centroids.T - 0.5 * np.sum(centroids ** 2, axis=1), axis=1)
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """
+        将码字编号还原为近似向量
+        """
+        return np.concatenate([self.codebooks[j][codes[:, j]] for j in range(codes.shape[1])], axis=1)
+
+    def inner_products(self, queries: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """
+        非对称距离计算:查询向量与编码后图库向量的近似内积
+
+        参数:
+        queries (np.ndarray): 查询向量矩阵,形状为 (Q, D)
+        codes (np.ndarray): 图库码字编号矩阵,形状为 (N, n_subvectors)
+
+        返回:
+        np.ndarray: 近似内积矩阵,形状为 (Q, N)
+        """
+        scores = np.zeros((queries.shape[0], codes.shape[0]), dtype=np.float32)
+        for j, (start, end) in enumerate(zip(self.bounds[:-1], self.bounds[1:])):
+            # (Q, n_centroids) 的内积表,按码字编号查表累加
+            table = queries[:, start:end] @ self.codebooks[j].T
+            scores += table[:, codes[:, j]]
+        return scores
+
+    def save(self, path: str):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as codebook_file:
+            np.savez(codebook_file, bounds=self.bounds, n_centroids=self.n_centroids, trained_count=self.trained_count,
+                     **{f'codebook_{j}': codebook for j, codebook in enumerate(self.codebooks)})
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'ProductQuantizer':
+        with np.load(path) as data:
+            bounds = data['bounds']
+            quantizer = cls(n_subvectors=len(bounds) - 1, n_centroids=int(data['n_centroids']))
+            quantizer.bounds = bounds
+            quantizer.codebooks = [data[f'codebook_{j}'] for j in range(len(bounds) - 1)]
+            # 旧的码本文件没有记录训练规模,以实际的码字数量作为下限
+            quantizer.trained_count = int(data['trained_count']) if 'trained_count' in data \
+                else quantizer.codebooks[0].shape[0]
+        return quantizer
+
+
+class PQIndex(SimilarityIndex):
+    """
+    以乘积量化码存储图库向量的检索索引
+
+    每个向量只占 n_subvectors 字节 (float32 的 ResNet 输出为 4000 字节)。
+    近似分数由 ADC 查表得到,配合 rerank 从磁盘存储取出少量候选的原始向量精确重排,top-k 结果与精确检索基本一致。
+    """
+
+    storage_dtype = np.uint8
+
+    def __init__(self, quantizer: ProductQuantizer, ids: np.ndarray = None, matrix: np.ndarray = None,
+                 rerank: int = 0, vector_source: Callable[[List[int]], Tuple[np.ndarray, np.ndarray]] = None):
+        """
+        参数:
+        quantizer (ProductQuantizer): 已训练的乘积量化器
+        ids (np.ndarray): Fish id 数组
+        matrix (np.ndarray): 码字编号矩阵
+        rerank (int): 精确重排的候选数量
+        vector_source (Callable): 根据 Fish id 列表返回原始向量的函数
+        """
+        self.quantizer = quantizer
+        super().__init__(ids=ids, matrix=matrix, dim=quantizer.n_subvectors, rerank=rerank,
+                         vector_source=vector_source)
+
+    @classmethod
+    def build(cls, ids: np.ndarray, vectors: np.ndarray, n_subvectors: int = 64, quantizer: ProductQuantizer = None,
+              rerank: int = 0, vector_source: Callable = None) -> 'PQIndex':
+        """
+        训练 (或复用给定的) 量化器并编码所有向量
+
+        参数:
+        ids (np.ndarray): Fish id 数组
+        vectors (np.ndarray): 与 ids 对应的未归一化向量矩阵
+        n_subvectors (int): 子向量数量
+        quantizer (ProductQuantizer): 已训练的量化器,为空时在 vectors 上训练一个新的
+        rerank (int): 精确重排的候选数量
+        vector_source (Callable): 根据 Fish id 列表返回原始向量的函数
+
+        返回:
+        PQIndex: 构建好的索引
+        """
+        if quantizer is None:
+            quantizer = ProductQuantizer(n_subvectors=n_subvectors)
+            quantizer.train(cls.normalize(vectors))
+        index = cls(quantizer, rerank=rerank, vector_source=vector_source)
+        index.add(ids, vectors)
+        return index
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        return self.quantizer.encode(vectors)
+
+    def _scores(self, queries: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+        return self.quantizer.inner_products(queries, matrix)
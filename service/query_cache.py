@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+    """
+    带过期时间和内存预算的线程安全 LRU 缓存
+
+    每个条目写入时由调用方给出其占用的字节数,总字节数超过 max_bytes 时从最久未使用的条目开始淘汰;
+    条目超过 ttl 秒后视为未命中。
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        """
+        参数:
+        max_bytes (int): 缓存的内存预算 (字节)
+        ttl (float): 条目的有效期 (秒)
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        """
+        读取缓存,未命中或已过期时返回 None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] < time.monotonic():
+                if entry is not None:
+                    self._evict(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, size: int):
+        """
+        写入缓存
+
+        参数:
+        key (Hashable): 缓存键
+        value (Any): 缓存值
+        size (int): 缓存值占用的字节数
+        """
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = (value, size, time.monotonic() + self.ttl)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._evict(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _evict(self, key: Hashable):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> dict:
+        """
+        返回命中次数、未命中次数、命中率、条目数和占用字节数
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
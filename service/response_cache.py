@@ -0,0 +1,230 @@
+import hashlib
+import importlib
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+
+from flask import Response, current_app, make_response, request
+
+from service.query_cache import LRUCache
+from utils.streaming import wants_ndjson
+
+# 缓存的命名空间,写操作按命名空间使缓存失效
+FISH_TYPES = 'fish_type'
+FISH = 'fish'
+
+
+class CacheBackend:
+    """
+    响应缓存的存储后端
+
+    条目以字节串保存;每个命名空间有一个递增的版本号,版本号是缓存键的一部分,
+    使缓存失效只需要把版本号加一,旧版本的条目不再被读取,由后端按 LRU 或过期时间清理。
+    """
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: float):
+        raise NotImplementedError
+
+    def get_versions(self, namespaces: List[str]) -> List[int]:
+        raise NotImplementedError
+
+    def bump_version(self, namespace: str) -> int:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+
+class MemoryBackend(CacheBackend):
+    """
+    进程内后端,条目保存在 LRUCache 中;版本号只在本进程内递增,其他 worker 的缓存要等条目过期后才会更新
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self._entries = LRUCache(max_bytes, ttl)
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._entries.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self._entries.put(key, value, len(value))
+
+    def get_versions(self, namespaces: List[str]) -> List[int]:
+        with self._lock:
+            return [self._versions.get(namespace, 0) for namespace in namespaces]
+
+    def bump_version(self, namespace: str) -> int:
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            return self._versions[namespace]
+
+    def stats(self) -> dict:
+        return self._entries.stats()
+
+
+class RedisBackend(CacheBackend):
+    """
+    Redis 后端,所有 worker 共享条目和版本号,任一 worker 上的写操作立即对其他 worker 生效 (需要 pip install redis)
+    """
+
+    def __init__(self, url: str, prefix: str = 'fishquery:response:'):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._client.get(self._prefix + key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self._client.set(self._prefix + key, value, ex=max(1, int(ttl)))
+
+    def get_versions(self, namespaces: List[str]) -> List[int]:
+        values = self._client.mget([f'{self._prefix}version:{namespace}' for namespace in namespaces])
+        return [int(value) if value is not None else 0 for value in values]
+
+    def bump_version(self, namespace: str) -> int:
+        return self._client.incr(f'{self._prefix}version:{namespace}')
+
+
+def create_cache_backend(name: str, max_bytes: int, ttl: float, redis_url: str = None) -> Optional[CacheBackend]:
+    """
+    按名称创建缓存后端
+
+    参数:
+    name (str): memory、redis、none,或 "模块:类名" 形式的自定义 CacheBackend 子类 (以 max_bytes 和 ttl 构造)
+    max_bytes (int): memory 后端的内存预算 (字节)
+    ttl (float): 条目的有效期 (秒)
+    redis_url (str): redis 后端的连接地址
+
+    返回:
+    Optional[CacheBackend]: 缓存后端,name 为 none 或内存预算为 0 时返回 None
+    """
+    if name in (None, 'none') or (name == 'memory' and max_bytes <= 0):
+        return None
+    if name == 'memory':
+        return MemoryBackend(max_bytes, ttl)
+    if name == 'redis':
+        return RedisBackend(redis_url or 'redis://localhost:6379/0')
+    if ':' in name:
+        module_name, class_name = name.split(':', 1)
+        return getattr(importlib.import_module(module_name), class_name)(max_bytes=max_bytes, ttl=ttl)
+    raise ValueError(f'Unknown response cache backend: {name}, expected memory, redis, none or module:Class')
+
+
+class ResponseCache:
+    """
+    只读接口的读穿透 (read-through) 响应缓存
+
+    缓存键由相关命名空间的当前版本号、请求路径和影响结果的请求参数组成;
+    未命中时执行视图函数,把 200 响应的内容连同其 ETag (内容的哈希) 写入缓存。
+    流式响应不缓存:缓冲整个响应体会失去流式输出的意义,而且流中途出错时状态码仍是 200,响应体是截断的。
+    需要缓存的接口在 enabled 为 True 时应一次性生成完整响应体。
+    请求带有匹配的 If-None-Match 时直接返回 304,命中缓存的请求都不访问数据库。
+    写操作调用 invalidate 把命名空间的版本号加一,之后的请求自然落到新的缓存键上。
+    """
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self, backend: Optional[CacheBackend], ttl: float = 300):
+        """
+        参数:
+        backend (CacheBackend): 存储后端,为 None 时不缓存,每次都执行视图函数
+        ttl (float): 条目的有效期 (秒)
+        """
+        self.backend = backend
+        self.ttl = ttl
+
+    @classmethod
+    def get_instance(cls) -> 'ResponseCache':
+        if cls.__instance is None:
+            with cls.__instance_lock:
+                if cls.__instance is None:
+                    config = current_app.config
+                    ttl = config.get('RESPONSE_CACHE_TTL', 300)
+                    backend = create_cache_backend(config.get('RESPONSE_CACHE_BACKEND', 'memory'),
+                                                   config.get('RESPONSE_CACHE_MB', 16) * 1024 * 1024, ttl,
+                                                   redis_url=config.get('RESPONSE_CACHE_REDIS_URL'))
+                    cls.__instance = cls(backend, ttl=ttl)
+        return cls.__instance
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend is not None
+
+    def invalidate(self, *namespaces: str):
+        """
+        使这些命名空间下的所有缓存失效,在写操作提交之后调用
+        """
+        if self.backend is None:
+            return
+        for namespace in namespaces:
+            try:
+                self.backend.bump_version(namespace)
+            except Exception as e:
+                current_app.logger.error(f'Failed to invalidate response cache {namespace}: {e}')
+
+    def _key(self, namespaces: Iterable[str], params: Optional[dict]) -> str:
+        namespaces = list(namespaces)
+        versions = self.backend.get_versions(namespaces)
+        if params is None:
+            params = request.args.to_dict(flat=False)
+        raw = repr((request.path, sorted(params.items()), wants_ndjson()))
+        digest = hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()
+        return ','.join(f'{namespace}.{version}' for namespace, version in zip(namespaces, versions)) + ':' + digest
+
+    def serve(self, namespaces: Iterable[str], produce: Callable[[], object], params: Optional[dict] = None) -> Response:
+        """
+        从缓存返回响应,未命中时调用 produce 生成响应并写入缓存
+
+        参数:
+        namespaces (Iterable[str]): 响应内容依赖的命名空间
+        produce (Callable): 生成响应的函数,返回值与视图函数相同
+        params (dict): 影响响应内容的参数,默认使用全部请求参数;不影响内容的参数 (如 user_id) 不应放入
+
+        返回:
+        Response: 带 ETag 的响应,客户端的 If-None-Match 匹配时为 304
+        """
+        if self.backend is None:
+            return make_response(produce())
+
+        try:
+            key = self._key(namespaces, params)
+            cached = self.backend.get(key)
+        except Exception as e:
+            current_app.logger.warning(f'Response cache unavailable: {e}')
+            return make_response(produce())
+
+        if cached is not None:
+            etag, mimetype, body = cached.split(b'\n', 2)
+            etag, mimetype = etag.decode('ascii'), mimetype.decode('ascii')
+        else:
+            response = make_response(produce())
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            body = response.get_data()
+            mimetype = response.mimetype
+            etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+            try:
+                self.backend.set(key, f'{etag}\n{mimetype}\n'.encode('ascii') + body, self.ttl)
+            except Exception as e:
+                current_app.logger.warning(f'Failed to write response cache: {e}')
+
+        response = Response(body, mimetype=mimetype)
+        response.set_etag(etag)
+        # 允许客户端缓存,但每次使用前都要用 If-None-Match 重新验证
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+
+    def stats(self) -> dict:
+        if self.backend is None:
+            return {}
+        try:
+            return self.backend.stats()
+        except Exception as e:
+            return {'error': str(e)}
@@ -0,0 +1,370 @@
+import atexit
+import queue
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from flask import Flask, current_app
+from sqlalchemy import func, insert
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app import db
+from model import SearchHistory, SearchQueryStat
+
+# 聚合行的唯一键
+_STAT_KEY = ('user_id', 'day', 'search_method', 'search_content')
+
+
+def record_search(user_id: int, search_method: int, search_content: str,
+                  search_at: Optional[datetime] = None) -> SearchHistory:
+    """
+    将一条搜索历史加入当前数据库会话,并在同一事务中更新按天聚合的计数,由调用方提交
+
+    参数:
+    user_id (int): 用户 ID
+    search_method (int): 0: image, 1: name, 2: tags
+    search_content (str): 搜索内容
+    search_at (datetime): 搜索时间,默认当前时间
+
+    返回:
+    SearchHistory: 新建的搜索历史
+    """
+    search_at = search_at or datetime.now(timezone.utc)
+    history = SearchHistory(user_id=user_id, search_method=search_method, search_content=search_content,
+                            search_at=search_at)
+    db.session.add(history)
+    update_search_stats([(user_id, search_method, search_content, search_at)])
+    return history
+
+
+def update_search_stats(searches: Iterable[Tuple[int, int, str, datetime]]):
+    """
+    将一批搜索累加到 search_query_stat 中对应用户和所有用户合计的按天计数
+
+    同一批中相同的 (用户, 日期, 查询) 先在内存中合并,再对每个键执行一次 upsert,
+    MySQL 使用 INSERT ... ON DUPLICATE KEY UPDATE,SQLite / PostgreSQL 使用 ON CONFLICT DO UPDATE。
+    在调用方的事务中执行,不提交。
+
+    参数:
+    searches (Iterable[Tuple[int, int, str, datetime]]): (user_id, search_method, search_content, search_at)
+    """
+    counts: Dict[tuple, List] = defaultdict(lambda: [0, None])
+    for user_id, search_method, search_content, search_at in searches:
+        content = (search_content or '')[:SearchQueryStat.CONTENT_LENGTH]
+        day = search_at.date()
+        for key in ((int(user_id), day, search_method, content),
+                    (SearchQueryStat.ALL_USERS, day, search_method, content)):
+            entry = counts[key]
+            entry[0] += 1
+            entry[1] = search_at if entry[1] is None else max(entry[1], search_at)
+    if not counts:
+        return
+
+    rows = [dict(zip(_STAT_KEY, key), count=count, last_search_at=last_search_at)
+            for key, (count, last_search_at) in counts.items()]
+    table = SearchQueryStat.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'mysql':
+        statement = mysql_insert(table).values(rows)
+        statement = statement.on_duplicate_key_update(
+            count=table.c['count'] + statement.inserted['count'],
+            last_search_at=func.greatest(table.c.last_search_at, statement.inserted.last_search_at),
+        )
+    elif dialect in ('sqlite', 'postgresql'):
+        upsert_insert = sqlite_insert if dialect == 'sqlite' else postgresql_insert
+        statement = upsert_insert(table).values(rows)
+        latest = func.max if dialect == 'sqlite' else func.greatest
+        statement = statement.on_conflict_do_update(
+            index_elements=list(_STAT_KEY),
+            set_={'count': table.c['count'] + statement.excluded['count'],
+                  'last_search_at': latest(table.c.last_search_at, statement.excluded.last_search_at)},
+        )
+    else:
+        for row in rows:
+            _upsert_row(row)
+        return
+    db.session.execute(statement)
+
+
+def _upsert_row(row: dict):
+    stat = SearchQueryStat.query.filter_by(**{key: row[key] for key in _STAT_KEY}).with_for_update().first()
+    if stat is None:
+        db.session.add(SearchQueryStat(**row))
+        db.session.flush()
+    else:
+        stat.count += row['count']
+        stat.last_search_at = max(stat.last_search_at, row['last_search_at'])
+
+
+def top_queries(user_id: Optional[int] = None, days: int = 7, limit: int = 10,
+                search_method: Optional[int] = None) -> List[dict]:
+    """
+    最近 days 天内搜索次数最多的查询
+
+    只读取 search_query_stat 中时间窗口内的按天计数,扫描的行数与不同查询的数量和天数有关,与搜索历史的总量无关。
+
+    参数:
+    user_id (int): 用户 ID,为空时统计所有用户
+    days (int): 时间窗口的天数,包含今天
+    limit (int): 返回数量
+    search_method (int): 只统计某种搜索方式,可选
+
+    返回:
+    List[dict]: 按搜索次数倒序排列的 search_method、search_content、count 和 last_search_at
+    """
+    since = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+    total = func.sum(SearchQueryStat.count).label('count')
+    last_search_at = func.max(SearchQueryStat.last_search_at).label('last_search_at')
+    query = (
+        db.session.query(SearchQueryStat.search_method, SearchQueryStat.search_content, total, last_search_at)
+        .filter(SearchQueryStat.user_id == (SearchQueryStat.ALL_USERS if user_id is None else user_id),
+                SearchQueryStat.day >= since)
+    )
+    if search_method is not None:
+        query = query.filter(SearchQueryStat.search_method == search_method)
+    rows = (
+        query.group_by(SearchQueryStat.search_method, SearchQueryStat.search_content)
+        .order_by(total.desc(), last_search_at.desc())
+        .limit(limit)
+        .all()
+    )
+    return [{'search_method': row.search_method, 'search_content': row.search_content, 'count': int(row.count),
+             'last_search_at': _isoformat(row.last_search_at)} for row in rows]
+
+
+def _isoformat(value) -> str:
+    # SQLite 上聚合函数返回字符串
+    return value.isoformat() if isinstance(value, (datetime, date)) else value
+
+
+def rebuild_search_stats(batch_size: int = 1000) -> int:
+    """
+    清空 search_query_stat 并从 search_history 重新累加,用于首次部署或修复聚合数据,调用方负责提交
+
+    参数:
+    batch_size (int): 每批读取的搜索历史行数
+
+    返回:
+    int: 累加的搜索历史行数
+    """
+    SearchQueryStat.query.delete(synchronize_session=False)
+    columns = (SearchHistory.id, SearchHistory.user_id, SearchHistory.search_method, SearchHistory.search_content,
+               SearchHistory.search_at)
+    total, last_id = 0, 0
+    while True:
+        # 按主键分批读取,每批读完再写入,不在同一连接上边读游标边执行 upsert
+        rows = (
+            db.session.query(*columns)
+            .filter(SearchHistory.id > last_id, SearchHistory.search_at.isnot(None))
+            .order_by(SearchHistory.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            return total
+        update_search_stats(tuple(row)[1:] for row in rows)
+        total += len(rows)
+        last_id = rows[-1].id
+
+
+class SearchHistoryWriter:
+    """
+    异步批量写入搜索历史
+
+    搜索请求只把 (user_id, search_method, search_content, search_at) 放入内存中的有界队列,
+    后台线程凑满 batch_size 条或第一条等待超过 flush_interval 秒后,用一条多行 INSERT ... VALUES (...), (...)
+    写入 search_history,并在同一事务中累加 search_query_stat,搜索的延迟不再受写入负载影响。
+    - 队列满时按 full_policy 处理: drop 直接丢弃,block 最多等待 block_timeout 秒,仍然满则丢弃
+    - 整批写入失败时 (例如某个 user_id 不存在) 逐条重试,只丢弃写不进去的记录
+    - 进程退出时 (atexit) 写完队列中剩余的记录
+    未启动时 record 退化为在调用方的会话中同步写入。
+    """
+
+    DROP = 'drop'
+    BLOCK = 'block'
+    FULL_POLICIES = (DROP, BLOCK)
+
+    __instance = None
+    __instance_lock = threading.Lock()
+
+    def __init__(self):
+        self.batch_size = 500
+        self.flush_interval = 1.0
+        self.full_policy = self.DROP
+        self.block_timeout = 0.05
+        self._app = None
+        self._queue = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._metrics_lock = threading.Lock()
+        self._recorded = 0
+        self._dropped = 0
+        self._written = 0
+        self._failed = 0
+        self._batches = 0
+        self._max_queue_depth = 0
+
+    @classmethod
+    def get_instance(cls) -> 'SearchHistoryWriter':
+        if cls.__instance is None:
+            with cls.__instance_lock:
+                if cls.__instance is None:
+                    cls.__instance = cls()
+        return cls.__instance
+
+    def start(self, app: Flask, buffer_size: int = 10000, batch_size: int = 500, flush_interval: float = 1.0,
+              full_policy: str = DROP, block_timeout: float = 0.05):
+        """
+        启动后台写入线程
+
+        参数:
+        app (Flask): Flask 应用,写入线程在其应用上下文中访问数据库
+        buffer_size (int): 队列中最多缓存的记录数
+        batch_size (int): 每次 INSERT 最多写入的记录数
+        flush_interval (float): 记录在队列中最多停留的秒数
+        full_policy (str): 队列满时的处理方式,drop 或 block
+        block_timeout (float): block 模式下最多等待的秒数
+        """
+        if full_policy not in self.FULL_POLICIES:
+            raise ValueError(f'Unknown search history full_policy: {full_policy}, expected one of {self.FULL_POLICIES}')
+        if self._thread is not None:
+            return
+        self._app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.full_policy = full_policy
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=buffer_size)
+        self._thread = threading.Thread(target=self._run, name='search-history-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout: float = 10.0):
+        """
+        停止接收新记录,等待后台线程写完队列中剩余的记录
+        """
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join(timeout)
+
+    def record(self, user_id: int, search_method: int, search_content: str) -> bool:
+        """
+        记录一次搜索
+
+        参数:
+        user_id (int): 用户 ID
+        search_method (int): 0: image, 1: name, 2: tags
+        search_content (str): 搜索内容
+
+        返回:
+        bool: 是否已记录,未登录 (没有 user_id)、user_id 不是整数或队列满被丢弃时为 False
+        """
+        if user_id is None or user_id == '':
+            return False
+        # user_id 来自请求参数,格式错误时只丢弃这条历史,不影响搜索本身
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            current_app.logger.warning(f'Dropped search history with invalid user_id {user_id!r}')
+            return False
+        search_at = datetime.now(timezone.utc)
+        if self._thread is None or self._stopped.is_set():
+            record_search(user_id, search_method, search_content, search_at)
+            return True
+
+        item = (user_id, search_method, search_content, search_at)
+        try:
+            if self.full_policy == self.BLOCK:
+                self._queue.put(item, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(item)
+        except queue.Full:
+            with self._metrics_lock:
+                self._dropped += 1
+            return False
+        with self._metrics_lock:
+            self._recorded += 1
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return True
+
+    def metrics(self) -> dict:
+        """
+        返回写入器的运行指标:当前和历史最大队列深度、已接收 / 丢弃 / 写入 / 写入失败的记录数和批次数
+        """
+        with self._metrics_lock:
+            return {
+                'running': self._thread is not None and not self._stopped.is_set(),
+                'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+                'max_queue_depth': self._max_queue_depth,
+                'recorded': self._recorded,
+                'dropped': self._dropped,
+                'written': self._written,
+                'failed': self._failed,
+                'batches': self._batches,
+                'average_batch_size': (self._written + self._failed) / self._batches if self._batches else 0,
+            }
+
+    def _collect(self) -> list:
+        batch, deadline = [], None
+        while len(batch) < self.batch_size:
+            try:
+                if self._stopped.is_set():
+                    # 退出前尽快写完剩余的记录,不再等待凑批
+                    item = self._queue.get_nowait()
+                else:
+                    remaining = self.flush_interval if deadline is None else deadline - time.monotonic()
+                    item = self._queue.get(timeout=max(remaining, 0))
+            except queue.Empty:
+                break
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch:
+                with self._app.app_context():
+                    try:
+                        self._write(batch)
+                    finally:
+                        db.session.remove()
+            elif self._stopped.is_set():
+                return
+
+    def _write(self, batch: list):
+        try:
+            self._insert(batch)
+            written = len(batch)
+        except Exception as e:
+            db.session.rollback()
+            # 只记录驱动返回的错误,SQLAlchemy 的异常信息中包含整条多行 INSERT
+            self._app.logger.warning(f'Failed to write {len(batch)} search history rows, retrying one by one: '
+                                     f'{getattr(e, "orig", e)}')
+            written = 0
+            for item in batch:
+                try:
+                    self._insert([item])
+                    written += 1
+                except Exception as item_error:
+                    db.session.rollback()
+                    self._app.logger.error(f'Dropped search history {item}: {getattr(item_error, "orig", item_error)}')
+        with self._metrics_lock:
+            self._written += written
+            self._failed += len(batch) - written
+            self._batches += 1
+
+    @staticmethod
+    def _insert(batch: list):
+        rows = [{'user_id': user_id, 'search_method': search_method, 'search_content': search_content,
+                 'search_at': search_at} for user_id, search_method, search_content, search_at in batch]
+        # values(rows) 生成一条多行 INSERT,而不是逐行执行
+        db.session.execute(insert(SearchHistory.__table__).values(rows))
+        update_search_stats(batch)
+        db.session.commit()
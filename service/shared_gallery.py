@@ -0,0 +1,261 @@
+import fcntl
+import glob
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterable, Tuple
+
+import numpy as np
+
+from service.similarity_index import SimilarityIndex
+
+
+class SharedGallery:
+    """
+    在多个 worker 进程之间共享的只读图库快照
+
+    归一化后的向量矩阵和 id 数组写在磁盘文件中,每个 worker 以只读方式 mmap,
+    数据只在操作系统的页缓存中存在一份,不随 worker 数量增长。
+    CURRENT.json 记录当前的代数 (generation)、数据文件名和有效行数,通过原子替换发布:
+
+    - 追加: 直接写到当前数据文件末尾再增加有效行数,已经 mmap 的 worker 只读取旧的行数范围,不受影响
+    - 删除和替换: 写出新的数据文件后再切换 CURRENT.json,只保留最近 KEEP_FILES 份数据文件,更早的在发布时删除
+
+    每次发布 generation 都会加一,worker 发现 generation 变化时重新 mmap 即可,不需要各自重建。
+    """
+
+    CURRENT_FILE = 'CURRENT.json'
+    LOCK_FILE = '.lock'
+    # 保留的数据文件份数 (包括当前版本),读取 CURRENT.json 之后来得及 mmap 之前最多可以再发布 KEEP_FILES - 1 次
+    KEEP_FILES = 4
+
+    def __init__(self, path: str):
+        """
+        参数:
+        path (str): 快照文件所在目录
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    def read_current(self) -> dict:
+        """
+        读取当前发布的快照信息,尚未发布时返回空字典
+        """
+        try:
+            with open(os.path.join(self.path, self.CURRENT_FILE), 'r') as current_file:
+                return json.load(current_file)
+        except FileNotFoundError:
+            return {}
+
+    def attach(self, current: dict = None) -> Tuple[int, np.ndarray, np.ndarray]:
+        """
+        以只读方式 mmap 当前发布的快照
+
+        参数:
+        current (dict): read_current 的结果,为空时重新读取
+
+        返回:
+        Tuple[int, np.ndarray, np.ndarray]: (generation, Fish id 数组, 归一化向量矩阵)
+        """
+        try:
+            return self._attach(current or self.read_current())
+        except FileNotFoundError:
+            # 读取 CURRENT.json 之后,数据文件恰好被其他进程的多次发布删除,重新读取一次 CURRENT.json
+            return self._attach(self.read_current())
+
+    def _attach(self, current: dict) -> Tuple[int, np.ndarray, np.ndarray]:
+        count, dim = current.get('count', 0), current.get('dim', 0)
+        if count == 0:
+            return current.get('generation', 0), np.empty((0,), dtype=np.int64), np.empty((0, dim), dtype=np.float32)
+
+        prefix = os.path.join(self.path, current['file'])
+        ids = np.memmap(f'{prefix}.ids', dtype=np.int64, mode='r', shape=(count,))
+        matrix = np.memmap(f'{prefix}.f32', dtype=np.float32, mode='r', shape=(count, dim))
+        return current['generation'], ids, matrix
+
+    def publish(self, ids: np.ndarray, matrix: np.ndarray):
+        """
+        写出一个全新的快照并切换为当前版本
+
+        参数:
+        ids (np.ndarray): Fish id 数组
+        matrix (np.ndarray): 已归一化的向量矩阵
+        """
+        with self._write_lock():
+            self._publish(self.read_current(), np.asarray(ids, dtype=np.int64),
+                          np.ascontiguousarray(matrix, dtype=np.float32))
+
+    def add(self, ids: Iterable[int], matrix: np.ndarray):
+        """
+        增量写入已归一化的向量,已存在的 id 会被替换
+
+        参数:
+        ids (Iterable[int]): Fish id 列表
+        matrix (np.ndarray): 与 ids 对应的已归一化向量矩阵
+        """
+        ids = np.fromiter((int(fish_id) for fish_id in ids), dtype=np.int64)
+        matrix = np.ascontiguousarray(np.atleast_2d(matrix), dtype=np.float32)
+        if ids.shape[0] == 0:
+            return
+
+        with self._write_lock():
+            current = self.read_current()
+            if current.get('count', 0) > 0 and current['dim'] != matrix.shape[1]:
+                # 模型或特征头变化后旧快照中的向量无法与新向量混用,需要用完整的新图库重新发布
+                raise ValueError(f'Embedding dimension mismatch: shared gallery has {current["dim"]} dimensions, '
+                                 f'got {matrix.shape[1]}; run flask reindex --full and restart the workers to '
+                                 f'publish a new snapshot')
+            _, old_ids, old_matrix = self.attach(current)
+            replaced = np.isin(old_ids, ids)
+            if current.get('count', 0) == 0 or replaced.any():
+                # 替换已发布的行需要写出新文件
+                keep = ~replaced
+                self._publish(current, np.concatenate([old_ids[keep], ids]),
+                              np.concatenate([old_matrix[keep], matrix]) if keep.any() else matrix)
+                return
+
+            # 只追加时直接写到当前文件末尾,已经 mmap 的 worker 不会读到超出其行数范围的数据
+            prefix = os.path.join(self.path, current['file'])
+            count = current['count']
+            self._append(f'{prefix}.ids', count * 8, ids.tobytes())
+            self._append(f'{prefix}.f32', count * current['dim'] * 4, matrix.tobytes())
+            self._write_current({**current, 'generation': current['generation'] + 1, 'count': count + ids.shape[0]})
+
+    def remove(self, ids: Iterable[int]):
+        """
+        删除给定 id 的向量
+
+        参数:
+        ids (Iterable[int]): Fish id 列表
+        """
+        ids = np.fromiter((int(fish_id) for fish_id in ids), dtype=np.int64)
+        with self._write_lock():
+            current = self.read_current()
+            _, old_ids, old_matrix = self.attach(current)
+            keep = ~np.isin(old_ids, ids)
+            if keep.all():
+                return
+            self._publish(current, np.asarray(old_ids[keep]), np.asarray(old_matrix[keep]))
+
+    @staticmethod
+    def _append(path: str, offset: int, data: bytes):
+        with open(path, 'ab') as data_file:
+            # 丢弃上次写入中断时可能残留的数据
+            data_file.truncate(offset)
+            data_file.write(data)
+            data_file.flush()
+            os.fsync(data_file.fileno())
+
+    def _publish(self, current: dict, ids: np.ndarray, matrix: np.ndarray):
+        generation = current.get('generation', 0) + 1
+        name = f'gallery-{generation}'
+        prefix = os.path.join(self.path, name)
+        for suffix, data in (('ids', ids), ('f32', matrix)):
+            with open(f'{prefix}.{suffix}', 'wb') as data_file:
+                data_file.write(data.tobytes())
+                data_file.flush()
+                os.fsync(data_file.fileno())
+
+        self._write_current({'generation': generation, 'file': name, 'count': int(ids.shape[0]),
+                             'dim': int(matrix.shape[1]) if matrix.ndim == 2 else 0})
+
+        # 删除最近 KEEP_FILES 份之外的数据文件;仍然 mmap 着旧文件的 worker 在 POSIX 上可以继续读取,直到重新 attach
+        generations = {}
+        for old_path in glob.glob(os.path.join(self.path, 'gallery-*')):
+            old_name = os.path.basename(old_path).split('.', 1)[0]
+            generations.setdefault(int(old_name[len('gallery-'):]), []).append(old_path)
+        for old_generation in sorted(generations, reverse=True)[self.KEEP_FILES:]:
+            for old_path in generations[old_generation]:
+                try:
+                    os.remove(old_path)
+                except FileNotFoundError:
+                    pass
+
+    def _write_current(self, current: dict):
+        current_path = os.path.join(self.path, self.CURRENT_FILE)
+        tmp_path = f'{current_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as current_file:
+            json.dump(current, current_file)
+            current_file.flush()
+            os.fsync(current_file.fileno())
+        os.replace(tmp_path, current_path)
+
+    @contextmanager
+    def _write_lock(self):
+        with self._lock:
+            with open(os.path.join(self.path, self.LOCK_FILE), 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class SharedIndex(SimilarityIndex):
+    """
+    直接在 SharedGallery 的 mmap 快照上检索的精确索引
+
+    查询前检查 CURRENT.json 是否变化 (一次 stat),变化时重新 mmap 新的快照;
+    add / remove 写入共享快照后,其他 worker 在下一次查询时自动看到更新。
+    """
+
+    def __init__(self, gallery: SharedGallery):
+        """
+        参数:
+        gallery (SharedGallery): 共享的图库快照
+        """
+        super().__init__()
+        self.gallery = gallery
+        self._generation = -1
+        self._current_mtime = None
+        self.refresh()
+
+    def refresh(self):
+        """
+        CURRENT.json 有变化时重新 mmap 最新的快照
+        """
+        try:
+            stat = os.stat(os.path.join(self.gallery.path, SharedGallery.CURRENT_FILE))
+        except FileNotFoundError:
+            return
+        # CURRENT.json 每次都是原子替换的新文件,inode 和修改时间任一变化都说明有新的发布
+        mtime = (stat.st_ino, stat.st_mtime_ns)
+        if mtime == self._current_mtime:
+            return
+
+        with self._lock:
+            current = self.gallery.read_current()
+            if current.get('generation') != self._generation:
+                generation, ids, matrix = self.gallery.attach(current)
+                self._rows = {int(fish_id): row for row, fish_id in enumerate(ids)}
+                self._view = (ids, matrix)
+                self._generation = generation
+            self._current_mtime = mtime
+
+    @property
+    def generation(self) -> int:
+        # 与共享快照的 generation 一致,其他 worker 发布的更新同样会让它变化
+        self.refresh()
+        return self._generation
+
+    def __len__(self) -> int:
+        self.refresh()
+        return super().__len__()
+
+    def __contains__(self, fish_id: int) -> bool:
+        self.refresh()
+        return super().__contains__(fish_id)
+
+    def add(self, ids: Iterable[int], vectors: np.ndarray):
+        self.gallery.add(ids, self.normalize(np.atleast_2d(vectors)))
+        self.refresh()
+
+    def remove(self, ids: Iterable[int]):
+        self.gallery.remove(ids)
+        self.refresh()
+
+    def search_batch(self, queries: np.ndarray, top_k: int = None):
+        self.refresh()
+        return super().search_batch(queries, top_k)
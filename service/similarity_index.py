@@ -0,0 +1,240 @@
+import threading
+from typing import Callable, Iterable, List, Tuple
+
+import numpy as np
+
+
+class SimilarityIndex:
+    """
+    基于连续 NumPy 矩阵的精确 top-k 余弦相似度检索
+
+    图库向量在写入时就做 L2 归一化并保存为一个 float32 矩阵,与之平行的 ids 数组保存对应的 Fish id。
+    查询时只需一次矩阵-向量乘法得到所有余弦相似度,再用 argpartition 取出 top-k,
+    避免了逐条调用 scipy 的 cosine 以及对全部结果排序。
+
+    矩阵预留了额外容量,新增向量直接写到已有数据之后,不需要重建整个矩阵。
+    查询总是基于一份 (ids, matrix) 快照进行:追加只写快照之外的行,删除和替换则写到新的缓冲区后再整体发布,
+    因此更新与并发查询之间不需要加锁。
+
+    每次发布新的快照 generation 都会加一,调用方可以用它判断基于旧图库的缓存结果是否还有效。
+
+    子类可以通过 storage_dtype、_encode 和 _scores 改变向量在内存中的存储形式 (见 service/quantization.py)。
+    """
+
+    storage_dtype = np.float32
+
+    def __init__(self, ids: np.ndarray = None, matrix: np.ndarray = None, dim: int = 0, rerank: int = 0,
+                 vector_source: Callable[[List[int]], Tuple[np.ndarray, np.ndarray]] = None):
+        """
+        参数:
+        ids (np.ndarray): Fish id 数组,形状为 (N,)
+        matrix (np.ndarray): 已归一化并按 storage_dtype 编码的向量矩阵,形状为 (N, D)
+        dim (int): 向量维度,图库为空时使用
+        rerank (int): 大于 0 时先取出这么多个候选,再用 vector_source 提供的原始向量精确重排
+        vector_source (Callable): 根据 Fish id 列表返回 (Fish id 数组, 原始向量矩阵),例如 EmbeddingStore.get_vectors
+        """
+        if matrix is None:
+            matrix = np.empty((0, dim), dtype=self.storage_dtype)
+        if ids is None:
+            ids = np.empty((0,), dtype=np.int64)
+        self.rerank = rerank
+        self.vector_source = vector_source
+        self._lock = threading.Lock()
+        self._id_buffer = np.array(ids, dtype=np.int64)
+        self._matrix_buffer = np.array(matrix, dtype=self.storage_dtype, order='C')
+        self._size = self._id_buffer.shape[0]
+        self._rows = {int(fish_id): row for row, fish_id in enumerate(self._id_buffer)}
+        self._generation = 0
+        self._publish()
+
+    def _publish(self):
+        # 用一次赋值同时替换 ids 和 matrix,查询线程不会看到不一致的组合
+        self._view = (self._id_buffer[:self._size], self._matrix_buffer[:self._size])
+        self._generation += 1
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._view[0]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._view[1]
+
+    @classmethod
+    def from_vectors(cls, ids: Iterable[int], vectors: Iterable[np.ndarray]) -> 'SimilarityIndex':
+        """
+        由未归一化的向量构建索引
+
+        参数:
+        ids (Iterable[int]): Fish id 列表
+        vectors (Iterable[np.ndarray]): 与 ids 一一对应的向量列表
+
+        返回:
+        SimilarityIndex: 构建好的索引
+        """
+        index = cls()
+        vectors = list(vectors)
+        if vectors:
+            index.add(ids, np.stack(vectors))
+        return index
+
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        """
+        对向量 (或向量矩阵的每一行) 做 L2 归一化,归一化之后点积即为余弦相似度
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, np.finfo(np.float32).eps)
+
+    def __len__(self) -> int:
+        return self.ids.shape[0]
+
+    def __contains__(self, fish_id: int) -> bool:
+        return fish_id in self._rows
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    def add(self, ids: Iterable[int], vectors: np.ndarray):
+        """
+        增量写入向量,已存在的 id 会被替换,新的 id 追加到矩阵末尾
+
+        参数:
+        ids (Iterable[int]): Fish id 列表
+        vectors (np.ndarray): 与 ids 一一对应的未归一化向量矩阵,形状为 (N, D)
+        """
+        ids = [int(fish_id) for fish_id in ids]
+        if not ids:
+            return
+        vectors = self._encode(self.normalize(np.atleast_2d(vectors)))
+
+        with self._lock:
+            id_buffer, matrix_buffer = self._id_buffer, self._matrix_buffer
+            if self._size == 0 and matrix_buffer.shape[1] != vectors.shape[1]:
+                matrix_buffer = np.empty((0, vectors.shape[1]), dtype=self.storage_dtype)
+            if matrix_buffer.shape[1] != vectors.shape[1]:
+                raise ValueError(f'Embedding dimension mismatch: expected {matrix_buffer.shape[1]}, '
+                                 f'got {vectors.shape[1]}')
+
+            existing = [i for i, fish_id in enumerate(ids) if fish_id in self._rows]
+            appended = [i for i, fish_id in enumerate(ids) if fish_id not in self._rows]
+
+            if existing:
+                # 替换已发布的行需要写时复制,否则正在进行的查询可能读到一半新一半旧的数据
+                matrix_buffer = matrix_buffer.copy()
+                for i in existing:
+                    matrix_buffer[self._rows[ids[i]]] = vectors[i]
+
+            size = self._size + len(appended)
+            if size > matrix_buffer.shape[0]:
+                # 容量不足时按倍数扩容,保证追加的均摊代价为 O(1)
+                capacity = max(size, 2 * matrix_buffer.shape[0], 16)
+                new_ids = np.empty((capacity,), dtype=np.int64)
+                new_matrix = np.empty((capacity, vectors.shape[1]), dtype=self.storage_dtype)
+                new_ids[:self._size] = id_buffer[:self._size]
+                new_matrix[:self._size] = matrix_buffer[:self._size]
+                id_buffer, matrix_buffer = new_ids, new_matrix
+
+            for offset, i in enumerate(appended):
+                row = self._size + offset
+                id_buffer[row] = ids[i]
+                matrix_buffer[row] = vectors[i]
+                self._rows[ids[i]] = row
+
+            self._id_buffer, self._matrix_buffer, self._size = id_buffer, matrix_buffer, size
+            self._publish()
+
+    def remove(self, ids: Iterable[int]):
+        """
+        删除给定 id 的向量,不存在的 id 会被忽略
+
+        参数:
+        ids (Iterable[int]): Fish id 列表
+        """
+        with self._lock:
+            removed = {int(fish_id) for fish_id in ids} & self._rows.keys()
+            if not removed:
+                return
+
+            keep = np.fromiter((int(fish_id) not in removed for fish_id in self.ids), dtype=bool, count=self._size)
+            # 删除同样写时复制,新的缓冲区不预留容量,下次追加时再扩容
+            self._id_buffer = self._id_buffer[:self._size][keep]
+            self._matrix_buffer = self._matrix_buffer[:self._size][keep]
+            self._size = self._id_buffer.shape[0]
+            self._rows = {int(fish_id): row for row, fish_id in enumerate(self._id_buffer)}
+            self._publish()
+
+    def search(self, query: np.ndarray, top_k: int = None) -> List[Tuple[int, float]]:
+        """
+        查找与单个查询向量最相似的 top_k 个图库向量
+
+        参数:
+        query (np.ndarray): 查询向量,形状为 (D,)
+        top_k (int): 返回数量,为空时返回全部
+
+        返回:
+        List[Tuple[int, float]]: (Fish id, 余弦相似度) 列表,按相似度从高到低排列
+        """
+        return self.search_batch(np.asarray(query)[np.newaxis, :], top_k)[0]
+
+    def search_batch(self, queries: np.ndarray, top_k: int = None) -> List[List[Tuple[int, float]]]:
+        """
+        一次性为多个查询向量查找 top_k 个最相似的图库向量
+
+        参数:
+        queries (np.ndarray): 查询向量矩阵,形状为 (Q, D)
+        top_k (int): 每个查询的返回数量,为空时返回全部
+
+        返回:
+        List[List[Tuple[int, float]]]: 每个查询对应一个 (Fish id, 余弦相似度) 列表,按相似度从高到低排列
+        """
+        queries = self.normalize(np.atleast_2d(queries))
+        ids, matrix = self._view
+        if ids.shape[0] == 0:
+            return [[] for _ in range(queries.shape[0])]
+
+        scores = self._scores(queries, matrix)
+        if self.rerank > 0 and self.vector_source is not None:
+            return [self._rerank(ids, row, query, top_k) for row, query in zip(scores, queries)]
+        return [self._top_k(ids, row, top_k) for row in scores]
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        将已归一化的向量编码为内存中的存储形式
+        """
+        return vectors.astype(self.storage_dtype, copy=False)
+
+    def _scores(self, queries: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+        """
+        计算查询向量与所有图库向量的 (近似) 余弦相似度,返回形状为 (Q, N) 的矩阵
+        """
+        # (Q, D) x (D, N) -> (Q, N),每一行就是该查询与所有图库向量的余弦相似度
+        return queries @ matrix.T
+
+    def _rerank(self, ids: np.ndarray, scores: np.ndarray, query: np.ndarray,
+                top_k: int = None) -> List[Tuple[int, float]]:
+        # 先按近似分数取出候选,再用原始向量重新计算精确的余弦相似度
+        candidates = self._top_k(ids, scores, max(self.rerank, top_k or 0))
+        candidate_ids, vectors = self.vector_source([fish_id for fish_id, _ in candidates])
+        if candidate_ids.shape[0] == 0:
+            return candidates[:top_k]
+        return self._top_k(candidate_ids, self.normalize(vectors) @ query, top_k)
+
+    @staticmethod
+    def _top_k(ids: np.ndarray, scores: np.ndarray, top_k: int = None) -> List[Tuple[int, float]]:
+        n = scores.shape[0]
+        if top_k is not None and top_k <= 0:
+            return []
+        if top_k is None or top_k >= n:
+            order = np.argsort(-scores)
+        else:
+            # argpartition 只保证前 top_k 个是最大的,再对这 top_k 个排序即可
+            candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+            order = candidates[np.argsort(-scores[candidates])]
+        return [(int(ids[i]), float(scores[i])) for i in order]
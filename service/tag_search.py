@@ -0,0 +1,163 @@
+import re
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import case, distinct, func, insert, or_
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from model import Fish, FishTag, Tag
+
+# 标签之间的分隔符: 半角 / 全角逗号、顿号、分号
+TAG_SEPARATORS = re.compile(r'[,，、;；]')
+TAG_MAX_LENGTH = 64
+
+MATCH_EXACT = 'exact'
+MATCH_PREFIX = 'prefix'
+MATCH_MODES = (MATCH_EXACT, MATCH_PREFIX)
+OPERATOR_AND = 'and'
+OPERATOR_OR = 'or'
+OPERATORS = (OPERATOR_AND, OPERATOR_OR)
+
+
+def parse_tags(text: Optional[str]) -> List[str]:
+    """
+    将逗号分割的标签字符串拆分为规范化的标签:去掉首尾空白、转为小写、去重并保持原有顺序
+
+    参数:
+    text (str): 例如 "tag1, Tag2,tag3"
+
+    返回:
+    List[str]: 例如 ['tag1', 'tag2', 'tag3']
+    """
+    if not text:
+        return []
+    tags = []
+    for tag in TAG_SEPARATORS.split(text):
+        tag = tag.strip().lower()[:TAG_MAX_LENGTH]
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def resolve_tag_ids(names: Iterable[str]) -> Dict[str, int]:
+    """
+    查找标签对应的 id,不存在的标签在当前事务中创建
+
+    参数:
+    names (Iterable[str]): 规范化后的标签
+
+    返回:
+    Dict[str, int]: 标签到 id 的映射
+    """
+    names = set(names)
+    if not names:
+        return {}
+    tag_ids = dict(db.session.query(Tag.name, Tag.id).filter(Tag.name.in_(names)).all())
+    for name in names - tag_ids.keys():
+        # 并发请求可能同时创建同一个标签,用保存点隔离唯一约束冲突,冲突时改为读取对方创建的行
+        try:
+            with db.session.begin_nested():
+                tag = Tag(name=name)
+                db.session.add(tag)
+            tag_ids[name] = tag.id
+        except IntegrityError:
+            tag_ids[name] = db.session.query(Tag.id).filter(Tag.name == name).scalar()
+    return tag_ids
+
+
+def set_fish_tags(fish_ids_and_tags: Sequence[Tuple[int, Optional[str]]]):
+    """
+    按 Fish.tags 字符串重写一批 Fish 的 fish_tag 关联,在调用方的事务中执行,不提交
+
+    参数:
+    fish_ids_and_tags (Sequence[Tuple[int, str]]): (fish_id, 逗号分割的标签)
+    """
+    parsed = [(fish_id, parse_tags(tags)) for fish_id, tags in fish_ids_and_tags]
+    fish_ids = [fish_id for fish_id, _ in parsed]
+    if not fish_ids:
+        return
+    db.session.query(FishTag).filter(FishTag.fish_id.in_(fish_ids)).delete(synchronize_session=False)
+    tag_ids = resolve_tag_ids(tag for _, tags in parsed for tag in tags)
+    rows = [{'fish_id': fish_id, 'tag_id': tag_ids[tag]} for fish_id, tags in parsed for tag in tags]
+    if rows:
+        db.session.execute(insert(FishTag.__table__).values(rows))
+
+
+def backfill_fish_tags(batch_size: int = 500) -> int:
+    """
+    为还没有 fish_tag 关联的 Fish 从 Fish.tags 生成关联,可以重复执行,每批提交一次
+
+    参数:
+    batch_size (int): 每批处理的 Fish 数量
+
+    返回:
+    int: 处理的 Fish 数量
+    """
+    tagged = db.session.query(FishTag.fish_id).filter(FishTag.fish_id == Fish.id).exists()
+    total, last_id = 0, 0
+    while True:
+        rows = (
+            db.session.query(Fish.id, Fish.tags)
+            .filter(Fish.id > last_id, Fish.tags.isnot(None), Fish.tags != '', ~tagged)
+            .order_by(Fish.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            return total
+        set_fish_tags([tuple(row) for row in rows])
+        db.session.commit()
+        total += len(rows)
+        last_id = rows[-1].id
+
+
+def search_fish_ids(terms: Sequence[str], match: str = MATCH_PREFIX, operator: str = OPERATOR_OR,
+                    limit: Optional[int] = None) -> List[Tuple[int, int]]:
+    """
+    按标签搜索 Fish,结果按命中的查询词数量倒序排列,数量相同时较新的 Fish 在前
+
+    先在 tag 表的唯一索引上找出每个查询词对应的标签 (精确匹配为等值查找,前缀匹配为 LIKE 'term%' 的范围扫描),
+    再在 fish_tag 的 (tag_id, fish_id) 索引上按 Fish 分组统计命中的查询词数量,不扫描 Fish 表。
+
+    参数:
+    terms (Sequence[str]): 规范化后的查询词
+    match (str): exact 或 prefix
+    operator (str): or 命中任一查询词即返回,and 要求命中全部查询词
+    limit (int): 返回数量,可选
+
+    返回:
+    List[Tuple[int, int]]: (fish_id, 命中的查询词数量)
+    """
+    if match not in MATCH_MODES:
+        raise ValueError(f'Unknown match mode: {match}, expected one of {MATCH_MODES}')
+    if operator not in OPERATORS:
+        raise ValueError(f'Unknown operator: {operator}, expected one of {OPERATORS}')
+    if not terms:
+        return []
+
+    if match == MATCH_EXACT:
+        condition = Tag.name.in_(terms)
+    else:
+        condition = or_(*[Tag.name.startswith(term, autoescape=True) for term in terms])
+    # 标签 id -> 它命中的查询词下标,前缀匹配时一个标签可能同时以多个查询词开头,归到最长 (最具体) 的那个
+    term_of_tag = {}
+    for tag_id, name in db.session.query(Tag.id, Tag.name).filter(condition).all():
+        candidates = [index for index, term in enumerate(terms)
+                      if name == term or (match == MATCH_PREFIX and name.startswith(term))]
+        if candidates:
+            term_of_tag[tag_id] = max(candidates, key=lambda index: len(terms[index]))
+    if not term_of_tag or (operator == OPERATOR_AND and len(set(term_of_tag.values())) < len(terms)):
+        return []
+
+    matched = func.count(distinct(case(term_of_tag, value=FishTag.tag_id))).label('matched')
+    query = (
+        db.session.query(FishTag.fish_id, matched)
+        .filter(FishTag.tag_id.in_(list(term_of_tag)))
+        .group_by(FishTag.fish_id)
+    )
+    if operator == OPERATOR_AND:
+        query = query.having(matched == len(terms))
+    query = query.order_by(matched.desc(), FishTag.fish_id.desc())
+    if limit:
+        query = query.limit(limit)
+    return [(fish_id, count) for fish_id, count in query.all()]
@@ -0,0 +1,123 @@
+"""
+测试使用内存中的 SQLite 数据库
+
+app.py 导入时会读取 db/configuration.json 并连接 MySQL,测试中改为在 sys.modules 中注册一个提供 app 和 db 的
+app 模块,之后导入的 model、service 和 controllers 都使用这个 SQLite 数据库。
+"""
+import itertools
+import os
+import sys
+import threading
+import types
+
+import pytest
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.engine import RoutingSession  # noqa: E402
+
+
+def create_test_app() -> Flask:
+    app = Flask('fish_test')
+    app.config.update(
+        TESTING=True,
+        SQLALCHEMY_DATABASE_URI='sqlite://',
+        SQL_PROFILER=True,
+        SQL_PROFILER_STRICT=True,
+        NAME_INDEX_PINYIN=False,
+        NAME_INDEX_REFRESH_INTERVAL=0,
+        SEARCH_HISTORY_ASYNC=False,
+        RESPONSE_CACHE_BACKEND='none',
+    )
+    return app
+
+
+_app = create_test_app()
+_db = SQLAlchemy(_app, session_options={'class_': RoutingSession})
+_module = types.ModuleType('app')
+_module.app, _module.db = _app, _db
+sys.modules['app'] = _module
+
+from controllers.favorite_controller import favorite_bp  # noqa: E402
+from controllers.record_controller import records_bp  # noqa: E402
+from utils.sql_profiler import install_sql_profiler  # noqa: E402
+
+_app.register_blueprint(favorite_bp)
+_app.register_blueprint(records_bp)
+install_sql_profiler(_app)
+
+
+@pytest.fixture
+def app():
+    with _app.app_context():
+        _db.create_all()
+        try:
+            yield _app
+        finally:
+            _db.session.remove()
+            _db.drop_all()
+
+
+@pytest.fixture
+def db(app):
+    return _db
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(db):
+    from model import User
+
+    def make(name='alice'):
+        user = User(username=name, password='x', email=f'{name}@example.com', role=0)
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+    return make
+
+
+@pytest.fixture
+def make_fish(db, make_user):
+    from model import Fish, FishType
+    sequence = itertools.count(1)
+
+    def make(count=1, tags=None, fish_type_id=None):
+        n = next(sequence)
+        if fish_type_id is None:
+            fish_type = FishType(name_cn=f'鱼{n}', name_latin=f'Piscis {n}', description='')
+            db.session.add(fish_type)
+            db.session.flush()
+            fish_type_id = fish_type.id
+        user_id = make_user(f'uploader{n}')
+        fish = [Fish(fish_type_id=fish_type_id, image_url=f'https://example.com/{i}.jpg', tags=tags,
+                     uploaded_by=user_id) for i in range(count)]
+        db.session.add_all(fish)
+        db.session.commit()
+        return [item.id for item in fish]
+    return make
+
+
+@pytest.fixture
+def fish_service(app, tmp_path):
+    """
+    不加载模型、不读取数据库图库的 FishService,只用于测试图库索引的构建和切换
+    """
+    pytest.importorskip('torch')
+    from service.embedding_store import EmbeddingStore
+    from service.feature_heads import create_feature_head
+    from service.fish_service import FishService
+
+    service = FishService.__new__(FishService)
+    service.embedding_store = EmbeddingStore(str(tmp_path), 'test')
+    service.feature_head = create_feature_head()
+    service.result_cache = None
+    service._index_lock = threading.Lock()
+    service._indexed, service._indexed_revision = {}, None
+    service._pq_pending = False
+    return service
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from service.ann_index import IVFIndex
+
+
+def clustered(n, dim=64, n_clusters=50, seed=0):
+    # 真实的图片向量按鱼的种类聚集,用高斯混合近似
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim))
+    return (centers[rng.integers(0, n_clusters, n)] + 0.3 * rng.normal(size=(n, dim))).astype(np.float32)
+
+
+def queries_near(vectors, n=100, seed=1):
+    rng = np.random.default_rng(seed)
+    return vectors[:n] + 0.1 * rng.normal(size=(n, vectors.shape[1])).astype(np.float32)
+
+
+def test_recall_on_clustered_gallery():
+    vectors = clustered(3000)
+    index = IVFIndex.build(np.arange(3000), vectors)
+    assert index.recall(queries_near(vectors), top_k=5) >= 0.95
+
+
+def test_recall_grows_with_n_probe_and_is_exact_when_probing_every_list():
+    vectors = np.random.default_rng(0).normal(size=(2000, 64)).astype(np.float32)
+    index = IVFIndex.build(np.arange(2000), vectors)
+    queries = queries_near(vectors)
+    recalls = [index.recall(queries, top_k=5, n_probe=n_probe) for n_probe in (8, 32, index.n_lists)]
+    assert recalls == sorted(recalls)
+    assert recalls[0] >= 0.4
+    assert recalls[-1] == 1.0
+
+
+def test_add_remove_and_save_load(tmp_path):
+    vectors = clustered(500)
+    index = IVFIndex.build(np.arange(500), vectors)
+    index.add([1000], vectors[:1])
+    index.remove([0, 1, -1])
+    assert len(index) == 499 and 0 not in index and 1000 in index
+    assert index.search(vectors[0], top_k=1, n_probe=index.n_lists)[0][0] == 1000
+
+    path = str(tmp_path / 'ivf.npz')
+    index.save(path)
+    loaded = IVFIndex.load(path)
+    assert sorted(loaded.ids.tolist()) == sorted(index.ids.tolist())
+    assert loaded.trained_count == index.trained_count
+    assert loaded.search(vectors[5], top_k=3) == index.search(vectors[5], top_k=3)
+
+
+@pytest.fixture
+def ivf_config(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'IVF_N_LISTS', 8)
+    monkeypatch.setitem(app.config, 'IVF_N_PROBE', 8)
+
+
+def test_retrained_only_after_gallery_doubles(fish_service, ivf_config):
+    vectors = clustered(400)
+    ids = np.arange(400)
+    index = fish_service.load_ivf_index(ids[:100], vectors[:100], refreshed_ids=[])
+    assert index.trained_count == 100
+
+    # 不超过训练时的两倍:复用保存的簇中心,新向量直接分配到已有的簇
+    index = fish_service.load_ivf_index(ids[:200], vectors[:200], refreshed_ids=[])
+    assert index.trained_count == 100 and len(index) == 200
+
+    index = fish_service.load_ivf_index(ids[:201], vectors[:201], refreshed_ids=[])
+    assert index.trained_count == 201 and len(index) == 201
+
+    # 已删除的 Fish 在加载时从保存的索引中移除
+    index = fish_service.load_ivf_index(ids[1:201], vectors[1:201], refreshed_ids=[])
+    assert 0 not in index and len(index) == 200
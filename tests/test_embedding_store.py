@@ -0,0 +1,116 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from service.embedding_store import EmbeddingStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = EmbeddingStore(str(tmp_path), 'v1')
+    store.COMPACT_MIN_ROWS = 4
+    return store
+
+
+def vectors_for(values, dim=8):
+    return np.repeat(np.asarray(values, dtype=np.float32)[:, np.newaxis], dim, axis=1)
+
+
+def test_put_many_and_get_vectors(store):
+    store.put_many([1, 2, 3], ['a', 'b', 'c'], vectors_for([1, 2, 3]))
+    found_ids, vectors = store.get_vectors([3, 4, 1])
+    assert found_ids.tolist() == [3, 1]
+    assert vectors[:, 0].tolist() == [3, 1]
+    assert store.is_fresh(1, 'a') and not store.is_fresh(1, 'changed') and not store.is_fresh(4, 'd')
+    assert 2 in store and 4 not in store
+
+
+def test_dimension_mismatch_is_rejected(store):
+    store.put_many([1], ['a'], vectors_for([1]))
+    with pytest.raises(ValueError):
+        store.put_many([2], ['b'], vectors_for([2], dim=4))
+
+
+def test_overwrites_compact_and_survive_reopen(store, tmp_path):
+    store.put_many([1, 2, 3], ['a', 'b', 'c'], vectors_for([1, 2, 3]))
+    # 反复替换同一批 Fish,旧行不再被引用,超过阈值后自动压缩
+    for step in range(1, 6):
+        store.put_many([1, 2], [f'a{step}', f'b{step}'], vectors_for([10 * step + 1, 10 * step + 2]))
+    store.remove_many([3])
+
+    assert store.compactions > 0
+    assert store.count - store.dead_rows == 2
+    assert store.get_vectors([1, 2, 3])[1][:, 0].tolist() == [51, 52]
+
+    files = [name for name in os.listdir(os.path.join(str(tmp_path), 'v1')) if name.endswith('.f32')]
+    assert files == [store.vectors_file]
+
+    reopened = EmbeddingStore(str(tmp_path), 'v1')
+    found_ids, vectors = reopened.get_vectors([1, 2, 3])
+    assert found_ids.tolist() == [1, 2]
+    assert vectors[:, 0].tolist() == [51, 52]
+    assert reopened.is_fresh(1, 'a5') and 3 not in reopened
+
+
+def test_explicit_compact_keeps_every_vector(store):
+    store.put_many([1, 2, 3, 4], ['a', 'b', 'c', 'd'], vectors_for([1, 2, 3, 4]))
+    store.put_many([2], ['b2'], vectors_for([20]))
+    store.remove_many([3])
+
+    assert store.compact() == 2
+    assert store.dead_rows == 0
+    assert store.get_vectors([1, 2, 4])[1][:, 0].tolist() == [1, 20, 4]
+    assert sorted(entry['row'] for entry in store.entries.values()) == [0, 1, 2]
+
+
+def test_refresh_picks_up_other_writers(store, tmp_path):
+    other = EmbeddingStore(str(tmp_path), 'v1')
+    store.put_many([1], ['a'], vectors_for([1]))
+
+    revision = other.revision
+    assert other.refresh()
+    assert other.revision > revision
+    assert other.get_vectors([1])[1][:, 0].tolist() == [1]
+    assert not other.refresh()
+
+
+def test_snapshot_taken_before_compaction_stays_consistent(store):
+    store.put_many([1, 2, 3], ['a', 'b', 'c'], vectors_for([1, 2, 3]))
+    store.put_many([1], ['a2'], vectors_for([10]))
+    entries, vectors = store._snapshot
+
+    store.compact()
+    # 压缩发布新的字典和新文件的 mmap,旧快照中的行号仍然对应旧文件
+    assert entries is not store.entries
+    assert [vectors[entries[fish_id]['row'], 0] for fish_id in (1, 2, 3)] == [10, 2, 3]
+
+
+def test_other_model_version_is_separate(store, tmp_path):
+    store.put_many([1], ['a'], vectors_for([1]))
+    assert 1 not in EmbeddingStore(str(tmp_path), 'v2')
+
+
+def test_embedding_lock_lets_one_process_embed(store, tmp_path):
+    # flock 按打开的文件区分,两个线程各自打开锁文件,相当于两个 worker 进程
+    other = EmbeddingStore(str(tmp_path), 'v1')
+    entered, results = threading.Event(), []
+
+    def wait_for_owner():
+        entered.wait()
+        with other.embedding_lock() as owner:
+            results.append(('waiter', owner, other.refresh() and 1 in other))
+
+    waiter = threading.Thread(target=wait_for_owner)
+    waiter.start()
+    with store.embedding_lock() as owner:
+        results.append(('owner', owner))
+        entered.set()
+        store.put_many([1], ['a'], vectors_for([1]))
+        waiter.join(timeout=0.2)
+        assert waiter.is_alive()
+    waiter.join()
+
+    # 等待者在持有者计算完成后才拿到锁,并能直接读到写入的向量
+    assert results == [('owner', True), ('waiter', False, True)]
@@ -0,0 +1,136 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from service.job_queue import JobQueue
+
+
+@pytest.fixture
+def queue(app):
+    queue = JobQueue()
+    queue.retry_backoff = 10.0
+    return queue
+
+
+def utcnow():
+    # SQLite 读回的时间不带时区
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def enqueue(db, queue, kind, **kwargs):
+    job = queue.enqueue(kind, {'value': 1}, **kwargs)
+    db.session.commit()
+    return job.id
+
+
+def load(db, job_id):
+    from model import Job
+
+    db.session.expire_all()
+    return db.session.get(Job, job_id)
+
+
+def test_run_once_without_jobs(queue):
+    assert queue.run_once() is False
+
+
+def test_successful_job(db, queue):
+    from model import Job
+
+    payloads = []
+    queue.register('echo')(payloads.append)
+    job_id = enqueue(db, queue, 'echo')
+
+    assert queue.run_once() is True
+    job = load(db, job_id)
+    assert payloads == [{'value': 1}]
+    assert (job.status, job.attempts) == (Job.SUCCEEDED, 1)
+    assert job.finished_at is not None
+    assert queue.run_once() is False
+
+
+def test_delayed_job_is_not_claimed(db, queue):
+    queue.register('echo')(lambda payload: None)
+    enqueue(db, queue, 'echo', delay=60)
+    assert queue.run_once() is False
+
+
+def test_failed_job_is_retried_with_backoff(db, queue):
+    from model import Job
+
+    calls = []
+
+    @queue.register('flaky')
+    def flaky(payload):
+        calls.append(payload)
+        if len(calls) == 1:
+            raise RuntimeError('boom')
+
+    job_id = enqueue(db, queue, 'flaky', max_attempts=3)
+    assert queue.run_once() is True
+    job = load(db, job_id)
+    assert (job.status, job.attempts) == (Job.PENDING, 1)
+    assert 'RuntimeError: boom' in job.last_error
+    assert job.run_at > utcnow() + timedelta(seconds=5)
+
+    # 退避时间未到时不会被领取
+    assert queue.run_once() is False
+    job.run_at = utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    assert queue.run_once() is True
+    assert (load(db, job_id).status, len(calls)) == (Job.SUCCEEDED, 2)
+
+
+def test_job_is_dead_after_max_attempts_and_can_be_retried(db, queue):
+    from model import Job
+
+    @queue.register('broken')
+    def broken(payload):
+        raise ValueError('bad payload')
+
+    job_id = enqueue(db, queue, 'broken', max_attempts=1)
+    assert queue.run_once() is True
+    job = load(db, job_id)
+    assert (job.status, job.attempts) == (Job.DEAD, 1)
+
+    queue.retry(job)
+    db.session.commit()
+    job = load(db, job_id)
+    assert (job.status, job.attempts) == (Job.PENDING, 0)
+
+
+def test_unknown_kind_goes_straight_to_dead(db, queue):
+    from model import Job
+
+    job_id = enqueue(db, queue, 'unknown', max_attempts=5)
+    assert queue.run_once() is True
+    job = load(db, job_id)
+    assert job.status == Job.DEAD
+    assert 'No handler registered' in job.last_error
+
+
+def test_expired_lease_is_reclaimed(db, queue):
+    from model import Job
+
+    queue.register('echo')(lambda payload: None)
+    job_id = enqueue(db, queue, 'echo', max_attempts=2)
+    # 模拟领取任务的进程在执行途中退出
+    job = load(db, job_id)
+    job.status, job.attempts = Job.RUNNING, 1
+    job.locked_at = utcnow() - queue.lease - timedelta(seconds=1)
+    db.session.commit()
+
+    assert queue.run_once() is True
+    job = load(db, job_id)
+    assert (job.status, job.attempts) == (Job.SUCCEEDED, 2)
+
+
+def test_running_job_within_lease_is_not_reclaimed(db, queue):
+    from model import Job
+
+    queue.register('echo')(lambda payload: None)
+    job_id = enqueue(db, queue, 'echo')
+    job = load(db, job_id)
+    job.status, job.attempts, job.locked_at = Job.RUNNING, 1, utcnow()
+    db.session.commit()
+    assert queue.run_once() is False
@@ -0,0 +1,63 @@
+import pytest
+
+from service.name_index import EXACT, FUZZY, PREFIX, SUBSTRING, FishTypeNameIndex, edit_distance, normalize_name
+
+
+def test_normalize_name():
+    assert normalize_name(' Carassius  AURATUS ') == 'carassiusauratus'
+    assert normalize_name('ＡＢＣ') == 'abc'
+
+
+def test_edit_distance():
+    assert edit_distance('kitten', 'sitting', limit=3) == 3
+    assert edit_distance('kitten', 'sitting', limit=1) == 2
+    assert edit_distance('carp', 'carpio', limit=1, prefix=True) == 0
+
+
+@pytest.fixture
+def name_index(db):
+    from model import FishType
+
+    db.session.add_all([
+        FishType(name_cn='鲤鱼', name_latin='Cyprinus carpio', description=''),
+        FishType(name_cn='鲫鱼', name_latin='Carassius auratus', description=''),
+        FishType(name_cn='大黄鱼', name_latin='Larimichthys crocea', description=''),
+    ])
+    db.session.commit()
+    return FishTypeNameIndex(use_pinyin=False, refresh_interval=0)
+
+
+def test_exact_match_first(name_index):
+    results = name_index.search('鲤鱼')
+    assert (results[0]['name_cn'], results[0]['match']) == ('鲤鱼', EXACT)
+
+
+def test_prefix_match(name_index):
+    results = name_index.search('cyprinus')
+    assert (results[0]['name_cn'], results[0]['match']) == ('鲤鱼', PREFIX)
+
+
+def test_substring_match(name_index):
+    results = name_index.search('黄鱼')
+    assert (results[0]['name_cn'], results[0]['match']) == ('大黄鱼', SUBSTRING)
+
+
+def test_fuzzy_match_tolerates_typo(name_index):
+    results = name_index.search('carasius auratus')
+    assert (results[0]['name_cn'], results[0]['match'], results[0]['distance']) == ('鲫鱼', FUZZY, 1)
+    assert name_index.search('carasius auratus', fuzzy=False) == []
+
+
+def test_resolve(name_index):
+    assert name_index.resolve('Larimichthys crocea') is not None
+    assert name_index.resolve('不存在') is None
+
+
+def test_rebuild_picks_up_new_rows(db, name_index):
+    from model import FishType
+
+    assert name_index.search('草鱼') == []
+    db.session.add(FishType(name_cn='草鱼', name_latin='Ctenopharyngodon idella', description=''))
+    db.session.commit()
+    name_index.rebuild()
+    assert name_index.search('草鱼')[0]['match'] == EXACT
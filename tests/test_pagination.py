@@ -0,0 +1,117 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from utils.pagination import MAX_LIMIT, PaginationError, decode_cursor, encode_cursor, keyset_page, parse_fields, \
+    parse_limit
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 5, 1, 12, 30, 15, 123456)
+    assert decode_cursor(encode_cursor(created_at, 42)) == (created_at, 42)
+
+
+def test_invalid_cursor():
+    with pytest.raises(PaginationError):
+        decode_cursor('not-a-cursor')
+
+
+def test_parse_limit():
+    assert parse_limit('10') == 10
+    assert parse_limit(str(MAX_LIMIT + 1)) == MAX_LIMIT
+    for value in ('0', '-1', 'abc'):
+        with pytest.raises(PaginationError):
+            parse_limit(value)
+
+
+def test_parse_fields():
+    assert parse_fields('id, name', ('id', 'name', 'created_at')) == ['id', 'name']
+    assert parse_fields(None, ('id', 'name')) == ['id', 'name']
+    with pytest.raises(PaginationError):
+        parse_fields('password', ('id', 'name'))
+
+
+@pytest.fixture
+def records(db, make_user, make_fish):
+    from model import Fish, Record
+
+    user_id = make_user()
+    fish_type_id = db.session.get(Fish, make_fish()[0]).fish_type_id
+    start = datetime(2024, 1, 1)
+    # 每三条共用一个时间,翻页必须按 id 区分排序列相同的行;偶数条已审核
+    rows = [Record(user_id=user_id, image_url=f'https://example.com/r{i}.jpg', fish_type_id=fish_type_id,
+                   created_at=start + timedelta(minutes=i // 3),
+                   reviewed_at=start if i % 2 == 0 else None, is_approved=i % 2 == 0) for i in range(10)]
+    db.session.add_all(rows)
+    db.session.commit()
+    return sorted(rows, key=lambda row: (row.created_at, row.id), reverse=True)
+
+
+def test_keyset_page_visits_every_row_once(db, records):
+    from model import Record
+
+    query = db.session.query(Record.id, Record.created_at)
+    seen, cursor = [], None
+    while True:
+        rows, cursor = keyset_page(query, Record.created_at, Record.id, 4, cursor)
+        seen.extend(row.id for row in rows)
+        if cursor is None:
+            break
+    assert seen == [row.id for row in records]
+
+
+def fetch_all(client, url):
+    seen, cursor = [], None
+    while True:
+        body = client.get(url + (f'&cursor={cursor}' if cursor else '')).get_json()
+        assert body['success']
+        seen.extend(body['records'])
+        cursor = body['next_cursor']
+        if cursor is None:
+            return seen
+
+
+def test_records_endpoint_pages_with_projection(client, records):
+    seen = fetch_all(client, '/record/records?limit=3&fields=id,tags')
+    assert [item['id'] for item in seen] == [row.id for row in records]
+    assert all(set(item) == {'id', 'tags'} for item in seen)
+
+
+def test_pending_records_endpoint_filters(client, records):
+    seen = fetch_all(client, '/record/records/pending?limit=2&fields=id')
+    assert [item['id'] for item in seen] == [row.id for row in records if row.reviewed_at is None]
+
+
+def test_records_endpoint_rejects_bad_parameters(client, records):
+    assert client.get('/record/records?cursor=bogus').status_code == 400
+    assert client.get('/record/records?fields=password').status_code == 400
+    assert client.get('/record/records?status=unknown').status_code == 400
+
+
+def test_created_at_defaults_to_insert_time(client, db, make_user, make_fish):
+    from model import Fish, Record
+
+    user_id = make_user()
+    fish_type_id = db.session.get(Fish, make_fish()[0]).fish_type_id
+
+    def insert(name):
+        # 不指定 created_at,使用列的默认值
+        record = Record(user_id=user_id, image_url=f'https://example.com/{name}.jpg', fish_type_id=fish_type_id)
+        db.session.add(record)
+        db.session.commit()
+        return record
+
+    first = insert('first')
+    time.sleep(0.01)
+    boundary = datetime.now(timezone.utc).replace(tzinfo=None)
+    time.sleep(0.01)
+    later = [insert('second'), insert('third')]
+
+    assert first.created_at < boundary < later[0].created_at <= later[1].created_at
+    assert [item['id'] for item in fetch_all(client, '/record/records?limit=1&fields=id')] == \
+        [later[1].id, later[0].id, first.id]
+    assert [item['id'] for item in fetch_all(client, f'/record/records?fields=id&created_from={boundary.isoformat()}')] \
+        == [later[1].id, later[0].id]
+    assert [item['id'] for item in fetch_all(client, f'/record/records?fields=id&created_to={boundary.isoformat()}')] \
+        == [first.id]
@@ -0,0 +1,107 @@
+import os
+
+import numpy as np
+import pytest
+
+from service.quantization import Float16Index, PQIndex, ProductQuantizer
+from service.similarity_index import SimilarityIndex
+
+
+@pytest.fixture(scope='module')
+def gallery():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(2000, 64)).astype(np.float32)
+    queries = vectors[:100] + 0.1 * rng.normal(size=(100, 64)).astype(np.float32)
+    exact = SimilarityIndex()
+    exact.add(np.arange(2000), vectors)
+    return vectors, queries, exact.search_batch(queries, 5)
+
+
+def overlap(results, expected):
+    return np.mean([len({fish_id for fish_id, _ in r} & {fish_id for fish_id, _ in e}) / len(e)
+                    for r, e in zip(results, expected)])
+
+
+def vector_source(vectors):
+    def source(fish_ids):
+        fish_ids = np.asarray(fish_ids, dtype=np.int64)
+        return fish_ids, vectors[fish_ids]
+    return source
+
+
+def test_float16_matches_exact(gallery):
+    vectors, queries, expected = gallery
+    index = Float16Index()
+    index.add(np.arange(len(vectors)), vectors)
+    assert index.matrix.dtype == np.float16
+    assert overlap(index.search_batch(queries, 5), expected) >= 0.99
+
+
+def test_pq_recall(gallery):
+    vectors, queries, expected = gallery
+    index = PQIndex.build(np.arange(len(vectors)), vectors, n_subvectors=32)
+    assert index.matrix.dtype == np.uint8 and index.matrix.shape == (len(vectors), 32)
+    assert overlap(index.search_batch(queries, 5), expected) >= 0.75
+
+
+def test_pq_rerank_recall(gallery):
+    vectors, queries, expected = gallery
+    quantizer = PQIndex.build(np.arange(len(vectors)), vectors, n_subvectors=16).quantizer
+    index = PQIndex.build(np.arange(len(vectors)), vectors, quantizer=quantizer, rerank=50,
+                          vector_source=vector_source(vectors))
+    results = index.search_batch(queries, 5)
+    assert overlap(results, expected) >= 0.95
+    # 重排后的分数是精确的余弦相似度
+    np.testing.assert_allclose([score for _, score in results[0]],
+                               [score for _, score in expected[0]][:len(results[0])], rtol=1e-4)
+
+
+def test_codebook_save_load(gallery, tmp_path):
+    vectors, _, _ = gallery
+    quantizer = ProductQuantizer(n_subvectors=8)
+    quantizer.train(SimilarityIndex.normalize(vectors[:500]))
+    path = str(tmp_path / 'pq.npz')
+    quantizer.save(path)
+    loaded = ProductQuantizer.load(path)
+    assert (loaded.trained_count, loaded.dim) == (500, 64)
+    assert np.array_equal(loaded.encode(vectors[:10]), quantizer.encode(vectors[:10]))
+
+
+@pytest.fixture
+def pq_config(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'EMBEDDING_STORAGE', 'pq')
+    monkeypatch.setitem(app.config, 'PQ_SUBVECTORS', 8)
+    monkeypatch.setitem(app.config, 'SEARCH_RERANK', 0)
+    monkeypatch.setitem(app.config, 'SEARCH_SHARED', False)
+
+
+def test_codebook_retrained_after_gallery_doubles(fish_service, pq_config, gallery):
+    vectors, _, _ = gallery
+    ids = np.arange(len(vectors))
+    codebook_path = fish_service.artifact_path('pq-8.npz')
+
+    assert fish_service.load_pq_index(ids[:300], vectors[:300]).quantizer.trained_count == 300
+    saved_at = os.stat(codebook_path).st_mtime_ns
+    assert fish_service.load_pq_index(ids[:600], vectors[:600]).quantizer.trained_count == 300
+    assert os.stat(codebook_path).st_mtime_ns == saved_at
+    assert fish_service.load_pq_index(ids[:601], vectors[:601]).quantizer.trained_count == 601
+    assert ProductQuantizer.load(codebook_path).trained_count == 601
+
+
+def test_switches_to_pq_once_gallery_can_train_codebook(fish_service, pq_config, gallery):
+    vectors, _, _ = gallery
+    min_train_size = ProductQuantizer(n_subvectors=8).min_train_size
+    store = fish_service.embedding_store
+    store.put_many(list(range(min_train_size - 1)), [str(i) for i in range(min_train_size - 1)],
+                   vectors[:min_train_size - 1])
+
+    fish_ids, stored = store.get_vectors(list(range(min_train_size - 1)))
+    fish_service.fish_index = fish_service.load_exact_index(fish_ids, stored, refreshed_ids=[])
+    assert type(fish_service.fish_index) is SimilarityIndex
+
+    last = min_train_size - 1
+    store.put_many([last], [str(last)], vectors[last:last + 1])
+    fish_service.add_fish(last, str(last))
+    assert isinstance(fish_service.fish_index, PQIndex)
+    assert len(fish_service.fish_index) == min_train_size
+    assert fish_service.fish_index.search(vectors[3], top_k=1)[0][0] == 3
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+
+@pytest.fixture
+def history(db, make_user):
+    from model import SearchHistory
+
+    user_id = make_user()
+    start = datetime(2024, 1, 1)
+    # 每三条共用一个时间,翻页必须按 id 区分排序列相同的行
+    rows = [SearchHistory(user_id=user_id, search_method=1, search_content=f'q{i}',
+                          search_at=start + timedelta(minutes=i // 3)) for i in range(10)]
+    db.session.add_all(rows)
+    db.session.commit()
+    expected = [row.id for row in sorted(rows, key=lambda row: (row.search_at, row.id), reverse=True)]
+    return user_id, expected
+
+
+def test_search_history_endpoint_pages(client, history):
+    user_id, expected = history
+    seen, cursor = [], None
+    while True:
+        url = f'/record/search_history?user_id={user_id}&limit=3' + (f'&cursor={cursor}' if cursor else '')
+        body = client.get(url).get_json()
+        assert body['success']
+        seen.extend(item['id'] for item in body['search_history'])
+        cursor = body['next_cursor']
+        if cursor is None:
+            break
+    assert seen == expected
+
+
+def test_search_history_endpoint_rejects_bad_cursor(client, history):
+    user_id, _ = history
+    response = client.get(f'/record/search_history?user_id={user_id}&cursor=bogus')
+    assert response.status_code == 400
+
+
+def test_top_queries_aggregates_per_user_and_overall(db, make_user):
+    from service.search_history import record_search, top_queries
+
+    alice, bob = make_user('alice'), make_user('bob')
+    now = datetime.now(timezone.utc)
+    for user_id, content in ((alice, 'carp'), (alice, 'carp'), (alice, 'eel'), (bob, 'eel'), (bob, 'eel')):
+        record_search(user_id, 1, content, search_at=now)
+    # 时间窗口之外的搜索不计入
+    record_search(alice, 1, 'eel', search_at=now - timedelta(days=30))
+    db.session.commit()
+
+    assert [(row['search_content'], row['count']) for row in top_queries(user_id=alice)] == [('carp', 2), ('eel', 1)]
+    assert [(row['search_content'], row['count']) for row in top_queries()] == [('eel', 3), ('carp', 2)]
+    assert top_queries(search_method=0) == []
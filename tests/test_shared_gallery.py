@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+import pytest
+
+from service.shared_gallery import SharedGallery, SharedIndex
+from service.similarity_index import SimilarityIndex
+
+
+@pytest.fixture
+def vectors():
+    return SimilarityIndex.normalize(np.random.default_rng(0).normal(size=(50, 16)).astype(np.float32))
+
+
+def test_second_reader_follows_writer(tmp_path, vectors):
+    # 两个 SharedIndex 各自打开同一个目录,相当于两个 worker 进程
+    writer = SharedIndex(SharedGallery(str(tmp_path)))
+    reader = SharedIndex(SharedGallery(str(tmp_path)))
+    assert len(reader) == 0 and reader.search(vectors[0], top_k=1) == []
+
+    writer.gallery.publish(np.arange(40), vectors[:40])
+    assert len(reader) == 40
+    assert reader.generation == writer.generation
+    assert reader.search(vectors[7], top_k=1)[0][0] == 7
+
+    # 只追加时写到当前文件末尾
+    generation = reader.generation
+    writer.add([40, 41], vectors[40:42])
+    assert reader.generation > generation
+    assert reader.search(vectors[41], top_k=1)[0][0] == 41
+
+    # 替换已有的行和删除都会发布新文件
+    writer.add([7], vectors[45])
+    writer.remove([41, 3])
+    assert len(reader) == 40 and 3 not in reader
+    assert reader.search(vectors[45], top_k=1)[0][0] == 7
+    assert reader.generation == writer.generation
+
+
+def test_attach_matches_published_snapshot(tmp_path, vectors):
+    gallery = SharedGallery(str(tmp_path))
+    gallery.publish(np.arange(10), vectors[:10])
+    generation, ids, matrix = gallery.attach()
+    assert generation == gallery.read_current()['generation']
+    assert ids.tolist() == list(range(10))
+    np.testing.assert_array_equal(matrix, vectors[:10])
+
+
+def test_publish_keeps_recent_files_and_stale_reader_recovers(tmp_path, vectors):
+    gallery = SharedGallery(str(tmp_path))
+    gallery.publish(np.arange(5), vectors[:5])
+    stale = gallery.read_current()
+    for count in range(6, 6 + SharedGallery.KEEP_FILES + 1):
+        gallery.publish(np.arange(count), vectors[:count])
+
+    files = {name.split('.')[0] for name in os.listdir(str(tmp_path)) if name.startswith('gallery-')}
+    assert len(files) == SharedGallery.KEEP_FILES
+    assert stale['file'] not in files
+
+    # 读取 CURRENT.json 之后文件被删除时,重新读取最新的快照
+    generation, ids, _ = gallery.attach(stale)
+    assert generation == gallery.read_current()['generation']
+    assert len(ids) == 5 + SharedGallery.KEEP_FILES + 1
+
+
+def test_dimension_mismatch_is_rejected(tmp_path, vectors):
+    gallery = SharedGallery(str(tmp_path))
+    gallery.publish(np.arange(5), vectors[:5])
+    with pytest.raises(ValueError):
+        gallery.add([100], np.ones((1, 8), dtype=np.float32))
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from service.similarity_index import SimilarityIndex
+
+
+def brute_force(ids, vectors, queries, top_k):
+    # 逐条计算余弦相似度并完整排序,作为检索结果的参照
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    results = []
+    for query in queries:
+        scores = normalized @ (query / np.linalg.norm(query))
+        order = np.argsort(-scores)[:top_k]
+        results.append([(int(ids[i]), float(scores[i])) for i in order])
+    return results
+
+
+@pytest.fixture
+def gallery():
+    rng = np.random.default_rng(0)
+    ids = np.arange(100, 400, dtype=np.int64)
+    return ids, rng.normal(size=(ids.shape[0], 32)).astype(np.float32), rng.normal(size=(5, 32)).astype(np.float32)
+
+
+def assert_same_ranking(actual, expected):
+    assert [[fish_id for fish_id, _ in row] for row in actual] == [[fish_id for fish_id, _ in row] for row in expected]
+    for actual_row, expected_row in zip(actual, expected):
+        np.testing.assert_allclose([score for _, score in actual_row], [score for _, score in expected_row],
+                                   rtol=1e-5, atol=1e-6)
+
+
+def test_search_batch_matches_brute_force(gallery):
+    ids, vectors, queries = gallery
+    index = SimilarityIndex()
+    index.add(ids, vectors)
+    assert_same_ranking(index.search_batch(queries, top_k=5), brute_force(ids, vectors, queries, 5))
+    assert index.search(queries[0], top_k=5) == index.search_batch(queries[:1], top_k=5)[0]
+    assert len(index.search(queries[0])) == len(ids)
+    assert index.search(queries[0], top_k=0) == []
+
+
+def test_empty_index_returns_no_results():
+    assert SimilarityIndex(dim=8).search_batch(np.ones((2, 8), dtype=np.float32), top_k=3) == [[], []]
+
+
+def test_add_replaces_existing_ids_and_appends_new(gallery):
+    ids, vectors, queries = gallery
+    index = SimilarityIndex()
+    index.add(ids[:200], vectors[:200])
+    index.add(ids[150:], vectors[150:][::-1].copy())
+
+    expected_vectors = np.concatenate([vectors[:150], vectors[150:][::-1]])
+    assert len(index) == len(ids)
+    assert_same_ranking(index.search_batch(queries, top_k=10), brute_force(ids, expected_vectors, queries, 10))
+
+
+def test_remove_drops_ids(gallery):
+    ids, vectors, queries = gallery
+    index = SimilarityIndex()
+    index.add(ids, vectors)
+    removed = ids[::3]
+    index.remove(removed.tolist() + [-1])
+
+    keep = ~np.isin(ids, removed)
+    assert len(index) == int(keep.sum())
+    assert all(int(fish_id) not in index for fish_id in removed)
+    assert_same_ranking(index.search_batch(queries, top_k=5), brute_force(ids[keep], vectors[keep], queries, 5))
+
+    # 删除后追加的行写到新的缓冲区,不影响保留的行
+    index.add(removed[:2], vectors[:2])
+    assert int(removed[0]) in index and len(index) == int(keep.sum()) + 2
+
+
+def test_snapshot_is_not_modified_by_later_updates(gallery):
+    ids, vectors, _ = gallery
+    index = SimilarityIndex()
+    index.add(ids[:10], vectors[:10])
+    snapshot_ids, snapshot_matrix = index.ids, index.matrix.copy()
+    view_ids, view_matrix = index.ids, index.matrix
+
+    index.add(ids[:5], vectors[10:15])
+    index.remove(ids[5:7])
+    assert np.array_equal(view_ids, snapshot_ids)
+    assert np.array_equal(view_matrix, snapshot_matrix)
+
+
+def test_generation_changes_on_every_update(gallery):
+    ids, vectors, _ = gallery
+    index = SimilarityIndex()
+    generations = [index.generation]
+    index.add(ids[:10], vectors[:10])
+    generations.append(index.generation)
+    index.add(ids[:1], vectors[10:11])
+    generations.append(index.generation)
+    index.remove(ids[:1])
+    generations.append(index.generation)
+    assert len(set(generations)) == len(generations)
+
+    # 没有实际变化的删除不发布新快照
+    index.remove([-1])
+    assert index.generation == generations[-1]
+
+
+def test_dimension_mismatch_is_rejected(gallery):
+    ids, vectors, _ = gallery
+    index = SimilarityIndex()
+    index.add(ids[:3], vectors[:3])
+    with pytest.raises(ValueError):
+        index.add([999], np.ones((1, 16), dtype=np.float32))
@@ -0,0 +1,93 @@
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine, text
+
+from utils.sql_profiler import SQLBudgetExceeded, count_queries, install_sql_profiler, sql_budget
+
+
+def test_count_queries_counts_statements(db):
+    with count_queries() as counter:
+        db.session.execute(text('SELECT 1'))
+        db.session.execute(text('SELECT 2'))
+    assert counter.count == 2
+    assert counter.statements == ['SELECT 1', 'SELECT 2']
+
+
+def test_nested_counters(db):
+    with count_queries() as outer:
+        db.session.execute(text('SELECT 1'))
+        with count_queries() as inner:
+            db.session.execute(text('SELECT 2'))
+    assert (outer.count, inner.count) == (2, 1)
+
+
+def test_strict_mode_fails_over_budget():
+    app = Flask('budget_test')
+    app.config.update(TESTING=True, SQL_PROFILER_STRICT=True)
+    engine = create_engine('sqlite://')
+    install_sql_profiler(app)
+
+    @app.route('/within')
+    @sql_budget(1)
+    def within():
+        with engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+        return 'ok'
+
+    @app.route('/over')
+    @sql_budget(1)
+    def over():
+        with engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+            connection.execute(text('SELECT 2'))
+        return 'ok'
+
+    client = app.test_client()
+    response = client.get('/within')
+    assert response.status_code == 200
+    assert 'desc="1 queries"' in response.headers['Server-Timing']
+    with pytest.raises(SQLBudgetExceeded):
+        client.get('/over')
+
+
+def test_get_favorites_within_budget(client, db, make_fish):
+    from model import Favorite, Fish
+
+    fish_ids = make_fish(3)
+    user_id = db.session.get(Fish, fish_ids[0]).uploaded_by
+    db.session.add_all([Favorite(user_id=user_id, fish_id=fish_id) for fish_id in fish_ids])
+    db.session.commit()
+
+    with count_queries() as counter:
+        response = client.get(f'/favorites/?user_id={user_id}')
+    assert response.status_code == 200
+    assert len(response.get_json()['favorites']) == 3
+    assert counter.count == 1, counter.statements
+
+
+def test_add_favorite_within_budget_and_rejects_duplicate(client, make_fish, make_user):
+    fish_id = make_fish()[0]
+    user_id = make_user('bob')
+
+    response = client.post('/favorites/', json={'user_id': user_id, 'fish_id': fish_id})
+    assert response.status_code == 200
+    assert response.get_json()['favorite_info']['fish_id'] == fish_id
+
+    response = client.post('/favorites/', json={'user_id': user_id, 'fish_id': fish_id})
+    assert response.status_code == 423
+
+
+def test_user_records_within_budget(client, db, make_fish, make_user):
+    from model import Fish, Record
+
+    fish_type_id = db.session.get(Fish, make_fish()[0]).fish_type_id
+    user_id = make_user('carol')
+    db.session.add_all([Record(user_id=user_id, image_url=f'https://example.com/r{i}.jpg', fish_type_id=fish_type_id)
+                        for i in range(5)])
+    db.session.commit()
+
+    with count_queries() as counter:
+        response = client.post('/record/records/user', json={'id': user_id})
+    assert response.status_code == 200
+    assert len(response.get_json()['records']) == 5
+    assert counter.count == 1, counter.statements
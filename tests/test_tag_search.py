@@ -0,0 +1,57 @@
+import pytest
+
+from service.tag_search import MATCH_EXACT, OPERATOR_AND, parse_tags, search_fish_ids, set_fish_tags
+
+
+def test_parse_tags_normalizes_and_deduplicates():
+    assert parse_tags(' Red, blue，red、Deep Sea ;') == ['red', 'blue', 'deep sea']
+    assert parse_tags(None) == []
+
+
+@pytest.fixture
+def tagged_fish(db, make_fish):
+    # 标签直接写入 fish_tag,与 Fish.tags 字符串保持一致
+    tags = ['red, sea', 'red, river', 'blue, sea', 'reef']
+    fish_ids = [make_fish(tags=text)[0] for text in tags]
+    set_fish_tags(list(zip(fish_ids, tags)))
+    db.session.commit()
+    return fish_ids
+
+
+def test_exact_or_ranks_by_matched_terms(tagged_fish):
+    red_sea, red_river, blue_sea, _ = tagged_fish
+    results = search_fish_ids(['red', 'sea'], match=MATCH_EXACT)
+    assert results[0] == (red_sea, 2)
+    assert set(results[1:]) == {(red_river, 1), (blue_sea, 1)}
+
+
+def test_exact_and_requires_every_term(tagged_fish):
+    red_sea = tagged_fish[0]
+    assert search_fish_ids(['red', 'sea'], match=MATCH_EXACT, operator=OPERATOR_AND) == [(red_sea, 2)]
+    assert search_fish_ids(['red', 'missing'], match=MATCH_EXACT, operator=OPERATOR_AND) == []
+
+
+def test_prefix_match(tagged_fish):
+    red_sea, red_river, _, reef = tagged_fish
+    assert {fish_id for fish_id, _ in search_fish_ids(['re'])} == {red_sea, red_river, reef}
+
+
+def test_prefix_escapes_like_wildcards(db, make_fish):
+    plain = make_fish(tags='ab')[0]
+    wildcard = make_fish(tags='a%b')[0]
+    set_fish_tags([(plain, 'ab'), (wildcard, 'a%b')])
+    db.session.commit()
+    assert search_fish_ids(['a%']) == [(wildcard, 1)]
+
+
+def test_set_fish_tags_replaces_previous_tags(db, tagged_fish):
+    red_sea = tagged_fish[0]
+    set_fish_tags([(red_sea, 'green')])
+    db.session.commit()
+    assert red_sea not in {fish_id for fish_id, _ in search_fish_ids(['red'], match=MATCH_EXACT)}
+    assert search_fish_ids(['green'], match=MATCH_EXACT) == [(red_sea, 1)]
+
+
+def test_rejects_unknown_mode():
+    with pytest.raises(ValueError):
+        search_fish_ids(['red'], match='regex')
@@ -1,6 +1,12 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
 import oss2
 from flask import current_app
 
+# OSS 要求除最后一个分片外,每个分片不小于 100 KB
+MIN_PART_SIZE = 100 * 1024
+
 class OSSClient:
     __instance = None
 
@@ -17,6 +23,11 @@ class OSSClient:
             self.auth = oss2.Auth(current_app.config['ACCESS_KEY_ID'], current_app.config['ACCESS_KEY_SECRET'])
             self.bucket = oss2.Bucket(self.auth, current_app.config['ENDPOINT'], current_app.config['BUCKET_NAME'])
             self.image_url_template = f'https://{current_app.config["BUCKET_NAME"]}.{current_app.config["ENDPOINT"]}/{{file_path}}'
+            # 超过 multipart_threshold 的文件按 part_size 分片,由 upload_threads 个线程并行上传
+            self.multipart_threshold = current_app.config.get('OSS_MULTIPART_THRESHOLD_MB', 8) * 1024 * 1024
+            self.part_size = max(MIN_PART_SIZE, int(current_app.config.get('OSS_PART_SIZE_MB', 2) * 1024 * 1024))
+            self.upload_threads = max(1, current_app.config.get('OSS_UPLOAD_THREADS', 4))
+            self.checkpoint_dir = current_app.config.get('UPLOAD_STAGING_DIR', 'uploads/staging')
 
             OSSClient.__instance = self
 
@@ -30,6 +41,92 @@ class OSSClient:
         except oss2.exceptions.OssError as e:
             raise Exception(f"Error uploading file to OSS: {e}")
 
+    def upload_stream(self, file_path, stream, size=None):
+        """
+        从文件对象中逐块读取并上传,不把整个文件读入内存
+
+        小于 multipart_threshold 的文件用一次 PUT 流式上传;更大或大小未知的文件用分片上传,
+        最多 upload_threads 个分片同时上传,内存占用不超过 (upload_threads + 1) * part_size。
+
+        参数:
+        file_path (str): OSS 中的文件路径
+        stream: 可读的文件对象,例如请求中上传文件的 stream
+        size (int): 文件大小 (字节),未知时为 None
+
+        返回:
+        str: 文件的访问地址
+        """
+        try:
+            if size is not None and size < self.multipart_threshold:
+                self.bucket.put_object(file_path, stream)
+            else:
+                self._upload_parts(file_path, stream)
+            return self.get_image_url(file_path)
+        except oss2.exceptions.OssError as e:
+            raise Exception(f"Error uploading file to OSS: {e}")
+
+    def _upload_parts(self, file_path, stream):
+        upload_id = self.bucket.init_multipart_upload(file_path).upload_id
+        try:
+            parts, pending = [], set()
+            with ThreadPoolExecutor(max_workers=self.upload_threads) as executor:
+                part_number = 1
+                while True:
+                    data = self._read_part(stream)
+                    if not data:
+                        break
+                    # 上传中的分片达到上限时,等其中一个完成再读取下一个分片
+                    if len(pending) >= self.upload_threads:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        parts.extend(future.result() for future in done)
+                    pending.add(executor.submit(self._upload_part, file_path, upload_id, part_number, data))
+                    part_number += 1
+                parts.extend(future.result() for future in pending)
+            self.bucket.complete_multipart_upload(file_path, upload_id,
+                                                  sorted(parts, key=lambda part: part.part_number))
+        except Exception:
+            try:
+                self.bucket.abort_multipart_upload(file_path, upload_id)
+            except oss2.exceptions.OssError:
+                # 保留原始错误,没有取消的分片由 bucket 的生命周期规则清理
+                pass
+            raise
+
+    def _read_part(self, stream):
+        # 管道、socket 等流的一次 read 可能少于请求的字节数,除最后一个分片外每个分片都必须达到 part_size
+        chunks, size = [], 0
+        while size < self.part_size:
+            chunk = stream.read(self.part_size - size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+        return b''.join(chunks)
+
+    def _upload_part(self, file_path, upload_id, part_number, data):
+        result = self.bucket.upload_part(file_path, upload_id, part_number, data)
+        return oss2.models.PartInfo(part_number, result.etag, size=len(data))
+
+    def upload_local_file(self, file_path, local_path):
+        """
+        断点续传本地文件,已上传的分片记录在 checkpoint_dir 中,上传中断后再次调用只上传缺失的分片
+
+        参数:
+        file_path (str): OSS 中的文件路径
+        local_path (str): 本地文件路径
+
+        返回:
+        str: 文件的访问地址
+        """
+        try:
+            oss2.resumable_upload(self.bucket, file_path, local_path,
+                                  store=oss2.ResumableStore(root=os.path.abspath(self.checkpoint_dir)),
+                                  multipart_threshold=self.multipart_threshold, part_size=self.part_size,
+                                  num_threads=self.upload_threads)
+            return self.get_image_url(file_path)
+        except oss2.exceptions.OssError as e:
+            raise Exception(f"Error uploading file to OSS: {e}")
+
     def delete_file(self, file_path):
         try:
             self.bucket.delete_object(file_path)
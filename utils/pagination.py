@@ -0,0 +1,142 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Query
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+class PaginationError(ValueError):
+    """
+    分页、投影或过滤参数不合法,控制器应返回 400
+    """
+
+
+def encode_cursor(sort_value: Any, row_id: int) -> str:
+    """
+    将一页最后一行的 (排序列, id) 编码为不透明的游标字符串
+    """
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, row_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    解析 encode_cursor 生成的游标,排序列为时间
+
+    返回:
+    Tuple[datetime, int]: (排序列的值, id)
+    """
+    try:
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(sort_value), int(row_id)
+    except (ValueError, TypeError):
+        raise PaginationError(f'Invalid cursor: {cursor}')
+
+
+def parse_limit(value: Optional[str]) -> int:
+    """
+    解析 limit 参数,默认 DEFAULT_LIMIT,最大 MAX_LIMIT
+    """
+    if value is None or value == '':
+        return DEFAULT_LIMIT
+    try:
+        limit = int(value)
+    except ValueError:
+        raise PaginationError(f'Invalid limit: {value}')
+    if limit <= 0:
+        raise PaginationError(f'Invalid limit: {value}')
+    return min(limit, MAX_LIMIT)
+
+
+def parse_fields(value: Optional[str], allowed: Sequence[str]) -> List[str]:
+    """
+    解析逗号分隔的 fields 参数,为空时返回全部字段
+
+    参数:
+    value (str): 请求中的 fields 参数
+    allowed (Sequence[str]): 允许投影的字段,按输出顺序排列
+
+    返回:
+    List[str]: 请求的字段列表
+    """
+    if not value:
+        return list(allowed)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise PaginationError(f'Unknown fields: {", ".join(unknown)}')
+    return fields
+
+
+def parse_datetime(value: Optional[str], name: str) -> Optional[datetime]:
+    """
+    解析 ISO 8601 格式的日期或时间参数
+    """
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise PaginationError(f'Invalid {name}: {value}')
+
+
+def keyset_query(query: Query, sort_column, id_column, cursor: Optional[str] = None) -> Query:
+    """
+    按 (sort_column, id_column) 倒序排列,并从游标位置之后开始
+
+    参数:
+    query (Query): 已经应用过滤条件的查询
+    sort_column: 排序列
+    id_column: 主键列
+    cursor (str): encode_cursor 生成的游标,为空时从头开始
+
+    返回:
+    Query: 排序并过滤后的查询
+    """
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor)
+        query = query.filter(or_(sort_column < sort_value, and_(sort_column == sort_value, id_column < row_id)))
+    return query.order_by(sort_column.desc(), id_column.desc())
+
+
+def keyset_page(query: Query, sort_column, id_column, limit: int,
+                cursor: Optional[str] = None) -> Tuple[list, Optional[str]]:
+    """
+    按 (sort_column, id_column) 倒序做键集分页
+
+    与 OFFSET 分页不同,无论翻到第几页,数据库都只需从索引中定位到游标位置再读取 limit 行。
+    query 中必须包含 sort_column 和 id_column 两列。
+
+    参数:
+    query (Query): 已经应用过滤条件的查询
+    sort_column: 排序列,例如 Record.created_at
+    id_column: 主键列,排序列相同时用于确定先后
+    limit (int): 每页行数
+    cursor (str): 上一页返回的 next_cursor,为空时从第一页开始
+
+    返回:
+    Tuple[list, Optional[str]]: (本页的行, 下一页的游标,没有更多数据时为 None)
+    """
+    # 多取一行,用来判断是否还有下一页
+    rows = keyset_query(query, sort_column, id_column, cursor).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]._mapping
+    return rows, encode_cursor(last[sort_column.key], last[id_column.key])
+
+
+def row_to_dict(row, fields: Sequence[str]) -> Dict[str, Any]:
+    """
+    将投影查询的结果行转换为字典,只保留请求的字段,时间统一转换为 ISO 8601 格式
+    """
+    mapping = row._mapping
+    return {field: mapping[field].isoformat() if isinstance(mapping[field], datetime) else mapping[field]
+            for field in fields}
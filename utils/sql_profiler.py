@@ -0,0 +1,136 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from flask import Flask, Response, current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# 当前上下文中正在计数的 QueryCounter,可以嵌套 (请求级计数器内再用 count_queries 统计一段代码)
+_active_counters: ContextVar[Tuple['QueryCounter', ...]] = ContextVar('sql_query_counters', default=())
+
+
+class SQLBudgetExceeded(AssertionError):
+    """
+    接口执行的 SQL 语句数超过了 sql_budget 声明的上限,只在 SQL_PROFILER_STRICT 开启时抛出
+    """
+
+
+class QueryCounter:
+    """
+    统计一段时间内执行的 SQL 语句数和数据库耗时
+    """
+
+    def __init__(self, keep_statements: bool = False):
+        """
+        参数:
+        keep_statements (bool): 是否保留每条语句的文本,便于定位多余的查询
+        """
+        self.count = 0
+        self.duration = 0.0
+        self.statements: Optional[List[str]] = [] if keep_statements else None
+
+    def record(self, statement: str, duration: float):
+        self.count += 1
+        self.duration += duration
+        if self.statements is not None:
+            self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(keep_statements: bool = True) -> Iterator[QueryCounter]:
+    """
+    统计 with 块内当前线程执行的 SQL 语句,用于在测试中断言语句数
+
+        with count_queries() as counter:
+            client.get('/favorites/?user_id=1')
+        assert counter.count <= 1, counter.statements
+    """
+    counter = QueryCounter(keep_statements)
+    token = _active_counters.set(_active_counters.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        _active_counters.reset(token)
+
+
+def sql_budget(max_statements: int) -> Callable:
+    """
+    声明视图函数最多执行的 SQL 语句数,超出时记录警告,SQL_PROFILER_STRICT 开启时抛出 SQLBudgetExceeded
+
+    参数:
+    max_statements (int): 语句数上限
+    """
+    def decorator(view: Callable) -> Callable:
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            g.sql_budget = max_statements
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active_counters.get():
+        conn.info.setdefault('sql_profiler_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    counters = _active_counters.get()
+    if not counters:
+        return
+    starts = conn.info.get('sql_profiler_start')
+    duration = time.perf_counter() - starts.pop() if starts else 0.0
+    for counter in counters:
+        counter.record(statement, duration)
+
+
+def install_sql_profiler(app: Flask):
+    """
+    为每个请求统计执行的 SQL 语句数和数据库耗时
+
+    - 响应头 Server-Timing 中给出 db 的耗时和语句数,浏览器开发者工具中可以直接看到
+    - 每个请求在 DEBUG 级别记录一行日志,超出 sql_budget 时记录 WARNING
+    - SQL_PROFILER_STRICT 开启时 (测试环境) 超出预算的请求抛出 SQLBudgetExceeded
+
+    监听的是 Engine 类上的事件,主库和只读副本的连接都会被统计。
+    流式响应在 after_request 之后才读取的行不计入。
+
+    参数:
+    app (Flask): Flask 应用
+    """
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_sql_counter():
+        g.sql_counter = QueryCounter(keep_statements=app.config.get('SQL_PROFILER_STRICT', False))
+        g.sql_counter_token = _active_counters.set(_active_counters.get() + (g.sql_counter,))
+
+    @app.after_request
+    def report_sql_counter(response: Response) -> Response:
+        counter = g.get('sql_counter')
+        if counter is None:
+            return response
+        duration_ms = counter.duration * 1000
+        response.headers.add('Server-Timing', f'db;dur={duration_ms:.2f};desc="{counter.count} queries"')
+
+        budget = g.get('sql_budget')
+        message = f'{request.method} {request.path} ({request.endpoint}): {counter.count} SQL statements, ' \
+                  f'{duration_ms:.2f} ms'
+        if budget is not None and counter.count > budget:
+            current_app.logger.warning(f'{message}, over budget of {budget}')
+            if app.config.get('SQL_PROFILER_STRICT', False):
+                raise SQLBudgetExceeded(f'{message}, over budget of {budget}:\n' + '\n'.join(counter.statements))
+        else:
+            current_app.logger.debug(message)
+        return response
+
+    @app.teardown_request
+    def stop_sql_counter(exception=None):
+        token = g.pop('sql_counter_token', None)
+        if token is not None:
+            _active_counters.reset(token)
@@ -0,0 +1,108 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict
+
+from flask import Response, current_app, request, stream_with_context
+from sqlalchemy.orm import Query
+
+# 每次从数据库游标取出的行数
+YIELD_PER = 500
+# 每次写给客户端的行数
+CHUNK_ROWS = 100
+
+
+def wants_ndjson() -> bool:
+    """
+    请求参数 format=ndjson 或 Accept 首选 application/x-ndjson 时,以每行一个 JSON 对象的形式返回
+    """
+    return request.args.get('format') == 'ndjson' or \
+        request.accept_mimetypes.best == 'application/x-ndjson'
+
+
+def wants_stream() -> bool:
+    """
+    请求参数 stream=true 或要求 NDJSON 时,不分页,以流的形式返回全部结果
+    """
+    return request.args.get('stream', '').lower() in ('1', 'true') or wants_ndjson()
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def render_rows(query: Query, serialize: Callable[[Any], Dict[str, Any]], key: str, message: str) -> Response:
+    """
+    与 stream_rows 输出相同结构的内容,但先读取全部结果再一次性生成响应体,用于需要写入响应缓存的小结果集。
+    查询出错时直接抛出异常,不会生成带 error 字段的响应
+
+    参数:
+    query (Query): 待执行的查询
+    serialize (Callable): 将一行结果转换为字典
+    key (str): JSON 对象中结果数组的字段名
+    message (str): 状态消息
+
+    返回:
+    Response: 完整的响应
+    """
+    items = [serialize(row) for row in query]
+    if wants_ndjson():
+        return Response(''.join(json.dumps(item, default=_json_default) + '\n' for item in items),
+                        mimetype='application/x-ndjson')
+    return Response(json.dumps({'message': message, 'success': True, key: items}, default=_json_default),
+                    mimetype='application/json')
+
+
+def stream_rows(query: Query, serialize: Callable[[Any], Dict[str, Any]], key: str, message: str) -> Response:
+    """
+    从服务端游标逐批读取查询结果并以流的形式写出,内存占用与结果行数无关
+
+    默认输出与 jsonify 相同结构的 JSON 对象 {"message": ..., "success": true, key: [...]},
+    数组元素逐块写出;要求 NDJSON 时每行输出一个 JSON 对象。
+    响应头发出之后无法再修改状态码,中途出错时在 JSON 末尾追加 error 字段 (NDJSON 追加一行 error 对象)。
+
+    参数:
+    query (Query): 待执行的查询
+    serialize (Callable): 将一行结果转换为字典
+    key (str): JSON 对象中结果数组的字段名
+    message (str): 状态消息
+
+    返回:
+    Response: 流式响应
+    """
+    ndjson = wants_ndjson()
+    # yield_per 会同时开启 stream_results,MySQL 驱动使用服务端游标,不会一次性把结果集读入内存
+    rows = query.execution_options(yield_per=YIELD_PER)
+
+    def generate():
+        if not ndjson:
+            yield json.dumps({'message': message, 'success': True})[:-1] + f', "{key}": ['
+        chunk, first = [], True
+        try:
+            for row in rows:
+                item = json.dumps(serialize(row), default=_json_default)
+                if ndjson:
+                    chunk.append(item + '\n')
+                else:
+                    chunk.append(item if first else ',' + item)
+                    first = False
+                if len(chunk) >= CHUNK_ROWS:
+                    yield ''.join(chunk)
+                    chunk = []
+            if chunk:
+                yield ''.join(chunk)
+            if not ndjson:
+                yield ']}'
+        except Exception as e:
+            current_app.logger.error(f'Streaming {key} failed: {e}')
+            if chunk:
+                yield ''.join(chunk)
+            error = json.dumps({'error': str(e)})
+            yield error + '\n' if ndjson else '], ' + error[1:]
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson' if ndjson else 'application/json')